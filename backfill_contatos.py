@@ -0,0 +1,21 @@
+# =========================================================
+# 👥 BACKFILL DA TABELA DE CONTATOS (contacts)
+# =========================================================
+# Recalcula uma linha por (bot_id, telegram_id) a partir de leads e pedidos.
+# O startup já faz a primeira carga sozinho (uma vez por banco, em segundo
+# plano); rode à mão para corrigir divergências:
+#
+#   python backfill_contatos.py            # todos os bots
+#   python backfill_contatos.py 12 15      # apenas os bots 12 e 15
+
+import sys
+import logging
+
+from contatos import executar_backfill_contatos
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    bots = [int(b) for b in sys.argv[1:]] or None
+    print(f"🔄 Reconstruindo contatos ({'bots ' + ', '.join(map(str, bots)) if bots else 'todos os bots'})...")
+    total = executar_backfill_contatos(bots)
+    print(f"✅ {total} contatos gravados em contacts")
@@ -0,0 +1,181 @@
+# =========================================================
+# 📊 BACKFILL DO ROLLUP DIÁRIO (daily_bot_metrics)
+# =========================================================
+# Reconstrói os contadores diários a partir de pedidos, leads e logs de
+# remarketing. Rode após o deploy que criou a tabela ou sempre que quiser
+# corrigir divergências:
+#
+#   python backfill_metricas.py            # todos os bots
+#   python backfill_metricas.py 12 15      # apenas os bots 12 e 15
+#
+# No Postgres a tabela fica travada (EXCLUSIVE) durante a reconstrução: as
+# gravações ao vivo esperam e somam por cima do resultado, sem perder eventos.
+# Rode como comando de pré-deploy ou fora do pico.
+#
+# O startup NÃO trava a tabela: backfill_se_pendente() roda uma única vez por
+# banco (marcador em system_config), em segundo plano, bot a bot. No Postgres
+# cada bot é recalculado sob pg_advisory_xact_lock(METRICAS_LOCK_CLASSE, bot);
+# o listener do rollup pega a mesma trava compartilhada antes de somar, então
+# um evento entra no cálculo ou soma por cima do resultado, nunca se perde.
+
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import func, text
+
+from database import SessionJobs, engine, Bot, Pedido, Lead, RemarketingLog, DailyBotMetrics
+from migrations import carga_concluida, executar_carga_unica
+
+logger = logging.getLogger(__name__)
+
+METRICAS_LOCK_CLASSE = 724_003  # (classe, bot_id): backfill exclusivo, listener compartilhado
+BACKFILL_METRICAS_CHAVE = "backfill_metricas_diarias_concluido"
+
+SQL_TRAVAR_METRICAS_BOT = text("SELECT pg_advisory_xact_lock(:classe, :bot_id)")
+
+CAMPOS = ("leads", "pix_generated", "sales", "revenue_cents", "remarketing_sent", "remarketing_converted")
+STATUS_VENDA_HISTORICO = ('approved', 'paid', 'active', 'expired')
+
+def _dia(valor):
+    if isinstance(valor, str):
+        return datetime.strptime(valor[:10], "%Y-%m-%d").date()
+    if isinstance(valor, datetime):
+        return valor.date()
+    return valor
+
+SQL_SUBSTITUIR_METRICAS = text(f"""
+    INSERT INTO daily_bot_metrics (bot_id, day, {", ".join(CAMPOS)})
+    VALUES (:bot_id, :day, {", ".join(":" + c for c in CAMPOS)})
+    ON CONFLICT (bot_id, day) DO UPDATE SET
+    {", ".join(f"{c} = excluded.{c}" for c in CAMPOS)}
+""")
+
+def _calcular_metricas(db, bots_ids=None):
+    """Agrega o histórico em {(bot_id, dia): {campo: valor}}."""
+    linhas = {}
+
+    def somar(bot_id, dia, campo, valor):
+        if bot_id is None or dia is None:
+            return
+        chave = (bot_id, _dia(dia))
+        linhas.setdefault(chave, dict.fromkeys(CAMPOS, 0))[campo] += int(valor or 0)
+
+    def filtrar(query, coluna_bot):
+        return query.filter(coluna_bot.in_(bots_ids)) if bots_ids else query
+
+    # Leads por dia de criação
+    dia_lead = func.date(Lead.created_at)
+    for bot_id, dia, total in filtrar(
+        db.query(Lead.bot_id, dia_lead, func.count(Lead.id)), Lead.bot_id
+    ).group_by(Lead.bot_id, dia_lead).all():
+        somar(bot_id, dia, "leads", total)
+
+    # Cada pedido é um PIX gerado
+    dia_pedido = func.date(Pedido.created_at)
+    for bot_id, dia, total in filtrar(
+        db.query(Pedido.bot_id, dia_pedido, func.count(Pedido.id)), Pedido.bot_id
+    ).group_by(Pedido.bot_id, dia_pedido).all():
+        somar(bot_id, dia, "pix_generated", total)
+
+    # Vendas no dia da aprovação (inclusive as que já expiraram)
+    dia_venda = func.date(func.coalesce(Pedido.data_aprovacao, Pedido.created_at))
+    for bot_id, dia, total, soma in filtrar(
+        db.query(Pedido.bot_id, dia_venda, func.count(Pedido.id), func.sum(func.round(Pedido.valor * 100))),
+        Pedido.bot_id
+    ).filter(Pedido.status.in_(STATUS_VENDA_HISTORICO)).group_by(Pedido.bot_id, dia_venda).all():
+        somar(bot_id, dia, "sales", total)
+        somar(bot_id, dia, "revenue_cents", soma)
+
+    # Remarketing enviado / convertido
+    dia_envio = func.date(RemarketingLog.sent_at)
+    for bot_id, dia, total in filtrar(
+        db.query(RemarketingLog.bot_id, dia_envio, func.count(RemarketingLog.id)), RemarketingLog.bot_id
+    ).filter(RemarketingLog.status == 'sent').group_by(RemarketingLog.bot_id, dia_envio).all():
+        somar(bot_id, dia, "remarketing_sent", total)
+
+    dia_conversao = func.date(RemarketingLog.converted_at)
+    for bot_id, dia, total in filtrar(
+        db.query(RemarketingLog.bot_id, dia_conversao, func.count(RemarketingLog.id)), RemarketingLog.bot_id
+    ).filter(RemarketingLog.converted == True).group_by(RemarketingLog.bot_id, dia_conversao).all():
+        somar(bot_id, dia, "remarketing_converted", total)
+
+    return linhas
+
+def executar_backfill_metricas(bots_ids=None):
+    """
+    Recalcula daily_bot_metrics (para os bots informados ou para todos).
+    Retorna a quantidade de linhas (bot, dia) gravadas.
+    """
+    db = SessionJobs()
+    try:
+        if engine.dialect.name == "postgresql":
+            db.execute(text("LOCK TABLE daily_bot_metrics IN EXCLUSIVE MODE"))
+
+        linhas = _calcular_metricas(db, bots_ids)
+
+        # Substitui o rollup (dos bots escolhidos) pelo recalculado
+        query = db.query(DailyBotMetrics)
+        if bots_ids:
+            query = query.filter(DailyBotMetrics.bot_id.in_(bots_ids))
+        query.delete(synchronize_session=False)
+        db.bulk_insert_mappings(DailyBotMetrics, [
+            {"bot_id": bot_id, "day": dia, **valores} for (bot_id, dia), valores in linhas.items()
+        ])
+        db.commit()
+
+        logger.info(f"📊 [BACKFILL] {len(linhas)} linhas de métricas diárias reconstruídas")
+        return len(linhas)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def executar_backfill_metricas_por_bot():
+    """
+    Preenche daily_bot_metrics sem travar a tabela: calcula e grava um bot por
+    vez (upsert por bot/dia) em transações curtas. Retorna as linhas gravadas;
+    se algum bot falhar, os demais seguem e no fim levanta RuntimeError.
+    """
+    db = SessionJobs()
+    try:
+        bots_ids = [bot_id for (bot_id,) in db.query(Bot.id).order_by(Bot.id).all()]
+    finally:
+        db.close()
+
+    total, falhas = 0, []
+    for bot_id in bots_ids:
+        db = SessionJobs()
+        try:
+            if engine.dialect.name == "postgresql":
+                # Espera os flushes em andamento deste bot; os novos esperam o commit
+                db.execute(SQL_TRAVAR_METRICAS_BOT, {"classe": METRICAS_LOCK_CLASSE, "bot_id": bot_id})
+            linhas = _calcular_metricas(db, [bot_id])
+            if linhas:
+                db.execute(SQL_SUBSTITUIR_METRICAS, [
+                    {"bot_id": b, "day": dia, **valores} for (b, dia), valores in linhas.items()
+                ])
+            db.commit()
+            total += len(linhas)
+        except Exception as e:
+            db.rollback()
+            falhas.append(bot_id)
+            logger.error(f"❌ [BACKFILL] Erro nas métricas do bot {bot_id}: {e}")
+        finally:
+            db.close()
+
+    logger.info(f"📊 [BACKFILL] {total} linhas de métricas diárias gravadas (bot a bot)")
+    if falhas:
+        raise RuntimeError(f"backfill incompleto, bots com erro: {falhas}")
+    return total
+
+def backfill_se_pendente():
+    """Usado no startup (em segundo plano): preenche o rollup uma única vez por banco."""
+    return executar_carga_unica(BACKFILL_METRICAS_CHAVE, executar_backfill_metricas_por_bot)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    bots = [int(b) for b in sys.argv[1:]] or None
+    print(f"🔄 Reconstruindo métricas diárias ({'bots ' + ', '.join(map(str, bots)) if bots else 'todos os bots'})...")
+    total = executar_backfill_metricas(bots)
+    print(f"✅ {total} linhas gravadas em daily_bot_metrics")
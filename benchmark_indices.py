@@ -0,0 +1,252 @@
+# =========================================================
+# 🔬 BENCHMARK DE ÍNDICES (EXPLAIN DAS CONSULTAS QUENTES)
+# =========================================================
+# Monta um banco com dados sintéticos, roda EXPLAIN em cada consulta quente
+# e confere se o índice esperado aparece no plano:
+#
+#   python benchmark_indices.py                          # SQLite temporário
+#   python benchmark_indices.py postgresql://.../scratch  # Postgres VAZIO de teste
+#   python benchmark_indices.py --linhas 200000           # volume de pedidos/leads/logs
+#
+# Sai com código 1 se alguma consulta não usar o índice. Nunca aponte para o
+# banco de produção: o script recusa bancos que já tenham pedidos.
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+
+from database import Base
+
+logger = logging.getLogger(__name__)
+
+BOTS = 200
+PASSOS_POR_BOT = 10
+PASTAS = 50
+LINKS_POR_BOT = 10
+LOTE = 5000
+
+# (descrição, índice esperado, SQL, parâmetros)
+CONSULTAS_QUENTES = [
+    (
+        "Pedidos do usuário no bot",
+        "ix_pedidos_bot_telegram_status",
+        "SELECT id, status FROM pedidos WHERE bot_id = :bot AND telegram_id = :tg AND status = 'pending'",
+        {"bot": 7, "tg": "100042"},
+    ),
+    (
+        "Webhook: pedido pela transação",
+        "ix_pedidos_transaction_id",
+        "SELECT id FROM pedidos WHERE transaction_id = :tx",
+        {"tx": "tr-123"},
+    ),
+    (
+        "Vendas aprovadas no período",
+        "ix_pedidos_status_data_aprovacao",
+        "SELECT COUNT(id), SUM(valor) FROM pedidos WHERE status = 'paid' AND data_aprovacao >= :desde",
+        {"desde": "AGORA-1"},
+    ),
+    (
+        "Vendas do bot no período (parcial)",
+        "ix_pedidos_vendas_bot_aprovacao",
+        "SELECT COUNT(id), SUM(valor) FROM pedidos "
+        "WHERE bot_id = :bot AND status IN ('paid', 'approved', 'active') AND data_aprovacao >= :desde",
+        {"bot": 7, "desde": "AGORA-7"},
+    ),
+    (
+        "Assinantes ativos do bot (parcial)",
+        "ix_pedidos_vendas_bot_expiracao",
+        "SELECT COUNT(id) FROM pedidos "
+        "WHERE bot_id = :bot AND status IN ('paid', 'approved', 'active') AND data_expiracao > :agora",
+        {"bot": 7, "agora": "AGORA"},
+    ),
+    (
+        "Motor de expiração",
+        "ix_pedidos_status_data_expiracao",
+        "SELECT id FROM pedidos WHERE status = 'active' AND data_expiracao <= :agora",
+        {"agora": "AGORA-20"},
+    ),
+    (
+        "Lead do usuário no bot",
+        "ix_leads_bot_user",
+        "SELECT id FROM leads WHERE user_id = :tg AND bot_id = :bot",
+        {"bot": 7, "tg": "100042"},
+    ),
+    (
+        "Leads recentes do bot",
+        "ix_leads_bot_created_at",
+        "SELECT id FROM leads WHERE bot_id = :bot ORDER BY created_at DESC LIMIT 50",
+        {"bot": 7},
+    ),
+    (
+        "Remarketing: último envio ao usuário",
+        "ix_remarketing_logs_bot_user_sent_at",
+        "SELECT id FROM remarketing_logs WHERE bot_id = :bot AND user_id = :tg AND sent_at >= :desde "
+        "ORDER BY sent_at DESC LIMIT 1",
+        {"bot": 7, "tg": "100042", "desde": "AGORA-30"},
+    ),
+    (
+        "Próximo passo do fluxo",
+        "ix_bot_flow_steps_bot_order",
+        "SELECT id FROM bot_flow_steps WHERE bot_id = :bot AND step_order = :ordem",
+        {"bot": 7, "ordem": 3},
+    ),
+    (
+        "Links da pasta por bot",
+        "ix_tracking_links_folder_bot",
+        "SELECT id FROM tracking_links WHERE folder_id = :pasta AND bot_id = :bot",
+        {"pasta": 3, "bot": 7},
+    ),
+]
+
+# ---------------------------------------------------------
+# Dados sintéticos
+# ---------------------------------------------------------
+def _inserir(conn, tabela: str, linhas: list):
+    tabela = Base.metadata.tables[tabela]
+    for i in range(0, len(linhas), LOTE):
+        conn.execute(tabela.insert(), linhas[i:i + LOTE])
+
+def popular(engine, linhas: int, agora: datetime):
+    """Distribuição parecida com a de produção: maioria pending/expired, ~20% vendas ativas."""
+    aleatorio = random.Random(42)
+    usuarios = max(linhas // 5, 1000)
+
+    def quando(dias):
+        return agora - timedelta(seconds=aleatorio.randint(0, dias * 86400))
+
+    with engine.begin() as conn:
+        _inserir(conn, "bots", [
+            {"id": b, "nome": f"Bot {b}", "token": f"{b}:bench", "id_canal_vip": f"-100{b}"}
+            for b in range(1, BOTS + 1)
+        ])
+        _inserir(conn, "tracking_folders", [
+            {"id": p, "nome": f"Pasta {p}", "plataforma": "facebook"} for p in range(1, PASTAS + 1)
+        ])
+        _inserir(conn, "tracking_links", [
+            {"folder_id": aleatorio.randint(1, PASTAS), "bot_id": b, "nome": f"Link {b}-{n}", "codigo": f"bench{b}x{n}"}
+            for b in range(1, BOTS + 1) for n in range(LINKS_POR_BOT)
+        ])
+        _inserir(conn, "bot_flow_steps", [
+            {"bot_id": b, "step_order": o, "msg_texto": "passo"}
+            for b in range(1, BOTS + 1) for o in range(1, PASSOS_POR_BOT + 1)
+        ])
+
+        pedidos = []
+        for i in range(linhas):
+            status = aleatorio.choices(
+                ["pending", "expired", "paid", "approved", "active"], weights=[55, 25, 5, 5, 10]
+            )[0]
+            criado = quando(365)
+            venda = status != "pending"
+            pedidos.append({
+                "bot_id": aleatorio.randint(1, BOTS), "telegram_id": str(100000 + aleatorio.randint(0, usuarios)),
+                "valor": 19.9, "status": status, "txid": f"tx-{i}", "transaction_id": f"tr-{i}",
+                "created_at": criado,
+                "data_aprovacao": criado + timedelta(minutes=5) if venda else None,
+                "data_expiracao": criado + timedelta(days=30) if venda else None,
+            })
+        _inserir(conn, "pedidos", pedidos)
+
+        _inserir(conn, "leads", [
+            {"bot_id": aleatorio.randint(1, BOTS), "user_id": str(100000 + aleatorio.randint(0, usuarios)),
+             "status": "topo", "created_at": quando(365)}
+            for _ in range(linhas)
+        ])
+        _inserir(conn, "remarketing_logs", [
+            {"bot_id": aleatorio.randint(1, BOTS), "user_id": str(100000 + aleatorio.randint(0, usuarios)),
+             "sent_at": quando(180), "status": "sent", "converted": False}
+            for _ in range(linhas)
+        ])
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+# ---------------------------------------------------------
+# EXPLAIN
+# ---------------------------------------------------------
+def _indices_no_plano_postgres(no: dict) -> set:
+    nomes = {no["Index Name"]} if "Index Name" in no else set()
+    for filho in no.get("Plans", []):
+        nomes |= _indices_no_plano_postgres(filho)
+    return nomes
+
+def explicar(conn, sql: str, params: dict):
+    """Retorna (índices usados, plano em texto)."""
+    if conn.dialect.name == "postgresql":
+        plano = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        texto = "\n".join(r[0] for r in conn.execute(text(f"EXPLAIN {sql}"), params))
+        return _indices_no_plano_postgres(plano[0]["Plan"]), texto
+
+    linhas = [r[-1] for r in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+    usados = set()
+    for detalhe in linhas:
+        for marcador in ("USING COVERING INDEX ", "USING INDEX "):
+            if marcador in detalhe:
+                usados.add(detalhe.split(marcador, 1)[1].split(" ", 1)[0])
+    return usados, "\n".join(linhas)
+
+def _resolver(params: dict, agora: datetime) -> dict:
+    resolvidos = {}
+    for chave, valor in params.items():
+        if isinstance(valor, str) and valor.startswith("AGORA"):
+            dias = int(valor[5:] or 0)
+            valor = agora + timedelta(days=dias)
+        resolvidos[chave] = valor
+    return resolvidos
+
+def executar_benchmark(url: str, linhas: int) -> int:
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        if engine.dialect.has_table(conn, "pedidos") and conn.execute(text("SELECT 1 FROM pedidos LIMIT 1")).first():
+            raise SystemExit("❌ O banco já tem pedidos. Use um banco vazio/de teste.")
+
+    agora = datetime.utcnow()
+    Base.metadata.create_all(bind=engine)
+
+    inicio = time.monotonic()
+    popular(engine, linhas, agora)
+    print(f"📦 {linhas} pedidos/leads/logs sintéticos em {time.monotonic() - inicio:.1f}s ({engine.dialect.name})\n")
+
+    falhas = 0
+    with engine.connect() as conn:
+        for descricao, esperado, sql, params in CONSULTAS_QUENTES:
+            params = _resolver(params, agora)
+            usados, plano = explicar(conn, sql, params)
+
+            inicio = time.monotonic()
+            for _ in range(20):
+                conn.execute(text(sql), params).all()
+            media_ms = (time.monotonic() - inicio) * 1000 / 20
+
+            ok = esperado in usados
+            falhas += not ok
+            print(f"{'✅' if ok else '❌'} {descricao:<38} {media_ms:7.2f} ms   esperado: {esperado}")
+            if not ok:
+                print("   " + plano.replace("\n", "\n   "))
+
+    print(f"\n{len(CONSULTAS_QUENTES) - falhas}/{len(CONSULTAS_QUENTES)} consultas usando o índice esperado")
+    return falhas
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    argumentos = sys.argv[1:]
+    linhas = 50000
+    if "--linhas" in argumentos:
+        posicao = argumentos.index("--linhas")
+        linhas = int(argumentos[posicao + 1])
+        del argumentos[posicao:posicao + 2]
+
+    if argumentos:
+        url = argumentos[0].replace("postgres://", "postgresql://", 1)
+    else:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark_indices.db')}"
+
+    sys.exit(1 if executar_benchmark(url, linhas) else 0)
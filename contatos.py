@@ -0,0 +1,213 @@
+# =========================================================
+# 👥 CONTATOS MATERIALIZADOS (tabela contacts)
+# =========================================================
+# Cada (bot_id, telegram_id) tem uma linha com a etapa atual do funil e o
+# último pedido. Sempre que um lead ou pedido é criado, alterado ou apagado
+# (/start, geração de PIX, aprovação, expiração...), o after_flush recalcula
+# só as linhas desses contatos, na mesma transação. UPDATEs em massa fora do
+# ORM chamam sincronizar_contatos() diretamente.
+# Primeira carga: backfill_contatos_se_pendente(), em segundo plano no startup,
+# uma vez por banco. Reconstrução: python backfill_contatos.py
+
+import logging
+from datetime import datetime
+from typing import List, Optional, Dict
+from sqlalchemy import event, text, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from database import SessaoBanco, SessionJobs, Bot as BotModel, Pedido, Lead
+from migrations import carga_concluida, executar_carga_unica
+
+logger = logging.getLogger(__name__)
+
+STATUS_CONTATO_FUNDO = ('paid', 'approved', 'active')
+CONTATOS_LOTE_BACKFILL = 500
+BACKFILL_CONTATOS_CHAVE = "backfill_contatos_concluido"
+CONTATOS_CAMPOS = (
+    "bot_id", "telegram_id", "first_name", "username", "stage", "stage_at",
+    "order_id", "order_status", "plan_name", "value", "expiration",
+    "lead_id", "lead_status", "lead_created_at", "updated_at"
+)
+
+SQL_UPSERT_CONTATO = text(f"""
+    INSERT INTO contacts ({", ".join(CONTATOS_CAMPOS)})
+    VALUES ({", ".join(":" + c for c in CONTATOS_CAMPOS)})
+    ON CONFLICT (bot_id, telegram_id) DO UPDATE SET
+    {", ".join(f"{c} = excluded.{c}" for c in CONTATOS_CAMPOS[2:])}
+""")
+# Primeira carga com o app no ar: não sobrescreve o que o listener já gravou
+SQL_INSERIR_CONTATO_NOVO = text(f"""
+    INSERT INTO contacts ({", ".join(CONTATOS_CAMPOS)})
+    VALUES ({", ".join(":" + c for c in CONTATOS_CAMPOS)})
+    ON CONFLICT (bot_id, telegram_id) DO NOTHING
+""")
+SQL_REMOVER_CONTATO = text("DELETE FROM contacts WHERE bot_id = :bot_id AND telegram_id = :telegram_id")
+
+def _sem_fuso(dt: Optional[datetime]) -> Optional[datetime]:
+    return dt.replace(tzinfo=None) if dt else None
+
+def etapa_do_pedido(status: Optional[str]) -> str:
+    if status in STATUS_CONTATO_FUNDO:
+        return "fundo"
+    if status == "expired":
+        return "expirado"
+    return "meio"
+
+def _linha_contato(bot_id: int, telegram_id: str, lead, pedido) -> dict:
+    """Pedido (o mais recente) sempre prevalece sobre o lead."""
+    linha = {
+        "bot_id": bot_id,
+        "telegram_id": telegram_id,
+        "first_name": None, "username": None,
+        "stage": "topo", "stage_at": None,
+        "order_id": None, "order_status": None, "plan_name": None, "value": 0.0, "expiration": None,
+        "lead_id": None, "lead_status": None, "lead_created_at": None,
+        "updated_at": datetime.utcnow(),
+    }
+    if lead:
+        linha.update(
+            first_name=lead.nome, username=lead.username,
+            stage_at=_sem_fuso(lead.created_at), expiration=lead.expiration_date,
+            lead_id=lead.id, lead_status=lead.status, lead_created_at=_sem_fuso(lead.created_at),
+        )
+    if pedido:
+        linha.update(
+            first_name=pedido.first_name, username=pedido.username,
+            stage=etapa_do_pedido(pedido.status), stage_at=_sem_fuso(pedido.created_at),
+            order_id=pedido.id, order_status=pedido.status, plan_name=pedido.plano_nome,
+            value=float(pedido.valor or 0),
+            expiration=_sem_fuso(pedido.data_expiracao) or _sem_fuso(pedido.custom_expiration),
+        )
+    # A paginação por cursor ordena por stage_at (contatos) e lead_created_at
+    # (leads): nunca deixa nulo, senão o cursor corta a listagem
+    linha["stage_at"] = linha["stage_at"] or linha["updated_at"]
+    if lead:
+        linha["lead_created_at"] = linha["lead_created_at"] or linha["updated_at"]
+    return linha
+
+def sincronizar_contatos(db: Session, chaves, somente_novos: bool = False) -> int:
+    """
+    Recalcula as linhas de `contacts` das chaves (bot_id, telegram_id) a partir
+    de leads e pedidos. Não faz commit. Retorna quantos contatos foram tocados.
+    Com somente_novos só insere os que faltam (nada é atualizado ou removido).
+    """
+    por_bot: Dict[int, set] = {}
+    for bot_id, telegram_id in chaves:
+        if bot_id and telegram_id is not None and str(telegram_id).strip():
+            por_bot.setdefault(bot_id, set()).add(str(telegram_id).strip())
+    if not por_bot:
+        return 0
+
+    gravar, remover = [], []
+    with db.no_autoflush:
+        for bot_id, ids in por_bot.items():
+            # Ordem crescente: o último de cada contato é o mais recente
+            pedidos = {
+                str(p.telegram_id).strip(): p for p in db.query(
+                    Pedido.id, Pedido.telegram_id, Pedido.first_name, Pedido.username, Pedido.status,
+                    Pedido.plano_nome, Pedido.valor, Pedido.data_expiracao, Pedido.custom_expiration,
+                    Pedido.created_at
+                ).filter(
+                    Pedido.bot_id == bot_id, Pedido.telegram_id.in_(ids)
+                ).order_by(Pedido.created_at, Pedido.id).all()
+            }
+            leads = {
+                str(l.user_id).strip(): l for l in db.query(
+                    Lead.id, Lead.user_id, Lead.nome, Lead.username, Lead.status,
+                    Lead.expiration_date, Lead.created_at
+                ).filter(
+                    Lead.bot_id == bot_id, Lead.user_id.in_(ids)
+                ).order_by(Lead.created_at, Lead.id).all()
+            }
+            for telegram_id in ids:
+                lead, pedido = leads.get(telegram_id), pedidos.get(telegram_id)
+                if lead or pedido:
+                    gravar.append(_linha_contato(bot_id, telegram_id, lead, pedido))
+                else:
+                    remover.append({"bot_id": bot_id, "telegram_id": telegram_id})
+
+    conexao = db.connection()
+    if somente_novos:
+        if gravar:
+            conexao.execute(SQL_INSERIR_CONTATO_NOVO, gravar)
+        return len(gravar)
+    if gravar:
+        conexao.execute(SQL_UPSERT_CONTATO, gravar)
+    if remover:
+        conexao.execute(SQL_REMOVER_CONTATO, remover)
+    return len(gravar) + len(remover)
+
+# Colunas que alimentam contacts (ver _linha_contato). Mudanças em outras
+# colunas (ultimo_contato, total_remarketings...) não disparam a sincronização.
+CAMPOS_CONTATO_PEDIDO = (
+    "bot_id", "telegram_id", "first_name", "username", "status", "plano_nome",
+    "valor", "data_expiracao", "custom_expiration", "created_at"
+)
+CAMPOS_CONTATO_LEAD = ("bot_id", "user_id", "nome", "username", "status", "expiration_date", "created_at")
+
+def _chaves_do_objeto(obj, campo_id: str, campos, sempre: bool) -> set:
+    """
+    Chaves (bot_id, telegram_id) a recalcular para um lead/pedido do flush.
+    Inclui a chave antiga (valor anterior no histórico) quando bot ou
+    telegram_id mudaram, para o contato antigo não ficar órfão.
+    """
+    atributos = sa_inspect(obj).attrs
+    if not sempre and not any(atributos[c].history.has_changes() for c in campos):
+        return set()
+    bots = {obj.bot_id, *atributos.bot_id.history.deleted}
+    ids = {getattr(obj, campo_id), *atributos[campo_id].history.deleted}
+    return {(bot_id, telegram_id) for bot_id in bots for telegram_id in ids}
+
+# active_history: ao trocar a chave de um objeto expirado o SQLAlchemy carrega
+# o valor antigo, senão o histórico viria sem ele
+@event.listens_for(Pedido.bot_id, "set", active_history=True)
+@event.listens_for(Pedido.telegram_id, "set", active_history=True)
+@event.listens_for(Lead.bot_id, "set", active_history=True)
+@event.listens_for(Lead.user_id, "set", active_history=True)
+def _guardar_chave_antiga(target, value, oldvalue, initiator):
+    pass
+
+@event.listens_for(SessaoBanco, "after_flush")
+def _sincronizar_contatos_no_flush(session, flush_context):
+    # No after_flush as listas new/dirty/deleted e o histórico ainda são os de antes do flush
+    chaves = set()
+    for grupo, sempre in ((session.new, True), (session.deleted, True), (session.dirty, False)):
+        for obj in grupo:
+            if isinstance(obj, Pedido):
+                chaves |= _chaves_do_objeto(obj, "telegram_id", CAMPOS_CONTATO_PEDIDO, sempre)
+            elif isinstance(obj, Lead):
+                chaves |= _chaves_do_objeto(obj, "user_id", CAMPOS_CONTATO_LEAD, sempre)
+    if chaves:
+        sincronizar_contatos(session, chaves)
+
+def executar_backfill_contatos(bots_ids: Optional[List[int]] = None, somente_novos: bool = False) -> int:
+    """(Re)constrói `contacts` em lotes por bot. Retorna quantos contatos foram gravados."""
+    db = SessionJobs()
+    try:
+        query = db.query(BotModel.id)
+        if bots_ids:
+            query = query.filter(BotModel.id.in_(bots_ids))
+        total = 0
+        for (bot_id,) in query.order_by(BotModel.id).all():
+            ids = db.query(Lead.user_id).filter(Lead.bot_id == bot_id).union(
+                db.query(Pedido.telegram_id).filter(Pedido.bot_id == bot_id)
+            ).all()
+            ids = [t for (t,) in ids if t is not None]
+            for i in range(0, len(ids), CONTATOS_LOTE_BACKFILL):
+                lote = [(bot_id, t) for t in ids[i:i + CONTATOS_LOTE_BACKFILL]]
+                total += sincronizar_contatos(db, lote, somente_novos=somente_novos)
+                db.commit()
+        logger.info(f"👥 [CONTATOS] {total} contatos materializados")
+        return total
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def backfill_contatos_se_pendente() -> int:
+    """
+    Usado no startup (em segundo plano): preenche `contacts` uma única vez por
+    banco. Só insere os contatos que faltam; os que o listener já mantém ficam.
+    """
+    return executar_carga_unica(BACKFILL_CONTATOS_CHAVE, lambda: executar_backfill_contatos(somente_novos=True))
@@ -1,10 +1,16 @@
 import os
 import enum
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON
+import time
+import logging
+import threading
+from sqlalchemy import event, create_engine, Column, Integer, String, Float, Date, DateTime, Boolean, Text, ForeignKey, JSON, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.pool import QueuePool
-from sqlalchemy.sql import func
+from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.sql import func, text
 from datetime import datetime
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -13,21 +19,197 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# 🚦 POOLS POR CLASSE DE CARGA (COM MÉTRICAS)
+# =========================================================
+# Cada classe tem o seu pool: um painel pesado ou uma campanha longa não
+# tomam as conexões dos webhooks e do pagamento. Tamanhos ajustáveis por
+# ambiente: DB_POOL_<CLASSE>_SIZE / _OVERFLOW / _TIMEOUT (ex.: DB_POOL_JOBS_SIZE=4).
+# Atenção ao total por worker (soma de size + overflow) x max_connections do Postgres.
+POOLS_PADRAO = {
+    # classe: (pool_size, max_overflow, pool_timeout)
+    "interativo": (5, 10, 30),   # webhook do Telegram, painel, autenticação
+    "pagamentos": (4, 6, 10),    # webhook PIX, geração de PIX, status (engine assíncrona)
+    "analytics": (2, 3, 30),     # dashboards, estatísticas, exportações
+    "jobs": (2, 4, 60),          # scheduler, campanhas, expiração, reconciliação
+}
+CONEXAO_LONGA_SEGUNDOS = float(os.getenv("DB_CONEXAO_LONGA_SEGUNDOS", "30"))
+ESPERA_LENTA_MS = float(os.getenv("DB_ESPERA_LENTA_MS", "100"))
+
+def configuracao_pool(classe: str) -> dict:
+    size, overflow, timeout = POOLS_PADRAO[classe]
+    prefixo = f"DB_POOL_{classe.upper()}"
+    return {
+        "pool_size": int(os.getenv(f"{prefixo}_SIZE", size)),
+        "max_overflow": int(os.getenv(f"{prefixo}_OVERFLOW", overflow)),
+        "pool_timeout": float(os.getenv(f"{prefixo}_TIMEOUT", timeout)),
+        "pool_recycle": 1800,
+    }
+
+class MetricasPool:
+    """Espera no checkout, saturação e conexões retidas por muito tempo de um pool."""
+
+    def __init__(self, classe: str):
+        self.classe = classe
+        self.engine = None
+        self._lock = threading.Lock()
+        self._em_uso = {}  # id(connection_record) -> início do checkout
+        self.checkouts = 0
+        self.espera_total_ms = 0.0
+        self.espera_max_ms = 0.0
+        self.esperas_lentas = 0
+        self.timeouts = 0
+        self.retencoes_longas = 0
+        self.retencao_max_ms = 0.0
+
+    def registrar_espera(self, espera_ms: float, timeout: bool):
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.espera_total_ms += espera_ms
+            self.espera_max_ms = max(self.espera_max_ms, espera_ms)
+            if espera_ms >= ESPERA_LENTA_MS:
+                self.esperas_lentas += 1
+
+    def registrar_checkout(self, connection_record):
+        with self._lock:
+            self._em_uso[id(connection_record)] = time.monotonic()
+
+    def registrar_checkin(self, connection_record):
+        with self._lock:
+            inicio = self._em_uso.pop(id(connection_record), None)
+            if inicio is None:
+                return
+            retida_ms = (time.monotonic() - inicio) * 1000
+            self.retencao_max_ms = max(self.retencao_max_ms, retida_ms)
+            if retida_ms < CONEXAO_LONGA_SEGUNDOS * 1000:
+                return
+            self.retencoes_longas += 1
+        logger.warning(f"🐢 [POOL {self.classe}] Conexão retida por {retida_ms / 1000:.1f}s")
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        agora = time.monotonic()
+        with self._lock:
+            retidas = [agora - inicio for inicio in self._em_uso.values()]
+            dados = {
+                "checkouts": self.checkouts,
+                "espera_media_ms": round(self.espera_total_ms / self.checkouts, 2) if self.checkouts else 0,
+                "espera_max_ms": round(self.espera_max_ms, 2),
+                "esperas_lentas": self.esperas_lentas,
+                "timeouts": self.timeouts,
+                "retencoes_longas": self.retencoes_longas,
+                "retencao_max_ms": round(self.retencao_max_ms, 2),
+                "retidas_agora": sum(1 for s in retidas if s >= CONEXAO_LONGA_SEGUNDOS),
+                "retencao_mais_antiga_s": round(max(retidas), 1) if retidas else 0,
+            }
+        if isinstance(pool, QueuePool):
+            capacidade = pool.size() + pool._max_overflow
+            em_uso = pool.checkedout()
+            dados.update({
+                "pool_size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "em_uso": em_uso,
+                "ociosas": pool.checkedin(),
+                "saturacao": round(em_uso / capacidade, 3) if capacidade > 0 else 0,
+            })
+        return dados
+
+class _PoolInstrumentado:
+    """Mede o tempo de espera até o pool entregar uma conexão."""
+    metricas: MetricasPool = None
+
+    def connect(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super().connect()
+        except SATimeoutError:
+            self.metricas.registrar_espera(0, timeout=True)
+            raise
+        self.metricas.registrar_espera((time.perf_counter() - inicio) * 1000, timeout=False)
+        return conexao
+
+# classe -> MetricasPool (exportado em /api/health/database-pools)
+metricas_pools = {}
+
+def _instrumentar(classe: str, pool_base):
+    """Classe de pool com métricas (atributo de classe: sobrevive ao pool.recreate())."""
+    metricas = metricas_pools[classe] = MetricasPool(classe)
+    return type(f"{pool_base.__name__}_{classe}", (_PoolInstrumentado, pool_base), {"metricas": metricas})
+
+def _observar(classe: str, engine_sync):
+    metricas = metricas_pools[classe]
+    metricas.engine = engine_sync
+    event.listen(engine_sync, "checkout", lambda dbapi_con, registro, proxy: metricas.registrar_checkout(registro))
+    event.listen(engine_sync, "checkin", lambda dbapi_con, registro: metricas.registrar_checkin(registro))
+
+def _criar_engine(classe: str):
+    engine_classe = create_engine(DATABASE_URL, poolclass=_instrumentar(classe, QueuePool), **configuracao_pool(classe))
+    _observar(classe, engine_classe)
+    return engine_classe
+
 if DATABASE_URL:
-    engine = create_engine(
-        DATABASE_URL,
-        poolclass=QueuePool,
-        pool_size=5,
-        max_overflow=10,
-        pool_timeout=30,
-        pool_recycle=1800
-    )
+    engine = _criar_engine("interativo")
+    engine_analytics = _criar_engine("analytics")
+    engine_jobs = _criar_engine("jobs")
 else:
+    # SQLite local: um arquivo só, sem segregação
     engine = create_engine("sqlite:///./sql_app.db")
+    engine_analytics = engine_jobs = engine
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class SessaoBanco(Session):
+    """Classe de todas as sessões do app: os listeners de flush se registram nela."""
+
+SessionLocal = sessionmaker(class_=SessaoBanco, autocommit=False, autoflush=False, bind=engine)
+SessionAnalytics = sessionmaker(class_=SessaoBanco, autocommit=False, autoflush=False, bind=engine_analytics)
+SessionJobs = sessionmaker(class_=SessaoBanco, autocommit=False, autoflush=False, bind=engine_jobs)
 Base = declarative_base()
 
+# =========================================================
+# ⚡ ENGINE ASSÍNCRONA (asyncpg / aiosqlite)
+# =========================================================
+# Mesmo banco, driver assíncrono: usada pelos endpoints async (webhooks e
+# pagamento) para que a espera pelo banco não trave o event loop. É o pool
+# da classe "pagamentos".
+def _url_assincrona(url):
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        query = dict(url.query)
+        # asyncpg não entende 'sslmode' (comum nas URLs do Railway)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+if DATABASE_URL:
+    async_engine = create_async_engine(
+        _url_assincrona(engine.url),
+        poolclass=_instrumentar("pagamentos", AsyncAdaptedQueuePool),
+        **configuracao_pool("pagamentos")
+    )
+    _observar("pagamentos", async_engine.sync_engine)
+else:
+    async_engine = create_async_engine(_url_assincrona(engine.url))
+
+class SessaoSincronaAsync(SessaoBanco):
+    """Sessão síncrona por trás de cada AsyncSession."""
+
+# expire_on_commit=False: ler um atributo depois do commit não pode disparar I/O implícito
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, sync_session_class=SessaoSincronaAsync,
+    autoflush=False, expire_on_commit=False
+)
+
+# Predicado dos índices parciais de vendas (migration_v14). O planner só usa o
+# índice se a consulta filtrar por estes mesmos status.
+PREDICADO_VENDAS = "status IN ('paid', 'approved', 'active')"
+
 def init_db():
     Base.metadata.create_all(bind=engine)
 
@@ -60,7 +242,8 @@ class User(Base):
     # Mantemos is_superuser por compatibilidade, mas o sistema vai priorizar a ROLE
     is_superuser = Column(Boolean, default=False)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # NOT NULL: ordena a paginação por cursor (migração v15)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # 💰 CAMPOS FINANCEIROS (MANTIDOS)
@@ -72,6 +255,10 @@ class User(Base):
     audit_logs = relationship("AuditLog", back_populates="user")
     notifications = relationship("Notification", back_populates="user")
 
+    __table_args__ = (
+        Index("ix_users_created_id", "created_at", "id"),
+    )
+
 # =========================================================
 # ⚙️ CONFIGURAÇÕES GERAIS
 # =========================================================
@@ -99,10 +286,17 @@ class Bot(Base):
     
     status = Column(String, default="ativo")
     
+    # 🩺 Saúde (quarentena automática por token revogado / removido do canal)
+    saude_status = Column(String, default="ok")
+    saude_motivo = Column(String, nullable=True)
+    saude_falhas = Column(Integer, default=0)
+    saude_desde = Column(DateTime, nullable=True)
+    saude_proxima_sonda = Column(DateTime, nullable=True)
+    
     # Token Individual por Bot
     pushin_token = Column(String, nullable=True) 
 
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # 🆕 RELACIONAMENTO COM USUÁRIO (OWNER)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # nullable=True para migração
@@ -229,11 +423,15 @@ class RemarketingCampaign(Base):
     total_leads = Column(Integer, default=0)
     sent_success = Column(Integer, default=0)
     blocked_count = Column(Integer, default=0)
-    data_envio = Column(DateTime, default=datetime.utcnow)
+    data_envio = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Relacionamento
     bot = relationship("Bot", back_populates="remarketing_campaigns")
 
+    __table_args__ = (
+        Index("ix_remarketing_campaigns_bot_envio_id", "bot_id", "data_envio", "id"),
+    )
+
 # =========================================================
 # 🔄 WEBHOOK RETRY SYSTEM
 # =========================================================
@@ -255,6 +453,7 @@ class WebhookRetry(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_error = Column(Text, nullable=True)
     reference_id = Column(String(100), nullable=True)
+    last_latency_ms = Column(Integer, nullable=True)  # Duração da última tentativa
     
     def __repr__(self):
         return f"<WebhookRetry(id={self.id}, type={self.webhook_type}, attempts={self.attempts}, status={self.status})>"
@@ -307,6 +506,11 @@ class BotFlowStep(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     bot = relationship("Bot", back_populates="steps")
 
+    __table_args__ = (
+        # Próximo passo do fluxo (bot_id, step_order + 1) e listagem ordenada
+        Index("ix_bot_flow_steps_bot_order", "bot_id", "step_order"),
+    )
+
 # =========================================================
 # 🔗 TRACKING (RASTREAMENTO DE LINKS)
 # =========================================================
@@ -340,6 +544,11 @@ class TrackingLink(Base):
     folder = relationship("TrackingFolder", back_populates="links")
     bot = relationship("Bot", back_populates="tracking_links")
 
+    __table_args__ = (
+        # Links de uma pasta (filtrados pelos bots visíveis ao usuário)
+        Index("ix_tracking_links_folder_bot", "folder_id", "bot_id"),
+    )
+
 # =========================================================
 # 🛒 PEDIDOS
 # =========================================================
@@ -391,6 +600,25 @@ class Pedido(Base):
     # Rastreamento
     tracking_id = Column(Integer, ForeignKey("tracking_links.id"), nullable=True)
 
+    __table_args__ = (
+        # Reconciliação de PIX pendentes (status = 'pending' AND created_at na janela)
+        Index("ix_pedidos_status_created_at", "status", "created_at"),
+        # Motor de expiração (carga dos prazos por faixa de índice)
+        Index("ix_pedidos_status_custom_expiration", "status", "custom_expiration"),
+        Index("ix_pedidos_status_data_expiracao", "status", "data_expiracao"),
+        # Pedidos do usuário no bot (checkout, /start, entrega de acesso)
+        Index("ix_pedidos_bot_telegram_status", "bot_id", "telegram_id", "status"),
+        # Webhook da PushinPay localiza o pedido pelo id da transação
+        Index("ix_pedidos_transaction_id", "transaction_id"),
+        # Vendas por período (dashboards, superadmin)
+        Index("ix_pedidos_status_data_aprovacao", "status", "data_aprovacao"),
+        # Parciais: só as vendas (fração pequena da tabela)
+        Index("ix_pedidos_vendas_bot_aprovacao", "bot_id", "data_aprovacao",
+              postgresql_where=text(PREDICADO_VENDAS), sqlite_where=text(PREDICADO_VENDAS)),
+        Index("ix_pedidos_vendas_bot_expiracao", "bot_id", "data_expiracao",
+              postgresql_where=text(PREDICADO_VENDAS), sqlite_where=text(PREDICADO_VENDAS)),
+    )
+
 
 # =========================================================
 # 🎯 TABELA: LEADS (TOPO DO FUNIL)
@@ -432,6 +660,13 @@ class Lead(Base):
     # Se TrackingLink tiver back_populates="leads", descomente abaixo:
     # tracking_link = relationship("TrackingLink", back_populates="leads")
 
+    __table_args__ = (
+        # Lead do usuário no bot (/start, remarketing, conversão)
+        Index("ix_leads_bot_user", "bot_id", "user_id"),
+        # Leads recentes do bot
+        Index("ix_leads_bot_created_at", "bot_id", "created_at"),
+    )
+
 # =========================================================
 # 📱 MINI APP (TEMPLATE PERSONALIZÁVEL)
 # =========================================================
@@ -525,7 +760,7 @@ class AuditLog(Base):
     error_message = Column(Text, nullable=True)
     
     # 🕒 Timestamp
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
     
     # Relacionamento
     user = relationship("User", back_populates="audit_logs")
@@ -544,11 +779,15 @@ class Notification(Base):
     type = Column(String, default="info")        # info, success, warning, error
     read = Column(Boolean, default=False)        # Se o usuário já leu
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     # Relacionamento com Usuário
     user = relationship("User", back_populates="notifications")
 
+    __table_args__ = (
+        Index("ix_notifications_user_created_id", "user_id", "created_at", "id"),
+    )
+
 # =========================================================
 # 🎯 REMARKETING AUTOMÁTICO
 # =========================================================
@@ -653,6 +892,83 @@ class RemarketingLog(Base):
     
     # Relacionamento
     bot = relationship("Bot", back_populates="remarketing_logs")
+
+    __table_args__ = (
+        # Anti-duplicação e conversão: último envio do bot para o usuário
+        Index("ix_remarketing_logs_bot_user_sent_at", "bot_id", "user_id", "sent_at"),
+    )
     
     def __repr__(self):
-        return f"<RemarketingLog(bot_id={self.bot_id}, user_id={self.user_id}, status={self.status})>"
\ No newline at end of file
+        return f"<RemarketingLog(bot_id={self.bot_id}, user_id={self.user_id}, status={self.status})>"
+
+
+# =========================================================
+# 📊 ROLLUP DIÁRIO DE MÉTRICAS POR BOT
+# =========================================================
+class DailyBotMetrics(Base):
+    """
+    Contadores diários por bot, mantidos na mesma transação que grava o evento
+    (ver ROLLUP DIÁRIO no main.py). Os painéis leem daqui em vez de agregar
+    pedidos/leads/logs brutos. Dia em UTC.
+    """
+    __tablename__ = "daily_bot_metrics"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bot_id = Column(Integer, ForeignKey('bots.id', ondelete="CASCADE"), nullable=False)
+    day = Column(Date, nullable=False)
+    
+    leads = Column(Integer, default=0, nullable=False)
+    pix_generated = Column(Integer, default=0, nullable=False)
+    sales = Column(Integer, default=0, nullable=False)
+    revenue_cents = Column(Integer, default=0, nullable=False)
+    remarketing_sent = Column(Integer, default=0, nullable=False)
+    remarketing_converted = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("bot_id", "day", name="uq_daily_bot_metrics_bot_day"),
+        Index("ix_daily_bot_metrics_day", "day"),
+    )
+
+# =========================================================
+# 👥 CONTATOS (ESTADO ATUAL POR BOT + TELEGRAM ID)
+# =========================================================
+class Contact(Base):
+    """
+    Uma linha por (bot_id, telegram_id) com a etapa atual do funil e o último
+    pedido. Recalculada a partir de leads/pedidos sempre que eles mudam (ver
+    contatos.py); as listagens e o funil leem daqui.
+    """
+    __tablename__ = "contacts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bot_id = Column(Integer, ForeignKey('bots.id', ondelete="CASCADE"), nullable=False)
+    telegram_id = Column(String, nullable=False)
+    
+    first_name = Column(String, nullable=True)
+    username = Column(String, nullable=True)
+    
+    # topo (só lead) | meio (pedido pendente) | fundo (pago) | expirado
+    stage = Column(String(20), nullable=False, default="topo")
+    # Data do registro que define a etapa (último pedido ou lead): ordena as listagens
+    stage_at = Column(DateTime, nullable=True)
+    
+    # Último pedido
+    order_id = Column(Integer, nullable=True)
+    order_status = Column(String, nullable=True)
+    plan_name = Column(String, nullable=True)
+    value = Column(Float, default=0.0)
+    expiration = Column(DateTime, nullable=True)
+    
+    # Lead mais recente
+    lead_id = Column(Integer, nullable=True)
+    lead_status = Column(String(20), nullable=True)
+    lead_created_at = Column(DateTime, nullable=True)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("bot_id", "telegram_id", name="uq_contacts_bot_telegram"),
+        Index("ix_contacts_bot_stage_at", "bot_id", "stage_at"),
+        Index("ix_contacts_bot_stage", "bot_id", "stage", "stage_at"),
+        Index("ix_contacts_bot_lead_created_at", "bot_id", "lead_created_at"),
+    )
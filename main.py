@@ -10,18 +10,29 @@ import threading
 from telebot import types
 import json
 import uuid
+import random
+import heapq
+import hashlib
+import base64
+import codecs
+import csv
+import io
+import zlib
+from collections import deque, OrderedDict
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func, desc, text, and_, or_
+from sqlalchemy import func, desc, text, and_, or_, case, literal, event, select, inspect as sa_inspect
 from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware # <--- IMPORTANTE
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, EmailStr, Field 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Dict
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date, timezone
 
 # --- IMPORTS DE MIGRATION ---
-from force_migration import forcar_atualizacao_tabelas
+from migrations import aplicar_migracoes
 
 # 🆕 AUTENTICAÇÃO
 from passlib.context import CryptContext
@@ -39,6 +50,12 @@ from threading import Lock
 from database import (
     Base,                 # <--- ESSENCIAL PARA O STARTUP
     SessionLocal, 
+    SessionAnalytics,
+    SessionJobs,
+    AsyncSessionLocal,
+    SessaoBanco,
+    engine_jobs,
+    metricas_pools,
     init_db, 
     Bot as BotModel, 
     PlanoConfig, 
@@ -61,8 +78,13 @@ from database import (
     WebhookRetry,
     RemarketingConfig,
     AlternatingMessages, 
-    RemarketingLog 
+    RemarketingLog,
+    DailyBotMetrics,
+    Contact
 )
+# 👥 Contatos materializados: importar registra o listener after_flush de contacts
+from contatos import CONTATOS_LOTE_BACKFILL, sincronizar_contatos, backfill_contatos_se_pendente
+from backfill_metricas import METRICAS_LOCK_CLASSE, backfill_se_pendente
 
 import update_db
 
@@ -131,7 +153,7 @@ def alternar_mensagens_pagamento(bot_instance, chat_id, bot_id):
     As mensagens alternam até XX segundos antes do disparo automático.
     """
     try:
-        db = SessionLocal()
+        db = SessionJobs()
         
         # Busca configuração de mensagens alternantes
         config = db.query(AlternatingMessages).filter(
@@ -256,7 +278,7 @@ def enviar_remarketing_automatico(bot_instance, chat_id, bot_id):
             logger.info(f"⏭️ Remarketing já enviado para {chat_id}, bloqueando reenvio")
             return
         
-        db = SessionLocal()
+        db = SessionJobs()
         
         try:
             # Busca config de remarketing
@@ -350,7 +372,7 @@ def enviar_remarketing_automatico(bot_instance, chat_id, bot_id):
         usuarios_com_remarketing_enviado.add(chat_id)
         
         # Registra no log
-        db = SessionLocal()
+        db = SessionJobs()
         try:
             log = RemarketingLog(
                 bot_id=bot_id,
@@ -429,7 +451,7 @@ def agendar_remarketing_automatico(bot_instance, chat_id, bot_id):
             return
         
         # Busca config
-        db = SessionLocal()
+        db = SessionJobs()
         config = db.query(RemarketingConfig).filter(
             RemarketingConfig.bot_id == bot_id
         ).first()
@@ -486,182 +508,21 @@ def cancelar_remarketing(chat_id):
     except Exception as e:
         logger.error(f"Erro ao cancelar remarketing: {e}")
 
-# ============================================================
-# FUNÇÕES DE JOBS AGENDADOS
-# ============================================================
-
-async def verificar_vencimentos():
-    """
-    Job agendado para verificar e processar vencimentos de assinaturas.
-    Executa a cada 12 horas.
-    """
-    try:
-        logger.info("🔄 [JOB] Iniciando verificação de vencimentos...")
-        
-        db = SessionLocal()
-        
-        try:
-            # Buscar pedidos ativos que venceram
-            pedidos_vencidos = db.query(Pedido).filter(
-                Pedido.status == 'ativo',
-                Pedido.validade < datetime.now()
-            ).all()
-            
-            if not pedidos_vencidos:
-                logger.info("✅ [JOB] Nenhum vencimento encontrado")
-                return
-            
-            logger.info(f"📋 [JOB] {len(pedidos_vencidos)} vencimentos encontrados")
-            
-            # Processar cada vencimento
-            for pedido in pedidos_vencidos:
-                try:
-                    # Atualizar status do pedido
-                    pedido.status = 'vencido'
-                    pedido.updated_at = datetime.now()
-                    
-                    # Remover do grupo Telegram (se configurado)
-                    if pedido.grupo_id and pedido.user and pedido.user.telegram_id:
-                        try:
-                            # Buscar bot associado ao grupo
-                            bot_config = db.query(BotModel).filter(
-                                BotModel.grupo_telegram_id == pedido.grupo_id
-                            ).first()
-                            
-                            if bot_config and bot_config.token:
-                                # Criar instância do TeleBot
-                                bot = TeleBot(bot_config.token)
-                                
-                                # Remover usuário do grupo
-                                bot.ban_chat_member(
-                                    chat_id=int(pedido.grupo_id),
-                                    user_id=int(pedido.user.telegram_id)
-                                )
-                                bot.unban_chat_member(
-                                    chat_id=int(pedido.grupo_id),
-                                    user_id=int(pedido.user.telegram_id)
-                                )
-                                
-                                logger.info(
-                                    f"👋 [JOB] Usuário {pedido.user.nome} "
-                                    f"removido do grupo"
-                                )
-                        except Exception as e:
-                            logger.warning(
-                                f"⚠️  [JOB] Erro ao remover do grupo: {str(e)}"
-                            )
-                    
-                    db.commit()
-                    logger.info(f"✅ [JOB] Pedido #{pedido.id} marcado como vencido")
-                    
-                except Exception as e:
-                    logger.error(
-                        f"❌ [JOB] Erro ao processar pedido #{pedido.id}: {str(e)}"
-                    )
-                    db.rollback()
-                    continue
-            
-            logger.info("✅ [JOB] Verificação de vencimentos concluída")
-            
-        finally:
-            db.close()
-        
-    except Exception as e:
-        logger.error(f"❌ [JOB] Erro crítico na verificação de vencimentos: {str(e)}")
-
-
-async def processar_webhooks_pendentes():
-    """
-    Job agendado para reprocessar webhooks falhados.
-    Executa a cada 1 minuto.
-    """
-    try:
-        logger.info("🔄 [WEBHOOK-RETRY] Iniciando reprocessamento...")
-        
-        db = SessionLocal()
-        
-        try:
-            # Buscar webhooks pendentes que estão prontos para retry
-            webhooks = db.query(WebhookRetry).filter(
-                WebhookRetry.status == 'pending',
-                WebhookRetry.attempts < WebhookRetry.max_attempts,
-                (WebhookRetry.next_retry == None) | (WebhookRetry.next_retry <= datetime.now())
-            ).order_by(WebhookRetry.created_at).limit(10).all()
-            
-            if not webhooks:
-                return  # Sem webhooks para processar
-            
-            logger.info(f"📋 [WEBHOOK-RETRY] {len(webhooks)} webhooks para reprocessar")
-            
-            for webhook in webhooks:
-                try:
-                    # Deserializar payload
-                    payload = json.loads(webhook.payload)
-                    
-                    # Incrementar tentativas
-                    webhook.attempts += 1
-                    
-                    # Reprocessar baseado no tipo
-                    success = False
-                    error_msg = None
-                    
-                    if webhook.webhook_type == 'pushinpay':
-                        try:
-                            # TODO: Chamar função real de processamento
-                            # await processar_webhook_pix(payload)
-                            success = True  # Placeholder por enquanto
-                        except Exception as e:
-                            error_msg = str(e)
-                    
-                    # Atualizar registro
-                    if success:
-                        webhook.status = 'success'
-                        webhook.updated_at = datetime.now()
-                        logger.info(f"✅ [WEBHOOK-RETRY] Webhook #{webhook.id} processado")
-                    else:
-                        # Calcular próximo retry (exponential backoff)
-                        backoff_minutes = 2 ** webhook.attempts  # 2, 4, 8, 16, 32
-                        webhook.next_retry = datetime.now() + timedelta(minutes=backoff_minutes)
-                        
-                        # Verificar se esgotou tentativas
-                        if webhook.attempts >= webhook.max_attempts:
-                            webhook.status = 'failed'
-                            webhook.next_retry = None
-                            logger.error(
-                                f"❌ [WEBHOOK-RETRY] Webhook #{webhook.id} "
-                                f"esgotou tentativas"
-                            )
-                        else:
-                            webhook.status = 'pending'
-                        
-                        webhook.last_error = error_msg
-                        webhook.updated_at = datetime.now()
-                    
-                    db.commit()
-                
-                except Exception as e:
-                    logger.error(
-                        f"❌ [WEBHOOK-RETRY] Erro ao processar webhook "
-                        f"#{webhook.id}: {str(e)}"
-                    )
-                    db.rollback()
-                    continue
-            
-            logger.info("✅ [WEBHOOK-RETRY] Reprocessamento concluído")
-            
-        finally:
-            db.close()
-        
-    except Exception as e:
-        logger.error(f"❌ [WEBHOOK-RETRY] Erro crítico: {str(e)}")
-
-
 # ============================================================
 # CONFIGURAÇÃO DO SCHEDULER
 # ============================================================
 
 # ============ HTTPX CLIENT GLOBAL ============
 http_client = None
+
+@app.on_event("startup")
+async def iniciar_http_client():
+    """Cliente HTTP compartilhado (reuso de conexões com a PushinPay)."""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
 # =========================================================
 # ⚙️ STARTUP OTIMIZADA (CORREÇÃO DO MESTRE)
 # =========================================================
@@ -674,79 +535,22 @@ def on_startup():
     print("🚀 INICIANDO ZENYX GBOT SAAS")
     print("="*60)
     
-    # 1. Cria tabelas básicas e corrige estrutura
+    # 1. Migrações versionadas (schema_version). Com o banco em dia é só uma
+    #    consulta; o ideal é rodar "python migrations.py" antes do deploy.
     try:
-        print("📊 Inicializando banco de dados...")
-        
-        # 🔥 PASSO 1: Cria as tabelas se não existirem
-        Base.metadata.create_all(bind=engine)
-        
-        # 🔥 PASSO 2: Inicializa dados básicos
-        init_db()
-        
-        # 🔥 PASSO 3: Força a verificação de colunas (Script de Auto-Fix)
-        print("🔧 Verificando integridade e colunas faltantes...")
-        forcar_atualizacao_tabelas()
-        
-        # ==============================================================================
-        # 🛠️ CORREÇÃO DE EMERGÊNCIA: CRIAR COLUNA ROLE (SQL DIRETO)
-        # ==============================================================================
-        # Isso resolve o erro de que a coluna 'role' não existe na tabela 'users'
-        try:
-            logger.info("🔧 Verificando coluna ROLE na tabela USERS...")
-            with engine.connect() as conn:
-                # O comando ADD COLUMN IF NOT EXISTS é seguro para rodar várias vezes
-                conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS role VARCHAR DEFAULT 'USER'"))
-                conn.commit()
-                logger.info("✅ Coluna ROLE verificada/criada com sucesso!")
-        except Exception as e:
-            logger.error(f"⚠️ Erro ao tentar criar coluna role: {e}")
-        # ==============================================================================
-
-        print("✅ Banco de dados inicializado e corrigido")
-        
+        print("🧬 Verificando versão do schema...")
+        aplicadas = aplicar_migracoes()
+        if aplicadas:
+            print(f"✅ {aplicadas} migração(ões) aplicada(s)")
+        else:
+            print("✅ Schema já está na última versão")
     except Exception as e:
-        logger.error(f"❌ ERRO CRÍTICO no init_db: {e}")
+        logger.error(f"❌ ERRO CRÍTICO nas migrações: {e}")
         # Não paramos o app para tentar rodar o resto, mas logamos o erro grave
         import traceback
         traceback.print_exc()
-
-    # 2. Executa migrações de versões (V3 a V6)
-    try:
-        print("🔄 Executando migrações...")
-        try:
-            executar_migracao_v3()
-        except: pass
-        
-        try:
-            executar_migracao_v4()
-        except: pass
-        
-        try:
-            executar_migracao_v5()
-        except: pass
-        
-        try:
-            executar_migracao_v6()
-        except: pass
-        
-        print("✅ Migrações de versão concluídas")
-            
-    except Exception as e:
-        logger.error(f"❌ Erro geral nas migrações: {e}")
     
-    # 3. Executa migração de Audit Logs
-    try:
-        print("📋 Configurando Audit Logs...")
-        from migration_audit_logs import executar_migracao_audit_logs
-        executar_migracao_audit_logs()
-        print("✅ Audit Logs configurado")
-    except ImportError:
-        logger.warning("⚠️ Arquivo migration_audit_logs.py não encontrado, pulando.")
-    except Exception as e:
-        logger.warning(f"⚠️ Erro na migração Audit Logs: {e}")
-    
-    # 4. Configura pagamento (Pushin Pay ID)
+    # 2. Configura pagamento (Pushin Pay ID)
     try:
         print("💳 Configurando sistema de pagamento...")
         db = SessionLocal()
@@ -948,7 +752,7 @@ async def send_remarketing_job(
         # Aguarda o tempo configurado
         await asyncio.sleep(delay * 60)
         
-        db = SessionLocal()
+        db = SessionJobs()
         try:
             # 1. Verifica se o usuário JÁ PAGOU
             pagou = db.query(Pedido).filter(
@@ -987,7 +791,7 @@ async def send_remarketing_job(
                 msg_text = msg_text.replace('{valor_original}', str(user_info.get('valor', '')))
 
             # ✅ NOVO: Aplicar preço promocional temporariamente
-            db_session = SessionLocal()
+            db_session = SessionJobs()
             try:
                 promos = config_dict.get('promo_values', {})
                 for plano_id_str, promo_data in promos.items():
@@ -1126,7 +930,7 @@ async def cleanup_orphan_jobs():
         
         if not active_users: return
         
-        db = SessionLocal()
+        db = SessionJobs()
         try:
             pagantes = db.query(Pedido.telegram_id).filter(
                 Pedido.status == 'paid', 
@@ -1245,20 +1049,6 @@ def schedule_remarketing_and_alternating(bot_id: int, chat_id: int, payment_mess
 scheduler = AsyncIOScheduler()
 
 # Adicionar jobs
-scheduler.add_job(
-    verificar_vencimentos,
-    'interval',
-    hours=12,
-    id='verificar_vencimentos'
-)
-
-scheduler.add_job(
-    processar_webhooks_pendentes,
-    'interval',
-    minutes=1,
-    id='webhook_retry_processor'
-)
-
 scheduler.add_job(
     cleanup_orphan_jobs,
     'interval',
@@ -1267,8 +1057,6 @@ scheduler.add_job(
     replace_existing=True
 )
 
-logger.info("✅ [SCHEDULER] Job de vencimentos agendado (12h)")
-logger.info("✅ [SCHEDULER] Job de retry de webhooks agendado (1 min)")
 logger.info("✅ [SCHEDULER] Job de cleanup de remarketing agendado (1h)")
 
 
@@ -1280,12 +1068,12 @@ async def enviar_mensagens_alternantes():
     Envia mensagens alternantes para leads que não converteram.
     Roda a cada 1 hora e verifica internamente os intervalos configurados.
     """
-    db = SessionLocal()
+    db = SessionJobs()
     try:
         logger.info("🔄 [ALTERNATING] Iniciando job de mensagens alternantes")
         
         # Busca todos os bots ativos
-        bots = db.query(BotModel).filter(BotModel.is_active == True).all()
+        bots = db.query(BotModel).filter(BotModel.is_active == True, filtro_bots_saudaveis()).all()
         
         for bot_db in bots:
             try:
@@ -1468,6 +1256,14 @@ async def health_check():
             ).count()
             webhook_stats = {"pending": pending, "failed": failed}
             db.close()
+            tentativas = webhook_retry_metricas["tentativas"]
+            webhook_stats["worker"] = {
+                "tentativas": tentativas,
+                "sucessos": webhook_retry_metricas["sucessos"],
+                "falhas": webhook_retry_metricas["falhas"],
+                "ultima_latencia_ms": webhook_retry_metricas["ultima_latencia_ms"],
+                "latencia_media_ms": round(webhook_retry_metricas["latencia_total_ms"] / tentativas, 1) if tentativas else None
+            }
         except:
             pass  # Tabela pode não existir ainda
         
@@ -1488,7 +1284,8 @@ async def health_check():
             "checks": {
                 "database": {"status": db_status},
                 "scheduler": {"status": scheduler_status},
-                "webhook_retry": webhook_stats
+                "webhook_retry": webhook_stats,
+                "pushinpay": {conta: cb.metricas() for conta, cb in pushinpay_breakers.items()}
             },
             "version": "5.0"
         }
@@ -1507,12 +1304,6 @@ async def health_check():
         )
 
 
-# 🔥 FORÇA A CRIAÇÃO DAS COLUNAS AO INICIAR
-try:
-    forcar_atualizacao_tabelas()
-except Exception as e:
-    print(f"Erro na migração forçada: {e}")
-
 # =========================================================
 # 🔐 CONFIGURAÇÕES DE AUTENTICAÇÃO JWT
 # =========================================================
@@ -1651,6 +1442,84 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Sessão assíncrona (asyncpg/aiosqlite): a espera pelo banco não trava o event loop"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_db_analytics():
+    """Sessão do pool de analytics (dashboards, estatísticas, exportações)"""
+    db = SessionAnalytics()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# =========================================================
+# 🔌 CONEXÃO SÓ DURANTE O SQL (FASES DE REDE SEM CONEXÃO)
+# =========================================================
+# A Session segura a conexão do pool do primeiro SELECT até o commit. Em
+# handlers que alternam banco e rede (Telegram, PushinPay) a transação é
+# encerrada antes de cada chamada externa: a conexão volta ao pool e a
+# próxima consulta pega outra. Assim o número de checkouts simultâneos é
+# limitado pelo banco, não pela latência da rede.
+@event.listens_for(SessaoBanco, "after_flush")
+def _marcar_escrita_na_transacao(session, flush_context):
+    session.info["escrita_na_transacao"] = True
+
+@event.listens_for(SessaoBanco, "after_commit")
+@event.listens_for(SessaoBanco, "after_rollback")
+def _limpar_escrita_na_transacao(session):
+    session.info.pop("escrita_na_transacao", None)
+
+def tem_escrita_pendente(db: Session) -> bool:
+    """Alterações no ORM ainda sem flush, ou já enviadas ao banco sem commit."""
+    return bool(db.new or db.dirty or db.deleted or db.info.get("escrita_na_transacao"))
+
+def liberar_conexao(db: Session) -> bool:
+    """
+    Encerra uma transação SÓ DE LEITURA e devolve a conexão ao pool.
+    Se houver escrita pendente não faz nada (e avisa): gravar é papel do
+    commit explícito do handler, nunca de um efeito colateral daqui.
+    Sem escrita o commit não grava nada; é usado no lugar do rollback só para
+    não expirar os objetos carregados (lê-los na fase de rede não abre outra
+    transação). Retorna True se a conexão foi liberada.
+    """
+    if not db.in_transaction():
+        return True
+    if tem_escrita_pendente(db):
+        logger.warning("⚠️ [CONEXÃO] Transação com escrita pendente: conexão mantida até o commit do handler")
+        return False
+    expirar = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = expirar
+    return True
+
+class TeleBotSemConexao:
+    """
+    Envolve o TeleBot de um handler: cada chamada à API do Telegram libera
+    antes a conexão da sessão (liberar_conexao). Chamadas feitas por outras
+    threads (timers, autodestruição) não mexem na sessão do request.
+    """
+    def __init__(self, bot, db: Session):
+        self._bot = bot
+        self._db = db
+        self._thread = threading.get_ident()
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._bot, nome)
+        if not callable(atributo):
+            return atributo
+
+        def chamada(*args, **kwargs):
+            if threading.get_ident() == self._thread:
+                liberar_conexao(self._db)
+            return atributo(*args, **kwargs)
+        return chamada
+
 # =========================================================
 # 🔧 FUNÇÕES AUXILIARES DE AUTENTICAÇÃO
 # =========================================================
@@ -1681,7 +1550,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """Decodifica token e retorna usuário atual"""
     credentials_exception = HTTPException(
         status_code=401,
@@ -1700,24 +1569,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    db = SessionLocal()
-    try:
-        from sqlalchemy.orm import joinedload
-        
-        # 🔥 EAGER LOADING para carregar bots ANTES de fechar sessão
-        user = db.query(User).options(
-            joinedload(User.bots)
-        ).filter(User.id == user_id).first()
-        
-        if user is None:
-            raise credentials_exception
-        
-        # 🔥 Forçar o carregamento da relação bots
-        _ = user.bots  # Isso garante que está carregado
-        
-        return user
-    finally:
-        db.close()
+    # Usa a sessão da própria requisição (Depends(get_db) é resolvido uma vez só)
+    # em vez de abrir outra: nada de duas conexões do pool por request autenticado
+    from sqlalchemy.orm import joinedload
+    
+    # 🔥 EAGER LOADING para carregar bots ANTES de liberar a conexão
+    user = db.query(User).options(
+        joinedload(User.bots)
+    ).filter(User.id == user_id).first()
+    
+    # Devolve a conexão ao pool já (a sessão continua utilizável pela rota);
+    # o usuário fica desanexado, como antes
+    db.close()
+    
+    if user is None:
+        raise credentials_exception
+    
+    return user
 
 # =========================================================
 # 🛡️ FUNÇÃO QUE FALTAVA (VERIFICA SE USUÁRIO ESTÁ ATIVO)
@@ -2032,7 +1900,7 @@ def save_auto_remarketing_messages(
 def get_auto_remarketing_stats(
     bot_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_analytics)
 ):
     """Retorna estatísticas de remarketing"""
     try:
@@ -2043,24 +1911,16 @@ def get_auto_remarketing_stats(
         if bot.owner_id != current_user.id and not current_user.is_superuser:
             raise HTTPException(status_code=403, detail="Acesso negado")
         
-        # Totais
-        total_sent = db.query(RemarketingLog).filter(
-            RemarketingLog.bot_id == bot_id
-        ).count()
-        
-        total_converted = db.query(RemarketingLog).filter(
-            RemarketingLog.bot_id == bot_id,
-            RemarketingLog.converted == True
-        ).count()
+        # Totais (rollup diário)
+        totais = somar_metricas_diarias(db, [bot_id])
+        total_sent = totais["remarketing_sent"]
+        total_converted = totais["remarketing_converted"]
         
         conversion_rate = (total_converted / total_sent * 100) if total_sent > 0 else 0
         
-        # Enviados Hoje (Correção user_id não necessária aqui, mas bom manter padrão)
-        hoje = datetime.now().date()
-        today_sent = db.query(RemarketingLog).filter(
-            RemarketingLog.bot_id == bot_id,
-            func.date(RemarketingLog.sent_at) == hoje
-        ).count()
+        # Enviados Hoje
+        hoje = datetime.utcnow().date()
+        today_sent = somar_metricas_diarias(db, [bot_id], desde=hoje, ate=hoje)["remarketing_sent"]
         
         # Logs Recentes
         recent_logs = db.query(RemarketingLog).filter(
@@ -2608,7 +2468,6 @@ def registrar_remarketing(
     try:
         # Se você usa scheduler, inicia aqui
         if 'scheduler' in globals():
-            scheduler.add_job(verificar_vencimentos, 'interval', hours=12)
             scheduler.add_job(executar_remarketing, 'interval', minutes=30) 
             scheduler.start()
             logger.info("⏰ [STARTUP] Agendador de tarefas iniciado.")
@@ -2627,207 +2486,926 @@ def registrar_remarketing(
 #
 # ============================================================
 
-    # 3. Inicia o Ceifador
-    thread = threading.Thread(target=loop_verificar_vencimentos)
-    thread.daemon = True
-    thread.start()
-    logger.info("💀 O Ceifador (Auto-Kick) foi iniciado!")
-
-# =========================================================
-# 💀 O CEIFADOR: VERIFICA VENCIMENTOS E REMOVE (KICK SUAVE)
-# =========================================================
-def loop_verificar_vencimentos():
-    """Roda a cada 60 segundos para remover usuários vencidos"""
-    while True:
-        try:
-            logger.info("⏳ Verificando assinaturas vencidas...")
-            verificar_expiracao_massa()
-        except Exception as e:
-            logger.error(f"Erro no loop de vencimento: {e}")
-        
-        time.sleep(60) # 🔥 VOLTOU PARA 60 SEGUNDOS (Verificação Rápida)
-
-# =========================================================
-# 💀 O CEIFADOR: REMOVEDOR BASEADO EM DATA (SAAS)
 # =========================================================
-def verificar_expiracao_massa():
-    db = SessionLocal()
-    try:
-        # Pega todos os bots do sistema
-        bots = db.query(BotModel).all()
-        
-        for bot_data in bots:
-            if not bot_data.token or not bot_data.id_canal_vip: 
-                continue
-            
-            try:
-                # Conecta no Telegram deste bot específico
-                tb = telebot.TeleBot(bot_data.token)
-                
-                # Tratamento ROBUSTO do ID do canal
-                try: 
-                    raw_id = str(bot_data.id_canal_vip).strip()
-                    canal_id = int(raw_id)
-                except: 
-                    logger.error(f"ID do canal inválido para o bot {bot_data.nome}")
+# 📨 CLIENTE TELEGRAM ASSÍNCRONO (COM LIMITE DE TAXA)
+# =========================================================
+# Para trabalhos em massa (expiração, etc.) sem prender uma thread por chamada.
+# Cada instância espaça as requisições do seu bot e respeita o retry_after
+# devolvido pelo Telegram em respostas 429.
+TELEGRAM_API_URL = "https://api.telegram.org"
+TELEGRAM_REQ_POR_SEGUNDO = float(os.getenv("TELEGRAM_REQ_POR_SEGUNDO", "25"))
+TELEGRAM_CONCORRENCIA_POR_BOT = 10
+TELEGRAM_TENTATIVAS_429 = 3
+
+class TelegramErro(Exception):
+    def __init__(self, codigo: int, descricao: str):
+        super().__init__(f"{codigo}: {descricao}")
+        self.codigo = codigo
+        self.descricao = descricao
+
+class TelegramAsyncLimitado:
+    def __init__(self, token: str, req_por_segundo: float = TELEGRAM_REQ_POR_SEGUNDO):
+        self.token = token
+        self.intervalo = 1.0 / req_por_segundo
+        self.proximo_slot = 0.0
+        self.lock = asyncio.Lock()
+        self.semaforo = asyncio.Semaphore(TELEGRAM_CONCORRENCIA_POR_BOT)
+        self.motivo_quarentena: Optional[str] = None  # Preenchido ao detectar erro do bot
+
+    async def _aguardar_vez(self):
+        async with self.lock:
+            agora = time.monotonic()
+            espera = self.proximo_slot - agora
+            self.proximo_slot = max(agora, self.proximo_slot) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    async def chamar(self, metodo: str, **params):
+        if self.motivo_quarentena:
+            raise TelegramErro(0, f"bot em quarentena ({self.motivo_quarentena})")
+        async with self.semaforo:
+            for _ in range(TELEGRAM_TENTATIVAS_429):
+                await self._aguardar_vez()
+                resp = await http_client.post(
+                    f"{TELEGRAM_API_URL}/bot{self.token}/{metodo}", json=params, timeout=10
+                )
+                dados = resp.json()
+                if dados.get("ok"):
+                    return dados.get("result")
+                if resp.status_code == 429:
+                    retry_after = (dados.get("parameters") or {}).get("retry_after", 1)
+                    async with self.lock:
+                        self.proximo_slot = max(self.proximo_slot, time.monotonic() + retry_after)
                     continue
-                
-                agora = datetime.utcnow()
-                
-                # Busca usuários vencidos
-                vencidos = db.query(Pedido).filter(
-                    Pedido.bot_id == bot_data.id,
-                    Pedido.status.in_(['paid', 'approved', 'active']),
-                    Pedido.custom_expiration != None, 
-                    Pedido.custom_expiration < agora
-                ).all()
-                
-                for u in vencidos:
-                    # 🔥 Proteção: Admin nunca é removido
-                    # ✅ CORRIGIDO: Comparação segura com None
-                    eh_admin_principal = (
-                        bot_data.admin_principal_id and 
-                        str(u.telegram_id) == str(bot_data.admin_principal_id)
-                    )
-                    
-                    # Verifica na tabela BotAdmin
-                    eh_admin_extra = db.query(BotAdmin).filter(
-                        BotAdmin.telegram_id == str(u.telegram_id),
-                        BotAdmin.bot_id == bot_data.id
-                    ).first()
-                    
-                    if eh_admin_principal or eh_admin_extra:
-                        logger.info(f"👑 Ignorando remoção de Admin: {u.telegram_id}")
-                        continue
-                    
-                    try:
-                        logger.info(f"💀 Removendo usuário vencido: {u.first_name} (Bot: {bot_data.nome})")
-                        
-                        # 1. Kick Suave
-                        tb.ban_chat_member(canal_id, int(u.telegram_id))
-                        tb.unban_chat_member(canal_id, int(u.telegram_id))
-                        
-                        # 2. Atualiza Status
-                        u.status = 'expired'
-                        db.commit()
-                        
-                        # 3. Avisa o usuário
-                        try: 
-                            tb.send_message(
-                                int(u.telegram_id), 
-                                "🚫 <b>Seu plano venceu!</b>\n\nPara renovar, digite /start", 
-                                parse_mode="HTML"
-                            )
-                        except: 
-                            pass
-                        
-                    except Exception as e_kick:
-                        err_msg = str(e_kick).lower()
-                        if "participant_id_invalid" in err_msg or "user not found" in err_msg:
-                            logger.info(f"Usuário {u.telegram_id} já havia saído. Marcando expired.")
-                            u.status = 'expired'
-                            db.commit()
-                        else:
-                            logger.error(f"Erro ao remover {u.telegram_id}: {e_kick}")
-                        
-            except Exception as e_bot:
-                logger.error(f"Erro ao processar bot {bot_data.id}: {e_bot}")
-                
-    finally: 
-        db.close()
+                raise TelegramErro(resp.status_code, dados.get("description", ""))
+            raise TelegramErro(429, "Too Many Requests")
+
+# Um cliente por token: o limite de taxa vale para o bot, não para o lote
+telegram_clientes: Dict[str, TelegramAsyncLimitado] = {}
+
+def obter_cliente_telegram(token: str) -> TelegramAsyncLimitado:
+    cliente = telegram_clientes.get(token)
+    if cliente is None:
+        cliente = telegram_clientes[token] = TelegramAsyncLimitado(token)
+    return cliente
 
 # =========================================================
-# 🔄 SISTEMA DE RETRY DE WEBHOOKS
+# 🩺 SAÚDE DOS BOTS (QUARENTENA AUTOMÁTICA)
 # =========================================================
+# Token revogado (401/404) ou bot removido/sem permissão no canal VIP colocam o
+# bot em quarentena. Jobs em segundo plano pulam bots em quarentena sem tocar na
+# rede; a sondagem abaixo testa de novo com backoff e libera quando voltar.
+BOT_SAUDE_OK = "ok"
+BOT_SAUDE_QUARENTENA = "quarentena"
+BOT_SONDA_BACKOFF_BASE_MINUTOS = 5
+BOT_SONDA_BACKOFF_MAX_HORAS = 24
+BOT_STATUS_CANAL_OK = ("administrator", "creator")
 
-async def processar_webhooks_pendentes():
+def classificar_erro_bot(erro: Exception) -> Optional[str]:
     """
-    Job que roda a cada 1 minuto para reprocessar webhooks que falharam.
-    Implementa exponential backoff: 1min, 2min, 4min, 8min, 16min
+    Retorna o motivo da quarentena se o erro for do BOT (e não do usuário
+    destinatário, como 'bot was blocked by the user'), ou None.
     """
-    db = SessionLocal()
+    codigo = getattr(erro, "codigo", None) or getattr(erro, "error_code", None)
+    descricao = str(getattr(erro, "descricao", None) or getattr(erro, "description", None) or erro).lower()
+
+    if codigo in (401, 404) or "unauthorized" in descricao:
+        return "token_invalido"
+    if codigo == 403 and ("kicked from the channel" in descricao or "kicked from the supergroup" in descricao
+                          or "not a member of the channel" in descricao or "not a member of the supergroup" in descricao):
+        return "removido_do_canal"
+    if "not enough rights" in descricao or "need administrator rights" in descricao:
+        return "sem_permissao_canal"
+    return None
+
+def filtro_bots_saudaveis():
+    """Filtro SQLAlchemy para jobs: exclui bots em quarentena."""
+    return or_(BotModel.saude_status == None, BotModel.saude_status != BOT_SAUDE_QUARENTENA)
+
+def bot_em_quarentena(bot: BotModel) -> bool:
+    return bot is not None and bot.saude_status == BOT_SAUDE_QUARENTENA
+
+def colocar_bot_em_quarentena(bot_id: int, motivo: str):
+    db = SessionJobs()
     try:
-        now = datetime.utcnow()
-        
-        # Buscar webhooks pendentes que estão prontos para retry
-        pendentes = db.query(WebhookRetry).filter(
-            WebhookRetry.status == 'pending',
-            WebhookRetry.next_retry <= now,
-            WebhookRetry.attempts < WebhookRetry.max_attempts
-        ).all()
-        
-        if not pendentes:
-            logger.debug("🔄 Nenhum webhook pendente para retry")
-            return
-        
-        logger.info(f"🔄 Processando {len(pendentes)} webhooks pendentes")
-        
-        for retry_item in pendentes:
-            try:
-                logger.info(f"🔄 Tentativa {retry_item.attempts + 1}/{retry_item.max_attempts} para webhook {retry_item.id}")
-                
-                # Deserializar payload
-                payload = json.loads(retry_item.payload)
-                
-                # Reprocessar baseado no tipo
-                if retry_item.webhook_type == 'pushinpay':
-                    # Criar request fake para passar para a função
-                    class FakeRequest:
-                        async def body(self):
-                            return retry_item.payload.encode('utf-8')
-                        
-                        async def json(self):
-                            return payload
-                    
-                    fake_req = FakeRequest()
-                    
-                    # Chamar função de webhook
-                    await webhook_pix(fake_req, db)
-                    
-                    # Se chegou aqui, sucesso!
-                    retry_item.status = 'success'
-                    retry_item.updated_at = datetime.utcnow()
-                    db.commit()
-                    
-                    logger.info(f"✅ Webhook {retry_item.id} reprocessado com sucesso")
-                    
-                else:
-                    logger.warning(f"⚠️ Tipo de webhook desconhecido: {retry_item.webhook_type}")
-                    retry_item.status = 'failed'
-                    retry_item.last_error = "Tipo de webhook não suportado"
-                    db.commit()
-                
-            except Exception as e:
-                # Incrementar tentativas
-                retry_item.attempts += 1
-                retry_item.last_error = str(e)
-                retry_item.updated_at = datetime.utcnow()
-                
-                if retry_item.attempts >= retry_item.max_attempts:
-                    # Esgotou tentativas
-                    retry_item.status = 'failed'
-                    logger.error(f"❌ Webhook {retry_item.id} falhou após {retry_item.attempts} tentativas: {e}")
-                    
-                    # CRÍTICO: Alertar equipe sobre falha definitiva
-                    await alertar_falha_webhook_critica(retry_item, db)
-                else:
-                    # Agendar próximo retry com backoff exponencial
-                    backoff_minutes = 2 ** retry_item.attempts  # 1, 2, 4, 8, 16 minutos
-                    retry_item.next_retry = now + timedelta(minutes=backoff_minutes)
-                    logger.warning(f"⚠️ Webhook {retry_item.id} falhou (tentativa {retry_item.attempts}). Próximo retry em {backoff_minutes}min")
-                
-                db.commit()
-        
+        agora = datetime.utcnow()
+        atualizados = db.query(BotModel).filter(
+            BotModel.id == bot_id,
+            filtro_bots_saudaveis()
+        ).update({
+            BotModel.saude_status: BOT_SAUDE_QUARENTENA,
+            BotModel.saude_motivo: motivo,
+            BotModel.saude_falhas: 0,
+            BotModel.saude_desde: agora,
+            BotModel.saude_proxima_sonda: agora + timedelta(minutes=BOT_SONDA_BACKOFF_BASE_MINUTOS)
+        }, synchronize_session=False)
+        db.commit()
+        if atualizados:
+            logger.warning(f"🩺 [SAÚDE] Bot {bot_id} em quarentena ({motivo})")
     except Exception as e:
-        logger.error(f"❌ Erro no processador de webhooks pendentes: {e}")
+        db.rollback()
+        logger.error(f"❌ [SAÚDE] Erro ao colocar bot {bot_id} em quarentena: {e}")
     finally:
         db.close()
 
+def registrar_erro_telegram_bot(bot_id: int, erro: Exception) -> Optional[str]:
+    """Classifica o erro e, se for do bot, coloca-o em quarentena. Retorna o motivo."""
+    motivo = classificar_erro_bot(erro)
+    if motivo:
+        colocar_bot_em_quarentena(bot_id, motivo)
+    return motivo
+
+def liberar_saude_bot(bot: BotModel):
+    """Zera o estado de saúde (ex: token trocado pelo dono)."""
+    bot.saude_status = BOT_SAUDE_OK
+    bot.saude_motivo = None
+    bot.saude_falhas = 0
+    bot.saude_desde = None
+    bot.saude_proxima_sonda = None
+
+async def _sondar_bot(token: str, canal: Optional[str]) -> Optional[str]:
+    """Testa token e acesso ao canal. Retorna o motivo se ainda estiver quebrado."""
+    tg = TelegramAsyncLimitado(token)
+    try:
+        eu = await tg.chamar("getMe")
+        if canal:
+            membro = await tg.chamar("getChatMember", chat_id=int(str(canal).strip()), user_id=eu["id"])
+            if membro.get("status") not in BOT_STATUS_CANAL_OK:
+                return "sem_permissao_canal"
+    except Exception as e:
+        return classificar_erro_bot(e) or "indisponivel"
+    return None
 
-async def alertar_falha_webhook_critica(retry_item: WebhookRetry, db: Session):
+def _carregar_bots_para_sondar() -> List[tuple]:
+    """(id, nome, token, canal) dos bots em quarentena cuja próxima sonda já venceu."""
+    db = SessionJobs()
+    try:
+        return [
+            (bot.id, bot.nome, bot.token, bot.id_canal_vip) for bot in db.query(BotModel).filter(
+                BotModel.saude_status == BOT_SAUDE_QUARENTENA,
+                or_(BotModel.saude_proxima_sonda == None, BotModel.saude_proxima_sonda <= datetime.utcnow())
+            ).all()
+        ]
+    finally:
+        db.close()
+
+def _registrar_sondagem(bot_id: int, token: Optional[str], motivo: Optional[str]):
+    """Grava o resultado de uma sonda em transação curta."""
+    db = SessionJobs()
+    try:
+        bot = db.query(BotModel).filter(BotModel.id == bot_id).first()
+        # O dono pode ter trocado o token (e liberado o bot) durante a sonda
+        if not bot or bot.token != token or bot.saude_status != BOT_SAUDE_QUARENTENA:
+            return
+        if motivo is None:
+            liberar_saude_bot(bot)
+            telegram_clientes.pop(bot.token, None)
+            logger.info(f"🩺 [SAÚDE] Bot {bot.nome} saiu da quarentena")
+        else:
+            bot.saude_motivo = motivo
+            bot.saude_falhas = (bot.saude_falhas or 0) + 1
+            espera = min(
+                timedelta(minutes=BOT_SONDA_BACKOFF_BASE_MINUTOS * (2 ** bot.saude_falhas)),
+                timedelta(hours=BOT_SONDA_BACKOFF_MAX_HORAS)
+            )
+            bot.saude_proxima_sonda = datetime.utcnow() + espera
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def sondar_bots_em_quarentena():
+    """
+    Reavalia só os bots em quarentena cuja próxima sonda já venceu.
+    Nenhuma sessão fica aberta durante as chamadas ao Telegram: lê os bots,
+    fecha, sonda e grava cada resultado numa sessão nova.
+    """
+    try:
+        bots = await asyncio.to_thread(_carregar_bots_para_sondar)
+    except Exception as e:
+        logger.error(f"❌ [SAÚDE] Erro ao carregar bots em quarentena: {e}")
+        return
+
+    for bot_id, nome, token, canal in bots:
+        try:
+            motivo = await _sondar_bot(token, canal) if token else "token_invalido"
+            await asyncio.to_thread(_registrar_sondagem, bot_id, token, motivo)
+        except Exception as e:
+            logger.error(f"❌ [SAÚDE] Erro na sondagem do bot {nome}: {e}")
+
+scheduler.add_job(
+    sondar_bots_em_quarentena,
+    'interval',
+    minutes=BOT_SONDA_BACKOFF_BASE_MINUTOS,
+    id='sondagem_bots_quarentena',
+    replace_existing=True
+)
+logger.info("✅ [SCHEDULER] Job de sondagem de bots em quarentena agendado (5 min)")
+
+# =========================================================
+# ⏳ MOTOR DE EXPIRAÇÃO (HEAP DE PRAZOS)
+# =========================================================
+# Os prazos das assinaturas ativas ficam num min-heap em memória, carregado por
+# faixa dos índices (status, custom_expiration) / (status, data_expiracao).
+# O motor dorme até o próximo prazo, expira os vencidos em lotes por bot e
+# recebe prazos novos/alterados via agendar_expiracao() (aprovação, edição).
+# A cada EXPIRACAO_HORIZONTE_HORAS recarrega a próxima faixa do índice.
+STATUS_ASSINATURA_ATIVA = ('paid', 'approved', 'active')
+EXPIRACAO_HORIZONTE_HORAS = int(os.getenv("EXPIRACAO_HORIZONTE_HORAS", "6"))
+EXPIRACAO_LOTE = int(os.getenv("EXPIRACAO_LOTE", "200"))
+EXPIRACAO_CONCORRENCIA_BOTS = int(os.getenv("EXPIRACAO_CONCORRENCIA_BOTS", "4"))
+EXPIRACAO_AGRUPAMENTO_SEGUNDOS = 1  # Prazos colados saem no mesmo lote
+EXPIRACAO_BACKOFF_SEGUNDOS = int(os.getenv("EXPIRACAO_BACKOFF_SEGUNDOS", "30"))  # Lote que falhou volta ao heap
+MSG_PLANO_VENCIDO = "🚫 <b>Seu plano venceu!</b>\n\nPara renovar, digite /start"
+
+# Heap de (prazo, pedido_id). Entradas cujo prazo não bate mais com
+# expiracao_prazos são obsoletas e descartadas ao sair do heap.
+expiracao_heap: List[tuple] = []
+expiracao_prazos: Dict[int, datetime] = {}
+expiracao_estado = {"horizonte": None, "loop": None, "evento": None}
+expiracao_metricas = {"expirados": 0, "ignorados_admin": 0, "erros": 0, "ultimo_lote": None}
+
+def prazo_expiracao(pedido: Pedido) -> Optional[datetime]:
+    """Prazo efetivo: a data personalizada do admin vence a do plano."""
+    return pedido.custom_expiration or pedido.data_expiracao
+
+def _agendar_expiracao_no_loop(pedido_id: int, prazo: Optional[datetime]):
+    horizonte = expiracao_estado["horizonte"]
+    if prazo is None or (horizonte and prazo > horizonte):
+        # Vitalício ou fora da faixa atual (entra na próxima recarga)
+        expiracao_prazos.pop(pedido_id, None)
+        return
+    expiracao_prazos[pedido_id] = prazo
+    heapq.heappush(expiracao_heap, (prazo, pedido_id))
+    if expiracao_heap[0] == (prazo, pedido_id):
+        expiracao_estado["evento"].set()
+
+def _reagendar_com_backoff(pedido_ids: List[int]):
+    """Devolve ao heap, com um pequeno atraso, os prazos de um lote que falhou."""
+    novo_prazo = datetime.utcnow() + timedelta(seconds=EXPIRACAO_BACKOFF_SEGUNDOS)
+    for pedido_id in pedido_ids:
+        if pedido_id in expiracao_prazos:
+            continue  # Reagendado no meio do caminho: o prazo novo vale
+        _agendar_expiracao_no_loop(pedido_id, novo_prazo)
+
+def agendar_expiracao(pedido_id: int, prazo: Optional[datetime]):
+    """
+    Registra, altera ou remove (prazo=None) o prazo de um pedido no motor.
+    Pode ser chamada de qualquer thread.
+    """
+    loop = expiracao_estado["loop"]
+    if loop is None:
+        return  # Motor ainda não subiu: a carga inicial pega do banco
+    loop.call_soon_threadsafe(_agendar_expiracao_no_loop, pedido_id, prazo)
+
+def _carregar_prazos_expiracao(ate: datetime) -> List[tuple]:
+    """Lê (prazo, pedido_id) de assinaturas ativas com prazo até 'ate'."""
+    db = SessionJobs()
+    try:
+        personalizados = db.query(Pedido.id, Pedido.custom_expiration).filter(
+            Pedido.status.in_(STATUS_ASSINATURA_ATIVA),
+            Pedido.custom_expiration != None,
+            Pedido.custom_expiration <= ate
+        ).all()
+        do_plano = db.query(Pedido.id, Pedido.data_expiracao).filter(
+            Pedido.status.in_(STATUS_ASSINATURA_ATIVA),
+            Pedido.custom_expiration == None,
+            Pedido.data_expiracao != None,
+            Pedido.data_expiracao <= ate
+        ).all()
+        return [(prazo, pedido_id) for pedido_id, prazo in personalizados + do_plano]
+    finally:
+        db.close()
+
+async def _recarregar_horizonte_expiracao():
+    novo_horizonte = datetime.utcnow() + timedelta(hours=EXPIRACAO_HORIZONTE_HORAS)
+    prazos = await asyncio.to_thread(_carregar_prazos_expiracao, novo_horizonte)
+    novos = 0
+    for prazo, pedido_id in prazos:
+        if pedido_id not in expiracao_prazos:
+            expiracao_prazos[pedido_id] = prazo
+            heapq.heappush(expiracao_heap, (prazo, pedido_id))
+            novos += 1
+    expiracao_estado["horizonte"] = novo_horizonte
+    logger.info(f"⏳ [EXPIRAÇÃO] {novos} prazos carregados até {novo_horizonte.strftime('%d/%m %H:%M')} UTC")
+
+def _agrupar_vencidos_por_bot(pedido_ids: List[int]) -> Dict[int, List[int]]:
+    db = SessionJobs()
+    try:
+        grupos: Dict[int, List[int]] = {}
+        for pedido_id, bot_id in db.query(Pedido.id, Pedido.bot_id).filter(Pedido.id.in_(pedido_ids)).all():
+            grupos.setdefault(bot_id, []).append(pedido_id)
+        return grupos
+    finally:
+        db.close()
+
+def _reivindicar_lote_expiracao(bot_id: int, pedido_ids: List[int]) -> Optional[dict]:
+    """
+    Marca um lote de pedidos de um bot como expirado. Bot, canal e admins são
+    lidos uma única vez; o prazo é conferido de novo no banco (pode ter sido
+    renovado) e Pedido/Lead mudam com um UPDATE por tabela.
+    """
+    db = SessionJobs()
+    try:
+        bot_data = db.query(BotModel).filter(BotModel.id == bot_id).first()
+        if bot_em_quarentena(bot_data):
+            # Sem acesso ao canal: os prazos voltam na próxima recarga do horizonte
+            logger.info(f"🩺 [EXPIRAÇÃO] Bot {bot_data.nome} em quarentena, lote adiado")
+            return None
+        admins = {str(t) for (t,) in db.query(BotAdmin.telegram_id).filter(BotAdmin.bot_id == bot_id).all()}
+        if bot_data and bot_data.admin_principal_id:
+            admins.add(str(bot_data.admin_principal_id))
+
+        query = db.query(
+            Pedido.id, Pedido.telegram_id, Pedido.first_name,
+            Pedido.custom_expiration, Pedido.data_expiracao
+        ).filter(
+            Pedido.id.in_(pedido_ids),
+            Pedido.status.in_(STATUS_ASSINATURA_ATIVA)
+        )
+        if engine.dialect.name == "postgresql":
+            # Outro worker pode estar expirando o mesmo lote
+            query = query.with_for_update(skip_locked=True)
+
+        agora = datetime.utcnow()
+        expirar_ids, remover, ignorados_admin = [], [], 0
+        for pedido_id, telegram_id, nome, custom_exp, data_exp in query.all():
+            prazo = custom_exp or data_exp
+            if not prazo or prazo > agora:
+                agendar_expiracao(pedido_id, prazo)  # Renovado/alterado no meio do caminho
+                continue
+            # 🔥 Proteção: Admin nunca é removido
+            if str(telegram_id) in admins:
+                ignorados_admin += 1
+                continue
+            expirar_ids.append(pedido_id)
+            remover.append((str(telegram_id), nome))
+
+        if expirar_ids:
+            db.query(Pedido).filter(Pedido.id.in_(expirar_ids)).update(
+                {Pedido.status: 'expired'}, synchronize_session=False
+            )
+            db.query(Lead).filter(
+                Lead.bot_id == bot_id,
+                Lead.user_id.in_({t for t, _ in remover})
+            ).update({Lead.status: 'expired'}, synchronize_session=False)
+            sincronizar_contatos(db, [(bot_id, t) for t, _ in remover])
+        db.commit()
+
+        return {
+            "nome": bot_data.nome if bot_data else str(bot_id),
+            "token": bot_data.token if bot_data else None,
+            "canal": bot_data.id_canal_vip if bot_data else None,
+            "remover": remover,
+            "ignorados_admin": ignorados_admin,
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def _remover_do_canal(tg: "TelegramAsyncLimitado", bot_id: int, canal_id: int, telegram_id: str, nome: str, bot_nome: str):
+    try:
+        # Kick suave: ban + unban (pode voltar pagando)
+        await tg.chamar("banChatMember", chat_id=canal_id, user_id=int(telegram_id))
+        await tg.chamar("unbanChatMember", chat_id=canal_id, user_id=int(telegram_id), only_if_banned=True)
+        logger.info(f"💀 Usuário vencido removido: {nome} (Bot: {bot_nome})")
+    except Exception as e_kick:
+        err_msg = str(e_kick).lower()
+        if tg.motivo_quarentena:
+            return
+        motivo = classificar_erro_bot(e_kick)
+        if motivo:
+            # Para o restante do lote sem novas chamadas
+            tg.motivo_quarentena = motivo
+            await asyncio.to_thread(colocar_bot_em_quarentena, bot_id, motivo)
+        elif "participant_id_invalid" in err_msg or "user not found" in err_msg:
+            logger.info(f"Usuário {telegram_id} já havia saído.")
+        else:
+            expiracao_metricas["erros"] += 1
+            logger.error(f"Erro ao remover {telegram_id}: {e_kick}")
+        return
+
+    try:
+        await tg.chamar("sendMessage", chat_id=int(telegram_id), text=MSG_PLANO_VENCIDO, parse_mode="HTML")
+    except Exception:
+        pass
+
+async def _expirar_lote_bot(bot_id: int, pedido_ids: List[int]):
+    lote = await asyncio.to_thread(_reivindicar_lote_expiracao, bot_id, pedido_ids)
+    if lote is None:
+        return
+    expiracao_metricas["expirados"] += len(lote["remover"])
+    expiracao_metricas["ignorados_admin"] += lote["ignorados_admin"]
+    if lote["ignorados_admin"]:
+        logger.info(f"👑 {lote['ignorados_admin']} admin(s) ignorados na expiração do bot {lote['nome']}")
+    if not lote["remover"] or not lote["token"] or not lote["canal"]:
+        return
+
+    try:
+        canal_id = int(str(lote["canal"]).strip())
+    except (TypeError, ValueError):
+        logger.error(f"ID do canal inválido para o bot {lote['nome']}")
+        return
+
+    tg = obter_cliente_telegram(lote["token"])
+    await asyncio.gather(*[
+        _remover_do_canal(tg, bot_id, canal_id, telegram_id, nome, lote["nome"])
+        for telegram_id, nome in lote["remover"]
+    ])
+
+async def processar_vencidos(pedido_ids: List[int]):
+    """Divide os vencidos por bot e processa os lotes com concorrência limitada."""
+    grupos = await asyncio.to_thread(_agrupar_vencidos_por_bot, pedido_ids)
+    semaforo = asyncio.Semaphore(EXPIRACAO_CONCORRENCIA_BOTS)
+
+    async def _executar(bot_id, lote):
+        async with semaforo:
+            try:
+                await _expirar_lote_bot(bot_id, lote)
+            except Exception as e:
+                expiracao_metricas["erros"] += 1
+                logger.error(f"❌ [EXPIRAÇÃO] Erro no lote do bot {bot_id}: {e}")
+                # O status é conferido de novo no banco: repetir não expira duas vezes
+                _reagendar_com_backoff(lote)
+
+    await asyncio.gather(*[
+        _executar(bot_id, ids[i:i + EXPIRACAO_LOTE])
+        for bot_id, ids in grupos.items()
+        for i in range(0, len(ids), EXPIRACAO_LOTE)
+    ])
+    expiracao_metricas["ultimo_lote"] = datetime.utcnow().isoformat()
+    logger.info(f"⏳ [EXPIRAÇÃO] {len(pedido_ids)} prazos vencidos processados em {len(grupos)} bot(s)")
+
+async def motor_expiracao():
+    """Dorme até o próximo prazo do heap (ou até ser acordado por um prazo novo)."""
+    evento = expiracao_estado["evento"]
+    while True:
+        try:
+            horizonte = expiracao_estado["horizonte"]
+            if horizonte is None or datetime.utcnow() >= horizonte:
+                await _recarregar_horizonte_expiracao()
+
+            limite = datetime.utcnow() + timedelta(seconds=EXPIRACAO_AGRUPAMENTO_SEGUNDOS)
+            vencidos = []
+            while expiracao_heap and expiracao_heap[0][0] <= limite:
+                prazo, pedido_id = heapq.heappop(expiracao_heap)
+                if expiracao_prazos.get(pedido_id) != prazo:
+                    continue  # Entrada obsoleta
+                del expiracao_prazos[pedido_id]
+                vencidos.append(pedido_id)
+
+            if vencidos:
+                try:
+                    await processar_vencidos(vencidos)
+                except Exception:
+                    _reagendar_com_backoff(vencidos)
+                    raise
+                continue
+
+            evento.clear()
+            proximo = expiracao_estado["horizonte"]
+            if expiracao_heap:
+                proximo = min(proximo, expiracao_heap[0][0])
+            espera = max(0.0, (proximo - datetime.utcnow()).total_seconds())
+            try:
+                await asyncio.wait_for(evento.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ [EXPIRAÇÃO] Erro no motor: {e}")
+            await asyncio.sleep(5)
+
+@app.on_event("startup")
+async def iniciar_motor_expiracao():
+    expiracao_estado["loop"] = asyncio.get_running_loop()
+    expiracao_estado["evento"] = asyncio.Event()
+    asyncio.create_task(motor_expiracao())
+    logger.info("⏳ [EXPIRAÇÃO] Motor de expiração iniciado")
+
+# =========================================================
+# 🚪 RECONCILIAÇÃO DE MEMBROS DOS CANAIS VIP
+# =========================================================
+# O porteiro (new_chat_members) e a expiração dependem de webhooks; se um se
+# perder, quem não pagou fica no canal. Este job percorre a tabela contacts de
+# cada bot em ordem de telegram_id (índice único bot_id + telegram_id), confere
+# com getChatMember quem está em cada canal do bot (padrão + canais dos planos)
+# sem assinatura ativa daquele canal e remove. O cursor de cada bot fica salvo
+# em SystemConfig e o lote de cada bot é proporcional ao seu número de
+# contatos, para que toda volta leve ~MEMBROS_VOLTA_HORAS em qualquer bot.
+MEMBROS_CURSOR_CHAVE = "reconciliacao_membros_cursor"
+MEMBROS_VOLTA_HORAS = float(os.getenv("MEMBROS_VOLTA_HORAS", "24"))
+MEMBROS_LOTE_MINIMO = int(os.getenv("MEMBROS_LOTE_MINIMO", "50"))
+MEMBROS_LOTE_MAXIMO = int(os.getenv("MEMBROS_LOTE_MAXIMO", "2000"))
+MEMBROS_REQ_POR_SEGUNDO = float(os.getenv("MEMBROS_REQ_POR_SEGUNDO", "3"))
+MEMBROS_INTERVALO_MINUTOS = 15
+MEMBROS_STATUS_NO_CANAL = ("member", "restricted")
+
+membros_metricas = {"verificados": 0, "removidos": 0, "voltas_completas": 0, "ultima_execucao": None}
+
+def _ler_cursor_membros(db: Session) -> Dict[int, str]:
+    """{bot_id: último telegram_id verificado}. Valor ilegível recomeça a volta."""
+    config = db.query(SystemConfig).filter(SystemConfig.key == MEMBROS_CURSOR_CHAVE).first()
+    if not config or not config.value:
+        return {}
+    try:
+        dados = json.loads(config.value)
+        return {int(bot_id): str(telegram_id) for bot_id, telegram_id in dados.items()}
+    except (ValueError, AttributeError, TypeError):
+        return {}
+
+def _salvar_cursor_membros(cursores: Dict[int, str]):
+    db = SessionJobs()
+    try:
+        valor = json.dumps({str(bot_id): telegram_id for bot_id, telegram_id in cursores.items()})
+        config = db.query(SystemConfig).filter(SystemConfig.key == MEMBROS_CURSOR_CHAVE).first()
+        if not config:
+            config = SystemConfig(key=MEMBROS_CURSOR_CHAVE)
+            db.add(config)
+        config.value = valor
+        config.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def tamanho_lote_membros(total_contatos: int) -> int:
+    """Fatia por execução para percorrer todos os contatos do bot em ~MEMBROS_VOLTA_HORAS."""
+    execucoes_por_volta = max(1, int(MEMBROS_VOLTA_HORAS * 60 / MEMBROS_INTERVALO_MINUTOS))
+    fatia = -(-total_contatos // execucoes_por_volta)
+    return max(MEMBROS_LOTE_MINIMO, min(MEMBROS_LOTE_MAXIMO, fatia))
+
+def _carregar_lote_membros() -> tuple:
+    """
+    Lê, para cada bot, a próxima fatia de contatos e separa por canal quem está
+    sem direito a ele. Retorna ({bot_id: {..., "canais": {canal: [ids]}}},
+    {bot_id: cursor a salvar}, quantos bots fecharam a volta).
+    """
+    db = SessionJobs()
+    try:
+        cursores = _ler_cursor_membros(db)
+        bots = {
+            b.id: b for b in db.query(BotModel).filter(
+                BotModel.token != None,
+                filtro_bots_saudaveis()
+            ).all()
+        }
+        if not bots:
+            return {}, cursores, 0
+
+        # Canal de cada plano, resolvido como na entrega do webhook
+        canal_por_plano: Dict[int, object] = {}
+        canais_por_bot: Dict[int, set] = {bot_id: set() for bot_id in bots}
+        for plano in db.query(PlanoConfig).filter(PlanoConfig.bot_id.in_(list(bots.keys()))).all():
+            canal = canal_destino_do_plano(bots[plano.bot_id], plano)
+            canal_por_plano[plano.id] = canal
+            if canal:
+                canais_por_bot[plano.bot_id].add(canal)
+        for bot_id, bot in bots.items():
+            padrao = canal_destino_do_plano(bot, None)
+            if padrao:
+                canais_por_bot[bot_id].add(padrao)
+
+        totais = dict(db.query(Contact.bot_id, func.count(Contact.id)).filter(
+            Contact.bot_id.in_([bot_id for bot_id, canais in canais_por_bot.items() if canais])
+        ).group_by(Contact.bot_id).all())
+
+        agora = datetime.utcnow()
+        prazo = func.coalesce(Pedido.custom_expiration, Pedido.data_expiracao)
+        # Bots fora desta execução (quarentena, sem canal) mantêm o cursor
+        lote, proximos, voltas = {}, dict(cursores), 0
+        for bot_id, total in totais.items():
+            bot = bots[bot_id]
+            tamanho = tamanho_lote_membros(total)
+            ids = [t for (t,) in db.query(Contact.telegram_id).filter(
+                Contact.bot_id == bot_id,
+                Contact.telegram_id > cursores.get(bot_id, "")
+            ).order_by(Contact.telegram_id).limit(tamanho).all()]
+
+            if len(ids) == tamanho:
+                proximos[bot_id] = ids[-1]
+            else:
+                proximos[bot_id] = ""
+                voltas += 1
+
+            ids = {t for t in ids if str(t).isdigit()}
+            if not ids:
+                continue
+
+            admins = {str(t) for (t,) in db.query(BotAdmin.telegram_id).filter(BotAdmin.bot_id == bot_id).all()}
+            if bot.admin_principal_id:
+                admins.add(str(bot.admin_principal_id))
+
+            # Direito por canal: assinatura ativa cujo plano entrega naquele canal
+            padrao = canal_destino_do_plano(bot, None)
+            com_direito: Dict[object, set] = {}
+            for telegram_id, plano_id in db.query(Pedido.telegram_id, Pedido.plano_id).filter(
+                Pedido.bot_id == bot_id,
+                Pedido.telegram_id.in_(ids),
+                Pedido.status.in_(STATUS_ASSINATURA_ATIVA),
+                or_(prazo == None, prazo > agora)
+            ).all():
+                canal = canal_por_plano.get(plano_id, padrao)
+                com_direito.setdefault(canal, set()).add(str(telegram_id))
+
+            canais = {}
+            for canal in canais_por_bot[bot_id]:
+                sem_direito = sorted(ids - admins - com_direito.get(canal, set()))
+                if sem_direito:
+                    canais[canal] = sem_direito
+            if canais:
+                lote[bot_id] = {"nome": bot.nome, "token": bot.token, "canais": canais}
+        return lote, proximos, voltas
+    finally:
+        db.close()
+
+async def _verificar_membros_bot(bot_id: int, dados: dict) -> int:
+    tg = TelegramAsyncLimitado(dados["token"], req_por_segundo=MEMBROS_REQ_POR_SEGUNDO)
+    removidos = 0
+    for canal, ids in dados["canais"].items():
+        try:
+            canal_id = int(str(canal).strip())
+        except (TypeError, ValueError):
+            continue
+
+        for telegram_id in ids:
+            try:
+                membro = await tg.chamar("getChatMember", chat_id=canal_id, user_id=int(telegram_id))
+                membros_metricas["verificados"] += 1
+                if membro.get("status") not in MEMBROS_STATUS_NO_CANAL:
+                    continue
+                if membro.get("status") == "restricted" and not membro.get("is_member"):
+                    continue
+
+                await tg.chamar("banChatMember", chat_id=canal_id, user_id=int(telegram_id))
+                await tg.chamar("unbanChatMember", chat_id=canal_id, user_id=int(telegram_id), only_if_banned=True)
+                removidos += 1
+                logger.info(
+                    f"🚪 [MEMBROS] {telegram_id} estava no canal {canal_id} sem assinatura ativa "
+                    f"(Bot: {dados['nome']}), removido"
+                )
+            except Exception as e:
+                motivo = classificar_erro_bot(e)
+                if motivo:
+                    await asyncio.to_thread(colocar_bot_em_quarentena, bot_id, motivo)
+                    return removidos
+                err_msg = str(e).lower()
+                if "participant_id_invalid" not in err_msg and "user not found" not in err_msg:
+                    logger.warning(f"⚠️ [MEMBROS] Erro ao verificar {telegram_id} no bot {dados['nome']}: {e}")
+    return removidos
+
+async def reconciliar_membros_canais():
+    """Uma fatia da volta de reconciliação de cada bot (ver tamanho_lote_membros)."""
+    try:
+        lote, proximos, voltas = await asyncio.to_thread(_carregar_lote_membros)
+        resultados = await asyncio.gather(*[
+            _verificar_membros_bot(bot_id, dados) for bot_id, dados in lote.items()
+        ])
+        await asyncio.to_thread(_salvar_cursor_membros, proximos)
+
+        removidos = sum(resultados)
+        membros_metricas["removidos"] += removidos
+        membros_metricas["ultima_execucao"] = datetime.utcnow().isoformat()
+        membros_metricas["voltas_completas"] += voltas
+        if removidos:
+            logger.info(f"🚪 [MEMBROS] {removidos} membros sem assinatura removidos nesta execução")
+    except Exception as e:
+        logger.error(f"❌ [MEMBROS] Erro na reconciliação de membros: {e}")
+
+scheduler.add_job(
+    reconciliar_membros_canais,
+    'interval',
+    minutes=MEMBROS_INTERVALO_MINUTOS,
+    id='reconciliacao_membros',
+    replace_existing=True
+)
+logger.info("✅ [SCHEDULER] Job de reconciliação de membros agendado (15 min)")
+
+# =========================================================
+# 🔄 SISTEMA DE RETRY DE WEBHOOKS (EXECUTOR CONCORRENTE)
+# =========================================================
+# Cada worker "reivindica" um lote com FOR UPDATE SKIP LOCKED e marca como
+# 'processing' com um prazo (lease). Vários workers podem rodar o job ao mesmo
+# tempo sem pegar o mesmo item; se um worker morrer, o item volta a ficar
+# disponível quando o lease vencer.
+WEBHOOK_RETRY_LOTE = int(os.getenv("WEBHOOK_RETRY_LOTE", "50"))
+WEBHOOK_RETRY_CONCORRENCIA = int(os.getenv("WEBHOOK_RETRY_CONCORRENCIA", "8"))
+WEBHOOK_RETRY_LEASE_MINUTOS = 5
+WEBHOOK_RETRY_BACKOFF_BASE_SEGUNDOS = 60
+WEBHOOK_RETRY_BACKOFF_MAX_SEGUNDOS = 60 * 60
+WEBHOOK_RETRY_TEMPO_MAX_EXECUCAO_SEGUNDOS = 50  # Job roda a cada 1 min
+
+# Métricas em memória deste worker (expostas no /api/health)
+webhook_retry_metricas = {
+    "tentativas": 0,
+    "sucessos": 0,
+    "falhas": 0,
+    "ultima_latencia_ms": None,
+    "latencia_total_ms": 0.0
+}
+
+def calcular_backoff_webhook(tentativas: int) -> timedelta:
+    """Backoff exponencial com jitter (metade fixa + metade aleatória)."""
+    teto = min(
+        WEBHOOK_RETRY_BACKOFF_MAX_SEGUNDOS,
+        WEBHOOK_RETRY_BACKOFF_BASE_SEGUNDOS * (2 ** max(tentativas - 1, 0))
+    )
+    return timedelta(seconds=random.uniform(teto / 2, teto))
+
+def reivindicar_lote_webhooks(limite: int) -> List[int]:
+    """
+    Transação curta que trava e marca um lote de retries como 'processing'.
+    Retorna apenas os IDs; cada item é processado depois em sessão própria.
+    """
+    db = SessionJobs()
+    try:
+        agora = datetime.utcnow()
+        itens = db.query(WebhookRetry).filter(
+            WebhookRetry.attempts < WebhookRetry.max_attempts,
+            or_(
+                and_(
+                    WebhookRetry.status == 'pending',
+                    or_(WebhookRetry.next_retry == None, WebhookRetry.next_retry <= agora)
+                ),
+                # Lease vencido: worker anterior morreu no meio
+                and_(WebhookRetry.status == 'processing', WebhookRetry.next_retry <= agora)
+            )
+        ).order_by(WebhookRetry.next_retry).limit(limite).with_for_update(skip_locked=True).all()
+
+        lease = agora + timedelta(minutes=WEBHOOK_RETRY_LEASE_MINUTOS)
+        for item in itens:
+            item.status = 'processing'
+            item.next_retry = lease
+        db.commit()
+        return [item.id for item in itens]
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ [WEBHOOK-RETRY] Erro ao reivindicar lote: {e}")
+        return []
+    finally:
+        db.close()
+
+class WebhookRetryRequest:
+    """Request mínimo para reenviar o payload salvo ao handler do webhook."""
+    eh_reprocessamento = True
+
+    def __init__(self, payload_str: str):
+        self._payload_str = payload_str
+
+    async def body(self):
+        return self._payload_str.encode('utf-8')
+
+    async def json(self):
+        return json.loads(self._payload_str)
+
+def _iniciar_tentativa_webhook(retry_id: int) -> Optional[tuple]:
+    """Conta a tentativa em transação curta. Retorna (tipo, payload) ou None se o item não é mais nosso."""
+    db = SessionJobs()
+    try:
+        retry_item = db.query(WebhookRetry).filter(WebhookRetry.id == retry_id).first()
+        if not retry_item or retry_item.status != 'processing':
+            return None
+
+        retry_item.attempts += 1
+        logger.info(f"🔄 Tentativa {retry_item.attempts}/{retry_item.max_attempts} para webhook {retry_item.id}")
+        # O handler usa sessão assíncrona própria: grava a tentativa antes
+        db.commit()
+        return retry_item.webhook_type, retry_item.payload
+    finally:
+        db.close()
+
+def _registrar_resultado_webhook(retry_id: int, erro: Optional[str], latencia_ms: int) -> Optional[str]:
+    """Grava o resultado da tentativa e retorna o novo status ('success', 'failed' ou 'pending')."""
+    db = SessionJobs()
+    try:
+        retry_item = db.query(WebhookRetry).filter(WebhookRetry.id == retry_id).first()
+        if not retry_item:
+            return None
+        retry_item.last_latency_ms = latencia_ms
+        retry_item.updated_at = datetime.utcnow()
+
+        if erro is None:
+            retry_item.status = 'success'
+            retry_item.next_retry = None
+            retry_item.last_error = None
+            logger.info(f"✅ Webhook {retry_item.id} reprocessado com sucesso ({latencia_ms}ms)")
+        elif retry_item.webhook_type != 'pushinpay' or retry_item.attempts >= retry_item.max_attempts:
+            retry_item.status = 'failed'
+            retry_item.next_retry = None
+            retry_item.last_error = erro
+            logger.error(f"❌ Webhook {retry_item.id} falhou após {retry_item.attempts} tentativas: {erro}")
+            db.commit()
+
+            # CRÍTICO: Alertar equipe sobre falha definitiva
+            alertar_falha_webhook_critica(retry_item, db)
+            return 'failed'
+        else:
+            espera = calcular_backoff_webhook(retry_item.attempts)
+            retry_item.status = 'pending'
+            retry_item.next_retry = datetime.utcnow() + espera
+            retry_item.last_error = erro
+            logger.warning(
+                f"⚠️ Webhook {retry_item.id} falhou (tentativa {retry_item.attempts}, {latencia_ms}ms). "
+                f"Próximo retry em {int(espera.total_seconds())}s"
+            )
+
+        db.commit()
+        return retry_item.status
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def executar_retry_webhook(retry_id: int):
+    """
+    Processa UMA tentativa e registra a latência.
+    As etapas síncronas (SessionJobs e alerta via TeleBot) rodam em thread,
+    então o loop continua livre para os outros itens do lote.
+    """
+    try:
+        tentativa = await asyncio.to_thread(_iniciar_tentativa_webhook, retry_id)
+        if not tentativa:
+            return
+        webhook_type, payload = tentativa
+
+        inicio = time.perf_counter()
+        erro = None
+        try:
+            if webhook_type == 'pushinpay':
+                async with AsyncSessionLocal() as db_webhook:
+                    resposta = await webhook_pix(WebhookRetryRequest(payload), db_webhook)
+                # Erros fora do processamento (ex.: SELECT do pedido) voltam como
+                # {"status": "error"} em vez de exceção: também contam como falha
+                if isinstance(resposta, dict) and resposta.get("status") == "error":
+                    erro = "Webhook retornou status error"
+            else:
+                erro = "Tipo de webhook não suportado"
+        except HTTPException as e:
+            erro = str(e.detail)
+        except Exception as e:
+            erro = str(e)
+        latencia_ms = int((time.perf_counter() - inicio) * 1000)
+
+        # O handler gravou em outra sessão; o resultado é gravado numa nova
+        status = await asyncio.to_thread(_registrar_resultado_webhook, retry_id, erro, latencia_ms)
+
+        webhook_retry_metricas["tentativas"] += 1
+        webhook_retry_metricas["ultima_latencia_ms"] = latencia_ms
+        webhook_retry_metricas["latencia_total_ms"] += latencia_ms
+        if status == 'success':
+            webhook_retry_metricas["sucessos"] += 1
+        elif status == 'failed':
+            webhook_retry_metricas["falhas"] += 1
+
+    except Exception as e:
+        logger.error(f"❌ [WEBHOOK-RETRY] Erro inesperado no item {retry_id}: {e}")
+
+async def processar_webhooks_pendentes():
+    """
+    Job que roda a cada 1 minuto para reprocessar webhooks que falharam.
+    Drena lotes até esvaziar a fila (ou atingir o tempo máximo do ciclo),
+    com no máximo WEBHOOK_RETRY_CONCORRENCIA itens em paralelo.
+    """
+    inicio = time.monotonic()
+    semaforo = asyncio.Semaphore(WEBHOOK_RETRY_CONCORRENCIA)
+
+    async def com_limite(retry_id: int):
+        async with semaforo:
+            await executar_retry_webhook(retry_id)
+
+    total = 0
+    while time.monotonic() - inicio < WEBHOOK_RETRY_TEMPO_MAX_EXECUCAO_SEGUNDOS:
+        ids = await asyncio.to_thread(reivindicar_lote_webhooks, WEBHOOK_RETRY_LOTE)
+        if not ids:
+            break
+        await asyncio.gather(*(com_limite(retry_id) for retry_id in ids))
+        total += len(ids)
+
+    if total:
+        logger.info(f"🔄 [WEBHOOK-RETRY] {total} webhooks reprocessados em {time.monotonic() - inicio:.1f}s")
+    else:
+        logger.debug("🔄 Nenhum webhook pendente para retry")
+
+scheduler.add_job(
+    processar_webhooks_pendentes,
+    'interval',
+    minutes=1,
+    id='webhook_retry_processor',
+    replace_existing=True
+)
+logger.info("✅ [SCHEDULER] Job de retry de webhooks agendado (1 min)")
+
+
+def alertar_falha_webhook_critica(retry_item: WebhookRetry, db: Session):
     """
     Alerta sobre webhooks que falharam definitivamente.
     Envia notificação para admin via Telegram e registra no banco.
+    Síncrona (TeleBot bloqueia): roda na thread de _registrar_resultado_webhook.
     """
     try:
         # Extrair informações do payload
@@ -2859,7 +3437,7 @@ async def alertar_falha_webhook_critica(retry_item: WebhookRetry, db: Session):
             if admin.telegram_id:
                 try:
                     # Buscar bot principal (primeiro ativo)
-                    bot = db.query(BotModel).filter(BotModel.status == 'ativo').first()
+                    bot = db.query(BotModel).filter(BotModel.status == 'ativo', filtro_bots_saudaveis()).first()
                     if bot:
                         tb = telebot.TeleBot(bot.token)
                         tb.send_message(int(admin.telegram_id), alerta, parse_mode="HTML")
@@ -2930,7 +3508,7 @@ def processar_envio_massivo_background(
     Precisa criar nova sessão aqui.
     """
     # 1. CRIAR NOVA SESSÃO (threads não compartilham conexões)
-    db = SessionLocal()
+    db = SessionJobs()
     
     try:
         logger.info(f"🚀 Iniciando envio background da campanha {campaign_id}")
@@ -2940,6 +3518,11 @@ def processar_envio_massivo_background(
         if not bot_data:
             logger.error(f"❌ Bot {bot_id} não encontrado")
             return
+        if bot_em_quarentena(bot_data):
+            logger.warning(f"🩺 Campanha {campaign_id} não enviada: bot em quarentena ({bot_data.saude_motivo})")
+            db.query(RemarketingCampaign).filter(RemarketingCampaign.id == campaign_id).update({"status": "erro"})
+            db.commit()
+            return
         
         bot = telebot.TeleBot(bot_data.token, threaded=False)
         
@@ -3046,6 +3629,8 @@ def processar_envio_massivo_background(
                 # Usuário bloqueou o bot ou ID inválido
                 erros += 1
                 logger.warning(f"⚠️ Telegram API error para {lead.user_id}: {e}")
+                if registrar_erro_telegram_bot(bot_id, e):
+                    break  # Token revogado: não adianta continuar
             except Exception as e:
                 erros += 1
                 logger.error(f"❌ Erro ao enviar para {lead.user_id}: {e}")
@@ -3081,6 +3666,9 @@ def processar_envio_massivo_background(
 # =========================================================
 # 🔌 INTEGRAÇÃO PUSHIN PAY (DINÂMICA)
 # =========================================================
+# Base da API (sobrescrevível para apontar para um servidor local em testes)
+PUSHINPAY_API_URL = os.getenv("PUSHINPAY_API_URL", "https://api.pushinpay.com.br/api").rstrip("/")
+
 def get_pushin_token():
     """Busca o token no banco, se não achar, tenta variável de ambiente"""
     db = SessionLocal()
@@ -3131,6 +3719,175 @@ def get_plataforma_pushin_id(db: Session) -> str:
         logger.error(f"Erro ao buscar pushin_pay_id da plataforma: {e}")
         return None
 # =========================================================
+# 🛡️ CIRCUIT BREAKER + ORÇAMENTO DE LATÊNCIA (PUSHIN PAY CASHIN)
+# =========================================================
+# Em instabilidade da PushinPay, falhamos rápido em vez de segurar worker e
+# sessão de banco pelo timeout inteiro. Um breaker por conta (token).
+PUSHINPAY_TIMEOUT = httpx.Timeout(float(os.getenv("PUSHINPAY_TIMEOUT_SEGUNDOS", "6")), connect=3.0)
+MSG_PIX_INDISPONIVEL = (
+    "⏳ O sistema de pagamento está instável no momento.\n"
+    "Tente novamente em alguns instantes."
+)
+
+class PushinPayIndisponivel(Exception):
+    """Circuito aberto: a chamada nem foi feita."""
+    pass
+
+class CircuitBreakerPushinPay:
+    """
+    Janela deslizante das últimas N chamadas (sucesso + latência).
+    - fechado: chamadas liberadas
+    - aberto: falha imediata até passar TEMPO_ABERTO
+    - meio_aberto: libera UMA sondagem; sucesso fecha, falha reabre
+    Abre quando a taxa de erro da janela passa de TAXA_ERRO_MAXIMA ou quando
+    o p95 de latência da janela cheia passa de LIMITE_LENTO_MS. Uma sondagem lenta
+    conta como falha.
+    """
+    JANELA = 20
+    MINIMO_CHAMADAS = 5
+    # Com menos de 20 amostras o p95 (nearest-rank) é a própria maior latência:
+    # só a janela cheia decide por lentidão
+    MINIMO_CHAMADAS_P95 = 20
+    TAXA_ERRO_MAXIMA = 0.5
+    LIMITE_LENTO_MS = 4000
+    TEMPO_ABERTO_SEGUNDOS = 30
+
+    def __init__(self, conta: str):
+        self.conta = conta
+        self.resultados = deque(maxlen=self.JANELA)  # (ok, latencia_ms)
+        self.estado = "fechado"
+        self.aberto_desde = 0.0
+        self.sondagem_em_andamento = False
+
+    def permitir(self) -> bool:
+        if self.estado == "fechado":
+            return True
+        if self.estado == "aberto" and time.monotonic() - self.aberto_desde >= self.TEMPO_ABERTO_SEGUNDOS:
+            self.estado = "meio_aberto"
+            self.sondagem_em_andamento = False
+        if self.estado == "meio_aberto" and not self.sondagem_em_andamento:
+            self.sondagem_em_andamento = True
+            return True
+        return False
+
+    def rejeitando(self) -> bool:
+        """True se uma chamada agora seria recusada (sem alterar o estado)."""
+        if self.estado == "aberto":
+            return time.monotonic() - self.aberto_desde < self.TEMPO_ABERTO_SEGUNDOS
+        if self.estado == "meio_aberto":
+            return self.sondagem_em_andamento
+        return False
+
+    def liberar_sondagem(self):
+        """Sondagem cancelada sem resultado: a próxima chamada pode sondar de novo."""
+        if self.estado == "meio_aberto":
+            self.sondagem_em_andamento = False
+
+    def registrar(self, ok: bool, latencia_ms: float):
+        self.resultados.append((ok, latencia_ms))
+
+        if self.estado == "meio_aberto":
+            if ok and latencia_ms <= self.LIMITE_LENTO_MS:
+                logger.info(f"✅ [PUSHINPAY-CB] Conta {self.conta}: sondagem OK, circuito FECHADO")
+                self.estado = "fechado"
+                self.resultados.clear()
+            else:
+                self._abrir()
+            self.sondagem_em_andamento = False
+            return
+
+        if self.estado == "fechado" and len(self.resultados) >= self.MINIMO_CHAMADAS:
+            lento = (
+                len(self.resultados) >= self.MINIMO_CHAMADAS_P95
+                and self.latencia_p95() > self.LIMITE_LENTO_MS
+            )
+            if self.taxa_erro() >= self.TAXA_ERRO_MAXIMA or lento:
+                self._abrir()
+
+    def _abrir(self):
+        self.estado = "aberto"
+        self.aberto_desde = time.monotonic()
+        logger.error(
+            f"🚨 [PUSHINPAY-CB] Conta {self.conta}: circuito ABERTO "
+            f"(erro {self.taxa_erro():.0%}, p95 {self.latencia_p95()}ms)"
+        )
+
+    def taxa_erro(self) -> float:
+        if not self.resultados:
+            return 0.0
+        return sum(1 for ok, _ in self.resultados if not ok) / len(self.resultados)
+
+    def latencia_p95(self):
+        if not self.resultados:
+            return None
+        latencias = sorted(lat for _, lat in self.resultados)
+        # Posição do p95 (nearest-rank): com 20 chamadas é a 19ª, não a maior
+        return int(latencias[-(-len(latencias) * 95 // 100) - 1])
+
+    def metricas(self) -> dict:
+        return {
+            "estado": self.estado,
+            "chamadas_na_janela": len(self.resultados),
+            "taxa_erro": round(self.taxa_erro(), 3),
+            "latencia_p95_ms": self.latencia_p95()
+        }
+
+# {id_conta: CircuitBreakerPushinPay}
+pushinpay_breakers: Dict[str, CircuitBreakerPushinPay] = {}
+
+def obter_breaker_pushinpay(token: str) -> CircuitBreakerPushinPay:
+    # Hash curto do token: identifica a conta sem expor o segredo nas métricas
+    conta = hashlib.sha256(token.encode()).hexdigest()[:12]
+    if conta not in pushinpay_breakers:
+        pushinpay_breakers[conta] = CircuitBreakerPushinPay(conta)
+    return pushinpay_breakers[conta]
+
+def pushinpay_disponivel(token: Optional[str]) -> bool:
+    """Consulta sem efeito colateral (não consome a sondagem do meio-aberto)."""
+    if not token:
+        return True
+    return not obter_breaker_pushinpay(token).rejeitando()
+
+def mensagem_erro_pix() -> str:
+    """Mensagem ao usuário quando o PIX não pôde ser gerado."""
+    if not pushinpay_disponivel(get_pushin_token()):
+        return MSG_PIX_INDISPONIVEL
+    return "❌ Erro ao gerar PIX."
+
+async def chamar_pushinpay_cashin(token: str, payload: dict) -> httpx.Response:
+    """
+    POST /pix/cashIn passando pelo circuit breaker da conta.
+    Levanta PushinPayIndisponivel sem chamar a API quando o circuito está aberto.
+    Respostas 4xx contam como sucesso (erro do pedido, não do provedor).
+    """
+    breaker = obter_breaker_pushinpay(token)
+    if not breaker.permitir():
+        raise PushinPayIndisponivel(f"Circuito aberto para conta {breaker.conta}")
+    sondagem = breaker.estado == "meio_aberto"
+
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+    inicio = time.perf_counter()
+    try:
+        try:
+            response = await http_client.post(
+                f"{PUSHINPAY_API_URL}/pix/cashIn", json=payload, headers=headers, timeout=PUSHINPAY_TIMEOUT
+            )
+        except Exception:
+            breaker.registrar(False, (time.perf_counter() - inicio) * 1000)
+            raise
+        breaker.registrar(response.status_code < 500, (time.perf_counter() - inicio) * 1000)
+        return response
+    finally:
+        # CancelledError (BaseException) não passa pelo except: sem isso a
+        # sondagem ficaria marcada para sempre e o circuito nunca fecharia
+        if sondagem:
+            breaker.liberar_sondagem()
+
+# =========================================================
 # 🔌 INTEGRAÇÃO PUSHIN PAY (CORRIGIDA COM REMARKETING)
 # =========================================================
 async def gerar_pix_pushinpay(
@@ -3163,14 +3920,12 @@ async def gerar_pix_pushinpay(
     if not token:
         logger.error("❌ Token Pushin Pay não configurado!")
         return None
-    
-    url = "https://api.pushinpay.com.br/api/pix/cashIn"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    
+
+    # 🛡️ Falha rápida: circuito aberto não gasta consultas de split nem timeout
+    if not pushinpay_disponivel(token):
+        logger.warning("⚡ [PUSHINPAY-CB] Circuito aberto, PIX não gerado")
+        return None
+
     # URL do Webhook
     seus_dominio = "zenyx-gbs-testesv1-production.up.railway.app" 
     
@@ -3229,14 +3984,17 @@ async def gerar_pix_pushinpay(
         logger.error(f"❌ Erro ao configurar split: {e}. Gerando PIX SEM split.")
         # Continua sem split em caso de erro
     
+    # Nenhuma conexão presa enquanto a PushinPay responde (até 10s)
+    liberar_conexao(db)
+    
     # ========================================
     # 📤 ENVIA REQUISIÇÃO PARA PUSHIN PAY (HTTPX ASYNC)
     # ========================================
     try:
         logger.info(f"📤 Gerando PIX de R$ {valor_float:.2f}. Webhook: https://{seus_dominio}/webhook/pix")
         
-        # ✅ MIGRAÇÃO: requests → httpx
-        response = await http_client.post(url, json=payload, headers=headers, timeout=10)
+        # ✅ MIGRAÇÃO: requests → httpx (com circuit breaker)
+        response = await chamar_pushinpay_cashin(token, payload)
         
         if response.status_code in [200, 201]:
             pix_response = response.json()
@@ -3279,8 +4037,11 @@ async def gerar_pix_pushinpay(
             return None
             
     # 🔥 TRATAMENTO DE ERROS RESTAURADO 🔥
+    except PushinPayIndisponivel:
+        logger.warning("⚡ [PUSHINPAY-CB] Circuito aberto, PIX não gerado")
+        return None
     except httpx.TimeoutException:
-        logger.error("❌ Timeout ao conectar com PushinPay (10s)")
+        logger.error("❌ Timeout ao conectar com PushinPay")
         return None
     except httpx.HTTPError as e:
         logger.error(f"❌ Erro HTTP ao chamar PushinPay: {e}")
@@ -3289,6 +4050,203 @@ async def gerar_pix_pushinpay(
         logger.error(f"❌ Exceção ao gerar PIX: {e}")
         return None
 
+# =========================================================
+# ♻️ REAPROVEITAMENTO DE PIX (CLIQUES REPETIDOS NO CHECKOUT)
+# =========================================================
+# Janela em que um PIX pendente do mesmo (bot, chat, plano, valor) é reenviado
+# em vez de gerar uma nova cobrança na PushinPay.
+PIX_REUSE_WINDOW_MINUTES = int(os.getenv("PIX_REUSE_WINDOW_MINUTES", "10"))
+
+# Single-flight: cobranças idênticas em andamento neste worker {chave: Future}
+pix_em_andamento: Dict[tuple, asyncio.Future] = {}
+
+def buscar_pix_reutilizavel(db: Session, bot_id: int, telegram_id: str, plano_id: int, valor_float: float):
+    """
+    Procura um Pedido pendente, ainda dentro da janela de reuso, com o mesmo
+    bot, chat, plano e valor. Retorna no formato da resposta da PushinPay.
+    """
+    if not plano_id or PIX_REUSE_WINDOW_MINUTES <= 0:
+        return None
+
+    limite = datetime.utcnow() - timedelta(minutes=PIX_REUSE_WINDOW_MINUTES)
+    valor_centavos = int(round(valor_float * 100))
+
+    candidatos = db.query(Pedido).filter(
+        Pedido.bot_id == bot_id,
+        Pedido.telegram_id == str(telegram_id),
+        Pedido.plano_id == plano_id,
+        Pedido.status == 'pending',
+        Pedido.qr_code != None,
+        Pedido.created_at >= limite
+    ).order_by(desc(Pedido.created_at)).limit(5).all()
+
+    for pedido in candidatos:
+        if int(round((pedido.valor or 0) * 100)) == valor_centavos:
+            logger.info(f"♻️ [PIX] Reaproveitando cobrança pendente {pedido.transaction_id} para {telegram_id}")
+            return {
+                "id": pedido.transaction_id,
+                "qr_code_text": pedido.qr_code,
+                "reaproveitado": True
+            }
+    return None
+
+async def obter_pix_checkout(
+    valor_float: float,
+    transaction_id: str,
+    bot_id: int,
+    db: Session,
+    user_telegram_id: str,
+    plano_id: int,
+    user_first_name: str = None,
+    plano_nome: str = None,
+    agendar_remarketing: bool = True
+):
+    """
+    Porta de entrada dos callbacks de checkout.
+    1. Reenvia o PIX pendente se existir um igual dentro da janela de reuso.
+    2. Coalesce cliques simultâneos idênticos em uma única chamada à PushinPay.
+    3. Caso contrário, gera um PIX novo via gerar_pix_pushinpay.
+
+    Respostas com 'reaproveitado': True já possuem Pedido salvo — o chamador
+    não deve inserir outro.
+    """
+    existente = buscar_pix_reutilizavel(db, bot_id, user_telegram_id, plano_id, valor_float)
+    if existente:
+        return existente
+    liberar_conexao(db)
+
+    chave = (bot_id, str(user_telegram_id), plano_id, int(round(valor_float * 100)))
+
+    em_andamento = pix_em_andamento.get(chave)
+    if em_andamento:
+        logger.info(f"⏳ [PIX] Clique repetido de {user_telegram_id}, aguardando cobrança em andamento")
+        resultado = await asyncio.shield(em_andamento)
+        return dict(resultado, reaproveitado=True) if resultado else None
+
+    futuro = asyncio.get_running_loop().create_future()
+    pix_em_andamento[chave] = futuro
+    resultado = None
+    try:
+        resultado = await gerar_pix_pushinpay(
+            valor_float=valor_float,
+            transaction_id=transaction_id,
+            bot_id=bot_id,
+            db=db,
+            user_telegram_id=user_telegram_id,
+            user_first_name=user_first_name,
+            plano_nome=plano_nome,
+            agendar_remarketing=agendar_remarketing
+        )
+        return resultado
+    finally:
+        pix_em_andamento.pop(chave, None)
+        if not futuro.done():
+            futuro.set_result(resultado)
+
+# =========================================================
+# 🧾 RECONCILIAÇÃO DE PIX PENDENTES (WEBHOOK PERDIDO)
+# =========================================================
+# Pedidos 'pending' recentes são consultados direto na PushinPay. Os que já
+# estiverem pagos entram pelo mesmo caminho do webhook (webhook_pix).
+RECONCILIACAO_JANELA_HORAS = int(os.getenv("RECONCILIACAO_JANELA_HORAS", "24"))
+RECONCILIACAO_ATRASO_MINUTOS = 2      # Dá tempo do webhook normal chegar
+RECONCILIACAO_LIMITE_POR_CICLO = 200
+RECONCILIACAO_CONCORRENCIA = 5
+STATUS_PROVEDOR_PAGO = ("paid", "approved", "completed", "succeeded")
+
+async def consultar_status_transacao(client: httpx.AsyncClient, transaction_id: str, tokens: List[str]):
+    """
+    Consulta GET /transactions/{id} na PushinPay.
+    Tenta cada token (bot e plataforma) até achar a transação. Retorna o JSON ou None.
+    """
+    for token in tokens:
+        try:
+            resp = await client.get(
+                f"{PUSHINPAY_API_URL}/transactions/{transaction_id}",
+                headers={"Authorization": f"Bearer {token}", "Accept": "application/json"}
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"⚠️ [RECONCILIAÇÃO] Erro HTTP ao consultar {transaction_id}: {e}")
+            return None
+
+        if resp.status_code == 200:
+            dados = resp.json()
+            if isinstance(dados, list):
+                dados = dados[0] if dados else None
+            return dados
+        if resp.status_code != 404:
+            logger.warning(f"⚠️ [RECONCILIAÇÃO] PushinPay respondeu {resp.status_code} para {transaction_id}")
+            return None
+    return None
+
+async def reconciliar_pedidos_pendentes():
+    """
+    Job periódico: busca pedidos pendentes da janela recente (índice
+    status + created_at), consulta a PushinPay com concorrência limitada e
+    aprova os que já foram pagos.
+    """
+    agora = datetime.utcnow()
+    db = SessionJobs()
+    try:
+        pendentes = db.query(
+            Pedido.transaction_id, Pedido.bot_id, BotModel.pushin_token
+        ).join(
+            BotModel, BotModel.id == Pedido.bot_id
+        ).filter(
+            Pedido.status == 'pending',
+            Pedido.created_at >= agora - timedelta(hours=RECONCILIACAO_JANELA_HORAS),
+            Pedido.created_at <= agora - timedelta(minutes=RECONCILIACAO_ATRASO_MINUTOS),
+            Pedido.transaction_id != None
+        ).order_by(desc(Pedido.created_at)).limit(RECONCILIACAO_LIMITE_POR_CICLO).all()
+    finally:
+        db.close()  # Não segura conexão durante as chamadas externas
+
+    if not pendentes:
+        return 0
+
+    token_plataforma = get_pushin_token()
+    semaforo = asyncio.Semaphore(RECONCILIACAO_CONCORRENCIA)
+    aprovados = 0
+
+    async def verificar(client: httpx.AsyncClient, transaction_id: str, token_bot: Optional[str]):
+        nonlocal aprovados
+        tokens = [t for t in dict.fromkeys([token_bot, token_plataforma]) if t]
+        if not tokens:
+            return
+        async with semaforo:
+            dados = await consultar_status_transacao(client, transaction_id, tokens)
+        if not dados or str(dados.get("status", "")).lower() not in STATUS_PROVEDOR_PAGO:
+            return
+
+        logger.info(f"🧾 [RECONCILIAÇÃO] Pedido {transaction_id} pago sem webhook. Aprovando...")
+        payload = {"id": transaction_id, "status": str(dados.get("status")).lower(), "value": dados.get("value")}
+        try:
+            async with AsyncSessionLocal() as db_item:
+                resposta = await webhook_pix(WebhookRetryRequest(json.dumps(payload)), db_item)
+        except Exception as e:
+            logger.error(f"❌ [RECONCILIAÇÃO] Falha ao aprovar {transaction_id}: {e}")
+            return
+        # "Already paid" (o webhook chegou antes), "Order not found" e erros não contam
+        if isinstance(resposta, dict) and resposta.get("status") == "received":
+            aprovados += 1
+        else:
+            logger.info(f"🧾 [RECONCILIAÇÃO] Pedido {transaction_id} não aprovado aqui: {resposta}")
+
+    limites = httpx.Limits(max_connections=RECONCILIACAO_CONCORRENCIA, max_keepalive_connections=RECONCILIACAO_CONCORRENCIA)
+    async with httpx.AsyncClient(timeout=10.0, limits=limites) as client:
+        await asyncio.gather(*(verificar(client, p.transaction_id, p.pushin_token) for p in pendentes))
+
+    logger.info(f"🧾 [RECONCILIAÇÃO] {len(pendentes)} pendentes verificados, {aprovados} aprovados")
+    return aprovados
+
+scheduler.add_job(
+    reconciliar_pedidos_pendentes,
+    'interval',
+    minutes=3,
+    id='reconciliacao_pix',
+    replace_existing=True
+)
+
 # --- HELPER: Notificar Admin Principal ---
 # --- HELPER: Notificar TODOS os Admins (Principal + Extras) ---
 # --- HELPER: Notificar TODOS os Admins (Principal + Extras) ---
@@ -3668,17 +4626,20 @@ def send_remarketing(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/admin/bots/{bot_id}/remarketing/history")
-def get_remarketing_history(bot_id: int, page: int = 1, limit: int = 10, db: Session = Depends(get_db)):
+def get_remarketing_history(bot_id: int, page: int = 1, limit: int = 10, cursor: Optional[str] = None,
+                            count: str = "exact", db: Session = Depends(get_db)):
     try:
         # Garante limites seguros
         limit = min(limit, 50)
-        skip = (page - 1) * limit
         
         # Query
         query = db.query(RemarketingCampaign).filter(RemarketingCampaign.bot_id == bot_id)
         
-        total = query.count()
-        campanhas = query.order_by(desc(RemarketingCampaign.data_envio)).offset(skip).limit(limit).all()
+        total = contar_total(db, query, count)
+        campanhas, next_cursor = paginar_keyset(
+            query, RemarketingCampaign.data_envio, RemarketingCampaign.id, lambda c: (c.data_envio, c.id),
+            limit, cursor, page
+        )
             
         # Formata Resposta
         data = []
@@ -3697,7 +4658,8 @@ def get_remarketing_history(bot_id: int, page: int = 1, limit: int = 10, db: Ses
             "data": data,
             "total": total,
             "page": page,
-            "total_pages": (total // limit) + (1 if total % limit > 0 else 0)
+            "total_pages": total_de_paginas(total, limit),
+            "next_cursor": next_cursor
         }
     except Exception as e:
         logger.error(f"Erro ao buscar histórico: {e}")
@@ -3744,19 +4706,19 @@ class PixCreateRequest(BaseModel):
 # 💰 2. GERAÇÃO DE PIX (COM SPLIT FORÇADO SEMPRE)
 # =========================================================
 @app.post("/api/pagamento/pix")
-async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
+async def gerar_pix(data: PixCreateRequest, db: AsyncSession = Depends(get_async_db)):
     try:
         logger.info(f"💰 Iniciando pagamento: {data.first_name} (R$ {data.valor})")
         
         # 1. Buscar o Bot
-        bot_atual = db.query(BotModel).filter(BotModel.id == data.bot_id).first()
+        bot_atual = await db.get(BotModel, data.bot_id)
         if not bot_atual:
             raise HTTPException(status_code=404, detail="Bot não encontrado")
 
         # 2. Definir Token e ID da Plataforma
         PLATAFORMA_ID = "9D4FA0F6-5B3A-4A36-ABA3-E55ACDF5794E"
         
-        config_sys = db.query(SystemConfig).filter(SystemConfig.key == "pushin_pay_token").first()
+        config_sys = await db.get(SystemConfig, "pushin_pay_token")
         token_plataforma = config_sys.value if (config_sys and config_sys.value) else os.getenv("PUSHIN_PAY_TOKEN")
 
         pushin_token = bot_atual.pushin_token 
@@ -3787,8 +4749,7 @@ async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
                     tem_order_bump=data.tem_order_bump
                 )
                 db.add(novo_pedido)
-                db.commit()
-                db.refresh(novo_pedido)
+                await db.commit()
                 
                 # ✅ Agenda remarketing (MODO TESTE)
                 try:
@@ -3828,7 +4789,7 @@ async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
         # ======================================================================
         membro_dono = None
         if bot_atual.owner_id:
-            membro_dono = db.query(User).filter(User.id == bot_atual.owner_id).first()
+            membro_dono = await db.get(User, bot_atual.owner_id)
 
         taxa_centavos = 60 
         if membro_dono and hasattr(membro_dono, 'taxa_venda') and membro_dono.taxa_venda:
@@ -3850,14 +4811,10 @@ async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
         # ======================================================================
         # 4. ENVIA (HTTPX ASYNC)
         # ======================================================================
-        url = "https://api.pushinpay.com.br/api/pix/cashIn"
-        headers = { 
-            "Authorization": f"Bearer {pushin_token}", 
-            "Content-Type": "application/json", 
-            "Accept": "application/json" 
-        }
-        
-        req = await http_client.post(url, json=payload, headers=headers, timeout=15)
+        # Leituras encerradas: a conexão do pool "pagamentos" volta antes da
+        # PushinPay (até 10s) e o pedido é gravado numa transação curta nova
+        await db.commit()
+        req = await chamar_pushinpay_cashin(pushin_token, payload)
         
         if req.status_code in [200, 201]:
             resp = req.json()
@@ -3881,8 +4838,7 @@ async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
                 tem_order_bump=data.tem_order_bump
             )
             db.add(novo_pedido)
-            db.commit()
-            db.refresh(novo_pedido)
+            await db.commit()
             
             # ✅ Agenda remarketing (PRODUÇÃO)
             try:
@@ -3949,6 +4905,9 @@ async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
                 detalhe = req.text
             raise HTTPException(status_code=400, detail=f"Erro Gateway: {detalhe}")
 
+    except PushinPayIndisponivel:
+        logger.warning("⚡ [PUSHINPAY-CB] Circuito aberto, PIX do checkout recusado")
+        raise HTTPException(status_code=503, detail=MSG_PIX_INDISPONIVEL, headers={"Retry-After": "30"})
     except httpx.HTTPError as e:
         logger.error(f"❌ Erro HTTP PushinPay: {e}")
         raise HTTPException(status_code=503, detail="Gateway de pagamento indisponível")
@@ -3956,11 +4915,161 @@ async def gerar_pix(data: PixCreateRequest, db: Session = Depends(get_db)):
         logger.error(f"❌ Erro fatal PIX: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# =========================================================
+# 📡 STATUS DO PAGAMENTO EM TEMPO REAL (LONG-POLL / SSE)
+# =========================================================
+# O webhook de pagamento publica a aprovação aqui. Dentro do mesmo worker os
+# clientes em espera são acordados na hora; entre workers o aviso trafega via
+# Postgres LISTEN/NOTIFY no canal abaixo.
+PAGAMENTO_CANAL_NOTIFY = "pagamento_status"
+STATUS_PAGAMENTO_FINAIS = ("approved", "paid", "active")
+PAGAMENTO_LONG_POLL_MAX_SEGUNDOS = 30
+PAGAMENTO_SSE_HEARTBEAT_SEGUNDOS = 15
+PAGAMENTO_SSE_DURACAO_MAX_SEGUNDOS = 15 * 60
+
+# {txid: set(asyncio.Future)}
+pagamento_waiters: Dict[str, set] = {}
+
+def _resolver_waiters_pagamento(txid: str, status: str):
+    """Acorda todos os clientes aguardando este txid (roda no event loop)."""
+    for futuro in pagamento_waiters.pop(txid, set()):
+        if not futuro.done():
+            futuro.set_result(status)
+
+def publicar_status_pagamento(db: Session, pedido: Pedido):
+    """
+    Publica a mudança de status de um pedido para os clientes em espera.
+    Chamar DEPOIS do commit que aprovou o pedido.
+    """
+    ids = {str(i).lower() for i in (pedido.txid, pedido.transaction_id) if i}
+    for txid in ids:
+        _resolver_waiters_pagamento(txid, pedido.status)
+
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        for txid in ids:
+            db.execute(
+                text("SELECT pg_notify(:canal, :payload)"),
+                {"canal": PAGAMENTO_CANAL_NOTIFY, "payload": f"{txid}:{pedido.status}"}
+            )
+        db.commit()
+    except Exception as e:
+        logger.warning(f"⚠️ [PAGAMENTO-PUSH] Falha no NOTIFY: {e}")
+        db.rollback()
+
+def _escutar_notificacoes_pagamento(loop):
+    """
+    Thread dedicada com uma conexão psycopg2 em LISTEN.
+    Repassa cada NOTIFY para o event loop; reconecta sozinha em caso de queda.
+    """
+    import select
+    import psycopg2
+    from database import DATABASE_URL
+
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {PAGAMENTO_CANAL_NOTIFY}; LISTEN {CACHE_PAINEL_CANAL_NOTIFY};")
+            logger.info("📡 [PAGAMENTO-PUSH] LISTEN ativo")
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    aviso = conn.notifies.pop(0)
+                    if aviso.channel == CACHE_PAINEL_CANAL_NOTIFY:
+                        cache_paineis.invalidar(int(aviso.payload) if aviso.payload.isdigit() else None)
+                        continue
+                    txid, _, status = aviso.payload.rpartition(":")
+                    loop.call_soon_threadsafe(_resolver_waiters_pagamento, txid, status)
+        except Exception as e:
+            logger.error(f"❌ [PAGAMENTO-PUSH] Listener caiu, reconectando em 5s: {e}")
+            time.sleep(5)
+        finally:
+            if conn:
+                try: conn.close()
+                except: pass
+
+@app.on_event("startup")
+async def iniciar_listener_pagamentos():
+    if engine.dialect.name != "postgresql":
+        logger.info("ℹ️ [PAGAMENTO-PUSH] Banco sem LISTEN/NOTIFY, usando apenas aviso local")
+        return
+    loop = asyncio.get_running_loop()
+    threading.Thread(target=_escutar_notificacoes_pagamento, args=(loop,), daemon=True).start()
+
+async def _consultar_status_pedido(txid: str) -> str:
+    """Leitura curta: abre e devolve a conexão antes de qualquer espera."""
+    async with AsyncSessionLocal() as db:
+        pedido = (await db.execute(
+            select(Pedido.status).where((Pedido.txid == txid) | (Pedido.transaction_id == txid)).limit(1)
+        )).first()
+        return pedido.status if pedido else "not_found"
+
+async def _aguardar_status_pagamento(txid: str, timeout: float):
+    """
+    Registra o cliente ANTES de consultar o banco (evita perder um aviso que
+    chegue entre a consulta e a espera) e aguarda até `timeout` segundos.
+    """
+    chave = txid.lower()
+    futuro = asyncio.get_running_loop().create_future()
+    pagamento_waiters.setdefault(chave, set()).add(futuro)
+    try:
+        status = await _consultar_status_pedido(txid)
+        if status in STATUS_PAGAMENTO_FINAIS or status == "not_found" or timeout <= 0:
+            return status
+        try:
+            return await asyncio.wait_for(futuro, timeout)
+        except asyncio.TimeoutError:
+            return status
+    finally:
+        waiters = pagamento_waiters.get(chave)
+        if waiters is not None:
+            waiters.discard(futuro)
+            if not waiters:
+                pagamento_waiters.pop(chave, None)
+
 @app.get("/api/pagamento/status/{txid}")
-def check_status(txid: str, db: Session = Depends(get_db)):
-    pedido = db.query(Pedido).filter((Pedido.txid == txid) | (Pedido.transaction_id == txid)).first()
-    if not pedido: return {"status": "not_found"}
-    return {"status": pedido.status}
+async def check_status(txid: str, wait: int = 0):
+    """
+    Status do pagamento. Com ?wait=N (segundos, máx. 30) vira long-poll:
+    a resposta sai assim que o webhook aprovar o pedido ou quando o tempo acabar.
+    """
+    timeout = max(0, min(wait, PAGAMENTO_LONG_POLL_MAX_SEGUNDOS))
+    status = await _aguardar_status_pagamento(txid, timeout)
+    return {"status": status}
+
+@app.get("/api/pagamento/status/{txid}/stream")
+async def stream_status(txid: str):
+    """
+    Server-Sent Events: envia o status atual e fecha o stream quando o pedido
+    for aprovado. Heartbeats periódicos também reconsultam o banco, cobrindo
+    ambientes sem LISTEN/NOTIFY.
+    """
+    async def eventos():
+        inicio = time.monotonic()
+        ultimo = None
+        while True:
+            status = await _aguardar_status_pagamento(txid, PAGAMENTO_SSE_HEARTBEAT_SEGUNDOS)
+            if status != ultimo:
+                yield f"event: status\ndata: {json.dumps({'status': status})}\n\n"
+                ultimo = status
+            else:
+                yield ": keep-alive\n\n"
+            if status in STATUS_PAGAMENTO_FINAIS or status == "not_found":
+                break
+            if time.monotonic() - inicio >= PAGAMENTO_SSE_DURACAO_MAX_SEGUNDOS:
+                break
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # =========================================================
 # 🔔 SISTEMA DE NOTIFICAÇÕES (HELPER)
@@ -4193,7 +5302,8 @@ async def health_check():
             "checks": {
                 "database": {"status": db_status},
                 "scheduler": {"status": scheduler_status},
-                "webhook_retry": webhook_stats
+                "webhook_retry": webhook_stats,
+                "pushinpay": {conta: cb.metricas() for conta, cb in pushinpay_breakers.items()}
             },
             "version": "5.0"
         }
@@ -4220,6 +5330,38 @@ async def health_check_simple():
     """
     return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
 
+@app.get("/api/health/pushinpay")
+async def health_check_pushinpay():
+    """
+    Estado dos circuit breakers da PushinPay por conta.
+    estado_codigo: 0 = fechado, 1 = meio_aberto, 2 = aberto (para alertas).
+    """
+    codigos = {"fechado": 0, "meio_aberto": 1, "aberto": 2}
+    contas = {}
+    for conta, cb in pushinpay_breakers.items():
+        metricas = cb.metricas()
+        metricas["estado_codigo"] = codigos[cb.estado]
+        contas[conta] = metricas
+    return {
+        "contas": contas,
+        "algum_aberto": any(cb.estado != "fechado" for cb in pushinpay_breakers.values()),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@app.get("/api/health/database-pools")
+async def health_check_database_pools():
+    """
+    Métricas dos pools por classe de carga (interativo, pagamentos, analytics, jobs):
+    espera no checkout, saturação (em uso / capacidade), timeouts e conexões
+    retidas por mais de DB_CONEXAO_LONGA_SEGUNDOS. Contadores acumulados desde o boot.
+    """
+    pools = {classe: metricas.snapshot() for classe, metricas in metricas_pools.items()}
+    return {
+        "pools": pools,
+        "saturados": [classe for classe, dados in pools.items() if dados.get("saturacao", 0) >= 0.9],
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 @app.get("/api/auth/me")
 async def get_current_user_info(current_user = Depends(get_current_user)):
     """
@@ -4260,6 +5402,7 @@ def update_own_profile(
         
     db.commit()
     db.refresh(user)
+    cache_paineis.invalidar(user.id)
     return user
 
 # =========================================================
@@ -4379,6 +5522,7 @@ def criar_bot(
         )
         
         logger.info(f"✅ Bot criado: {novo_bot.nome} (ID: {novo_bot.id})")
+        cache_paineis.invalidar(current_user.id)
         
         # 🏁 RETORNO DE SUCESSO (SÓ AGORA!)
         return {"id": novo_bot.id, "nome": novo_bot.nome, "status": "criado", "has_bots": True}
@@ -4494,6 +5638,7 @@ def update_bot(
             
             bot_db.status = "ativo"
             changes["status"] = {"old": old_values["status"], "new": "ativo"}
+            liberar_saude_bot(bot_db)
             
         except Exception as e:
             # 📋 AUDITORIA: Falha ao trocar token
@@ -4583,6 +5728,7 @@ def deletar_bot(
     )
     
     logger.info(f"🗑 Bot deletado: {nome_bot} (Owner: {current_user.username})")
+    cache_paineis.invalidar(current_user.id)
     return {"status": "deletado", "bot_nome": nome_bot}
 # --- NOVA ROTA: LIGAR/DESLIGAR BOT (TOGGLE) ---
 # --- NOVA ROTA: LIGAR/DESLIGAR BOT (TOGGLE) ---
@@ -4720,6 +5866,24 @@ def remover_admin(
 # CORRIGE: Conta LEADS + PEDIDOS (sem duplicatas)
 # ============================================================
 
+def contar_contatos_unicos_por_bot(db: Session, bots_ids: List[int]) -> Dict[int, int]:
+    """
+    Contatos únicos (leads + quem gerou pedido) de vários bots numa consulta só:
+    o UNION deduplica (bot_id, telegram_id) no banco e o GROUP BY conta por bot.
+    """
+    if not bots_ids:
+        return {}
+    contatos = db.query(Lead.bot_id.label("bot_id"), Lead.user_id.label("telegram_id")).filter(
+        Lead.bot_id.in_(bots_ids), Lead.user_id != None
+    ).union(
+        db.query(Pedido.bot_id, Pedido.telegram_id).filter(
+            Pedido.bot_id.in_(bots_ids), Pedido.telegram_id != None
+        )
+    ).subquery()
+    return dict(
+        db.query(contatos.c.bot_id, func.count()).group_by(contatos.c.bot_id).all()
+    )
+
 @app.get("/api/admin/bots")
 def listar_bots(
     db: Session = Depends(get_db),
@@ -4732,31 +5896,18 @@ def listar_bots(
     # 🔒 FILTRA APENAS BOTS DO USUÁRIO
     bots = db.query(BotModel).filter(BotModel.owner_id == current_user.id).all()
     
-    # ... RESTO DO CÓDIGO PERMANECE IGUAL (não mude nada abaixo daqui)
+    # Contatos e receita de todos os bots de uma vez (nada de consulta por bot)
+    bots_ids = [b.id for b in bots]
+    contatos_por_bot = contar_contatos_unicos_por_bot(db, bots_ids)
+    metricas_bots = metricas_diarias_por_bot(db, bots_ids) if bots else {}
+    
     result = []
     for bot in bots:
-        # 1. CONTAGEM DE LEADS ÚNICOS
-        leads_ids = set()
-        leads_query = db.query(Lead.user_id).filter(Lead.bot_id == bot.id).all()
-        for lead in leads_query:
-            leads_ids.add(str(lead.user_id))
-        
-        pedidos_ids = set()
-        pedidos_query = db.query(Pedido.telegram_id).filter(Pedido.bot_id == bot.id).all()
-        for pedido in pedidos_query:
-            pedidos_ids.add(str(pedido.telegram_id))
-        
-        contatos_unicos = leads_ids.union(pedidos_ids)
-        leads_count = len(contatos_unicos)
-        
-        # 2. REVENUE (PAGOS + EXPIRADOS)
-        status_financeiro = ["approved", "paid", "active", "completed", "succeeded", "expired"]
-        vendas_aprovadas = db.query(Pedido).filter(
-            Pedido.bot_id == bot.id,
-            Pedido.status.in_(status_financeiro)
-        ).all()
+        # 1. CONTATOS ÚNICOS (leads + pedidos, sem repetir)
+        leads_count = contatos_por_bot.get(bot.id, 0)
         
-        revenue = sum([v.valor for v in vendas_aprovadas]) if vendas_aprovadas else 0.0
+        # 2. REVENUE (todas as vendas aprovadas, inclusive as que já expiraram)
+        revenue = metricas_bots.get(bot.id, {}).get("revenue_cents", 0) / 100
         
         result.append({
             "id": bot.id,
@@ -4767,6 +5918,12 @@ def listar_bots(
             "admin_principal_id": bot.admin_principal_id,
             "suporte_username": bot.suporte_username,
             "status": bot.status,
+            "saude": {
+                "status": bot.saude_status or BOT_SAUDE_OK,
+                "motivo": bot.saude_motivo,
+                "desde": bot.saude_desde,
+                "proxima_verificacao": bot.saude_proxima_sonda
+            },
             "leads": leads_count,
             "revenue": revenue,
             "created_at": bot.created_at
@@ -5208,53 +6365,44 @@ def list_tracking_folders(
         # 🔥 SEGURANÇA: Lista de IDs dos bots que o usuário realmente possui
         user_bot_ids = [bot.id for bot in current_user.bots]
         
-        # Busca todas as pastas (da mais nova para mais antiga)
-        folders = db.query(TrackingFolder).order_by(desc(TrackingFolder.created_at)).all()
+        # Totais por pasta numa consulta agrupada: links de todos (para saber se
+        # está vazia) e cliques/vendas/faturamento só dos links dos MEUS bots
+        if user_bot_ids:
+            eh_meu = case((TrackingLink.bot_id.in_(user_bot_ids), 1), else_=0)
+        else:
+            eh_meu = literal(0)
+        stats = db.query(
+            TrackingLink.folder_id.label("folder_id"),
+            func.count(TrackingLink.id).label("total_links"),
+            func.sum(eh_meu).label("meus_links"),
+            func.sum(eh_meu * func.coalesce(TrackingLink.clicks, 0)).label("total_clicks"),
+            func.sum(eh_meu * func.coalesce(TrackingLink.vendas, 0)).label("total_vendas"),
+            func.sum(eh_meu * func.coalesce(TrackingLink.faturamento, 0)).label("total_faturamento"),
+        ).group_by(TrackingLink.folder_id).subquery()
+        
+        query = db.query(TrackingFolder, stats).outerjoin(stats, stats.c.folder_id == TrackingFolder.id)
+        
+        # --- LÓGICA DE VISIBILIDADE (BLINDAGEM) ---
+        # Mostra SE tenho links meus lá dentro OU a pasta está vazia OU sou superadmin
+        if not current_user.is_superuser:
+            query = query.filter(or_(
+                stats.c.meus_links > 0,
+                func.coalesce(stats.c.total_links, 0) == 0
+            ))
         
         result = []
-        for f in folders:
-            # Conta links totais na pasta
-            total_links_absoluto = db.query(TrackingLink).filter(TrackingLink.folder_id == f.id).count()
-            
-            # Conta links "meus" (Dos bots vinculados ao meu usuário)
-            meus_links_count = 0
-            stats = None
-            
-            if user_bot_ids:
-                meus_links_count = db.query(TrackingLink).filter(
-                    TrackingLink.folder_id == f.id,
-                    TrackingLink.bot_id.in_(user_bot_ids)
-                ).count()
-                
-                if meus_links_count > 0:
-                    stats = db.query(
-                        func.sum(TrackingLink.clicks).label('total_clicks'),
-                        func.sum(TrackingLink.vendas).label('total_vendas')
-                    ).filter(
-                        TrackingLink.folder_id == f.id,
-                        TrackingLink.bot_id.in_(user_bot_ids)
-                    ).first()
-            
-            # --- LÓGICA DE VISIBILIDADE (BLINDAGEM) ---
-            # Mostra SE:
-            # 1. Tenho links meus lá dentro (meus_links_count > 0)
-            # 2. OU a pasta está vazia (total_links_absoluto == 0)
-            # 3. OU sou superadmin
-            should_show = (meus_links_count > 0) or (total_links_absoluto == 0)
-            
-            if current_user.is_superuser:
-                should_show = True
-
-            if should_show:
-                result.append({
-                    "id": f.id, 
-                    "nome": f.nome, 
-                    "plataforma": f.plataforma, 
-                    "link_count": meus_links_count, # Mostra apenas contagem dos MEUS
-                    "total_clicks": (stats.total_clicks if stats else 0) or 0,
-                    "total_vendas": (stats.total_vendas if stats else 0) or 0,
-                    "created_at": f.created_at
-                })
+        for linha in query.order_by(desc(TrackingFolder.created_at)).all():
+            f = linha[0]
+            result.append({
+                "id": f.id, 
+                "nome": f.nome, 
+                "plataforma": f.plataforma, 
+                "link_count": int(linha.meus_links or 0), # Mostra apenas contagem dos MEUS
+                "total_clicks": int(linha.total_clicks or 0),
+                "total_vendas": int(linha.total_vendas or 0),
+                "total_faturamento": float(linha.total_faturamento or 0),
+                "created_at": f.created_at
+            })
         
         return result
         
@@ -5351,7 +6499,27 @@ def list_tracking_links(
             return []
         query = query.filter(TrackingLink.bot_id.in_(user_bot_ids))
     
-    return query.order_by(desc(TrackingLink.created_at)).all()
+    # Contadores já vêm no próprio link: conversão e ticket saem sem outra consulta
+    links = []
+    for link in query.order_by(desc(TrackingLink.created_at)).all():
+        clicks, vendas = link.clicks or 0, link.vendas or 0
+        faturamento = float(link.faturamento or 0)
+        links.append({
+            "id": link.id,
+            "folder_id": link.folder_id,
+            "bot_id": link.bot_id,
+            "nome": link.nome,
+            "codigo": link.codigo,
+            "origem": link.origem,
+            "clicks": clicks,
+            "leads": link.leads or 0,
+            "vendas": vendas,
+            "faturamento": faturamento,
+            "taxa_conversao": round(vendas / clicks * 100, 2) if clicks else 0.0,
+            "ticket_medio": round(faturamento / vendas, 2) if vendas else 0.0,
+            "created_at": link.created_at
+        })
+    return links
 
 @app.post("/api/admin/tracking/links")
 def create_tracking_link(
@@ -5661,12 +6829,104 @@ def delete_miniapp_category(cat_id: int, db: Session = Depends(get_db)):
 # =========================================================
 # 💳 WEBHOOK PIX (PUSHIN PAY) - V5.0 COM RETRY & MULTI-CANAIS
 # =========================================================
+def canal_destino_do_plano(bot_data, plano):
+    """Canal do plano quando configurado; senão o canal padrão do bot (ID numérico vira int)."""
+    canal = bot_data.id_canal_vip
+    if plano and plano.id_canal_destino and str(plano.id_canal_destino).strip() != "":
+        canal = plano.id_canal_destino
+    if canal is not None and str(canal).strip().replace("-", "").isdigit():
+        canal = int(str(canal).strip())
+    return canal
+
+def _entregar_acesso_telegram(bot_data, pedido, plano, bump_config, target_id: str, texto_validade: str):
+    """
+    Fase do Telegram do webhook de pagamento: convite do canal, mensagens ao
+    cliente (acesso + Order Bump) e aviso ao admin. Só lê objetos já carregados;
+    síncrona, chamada via asyncio.to_thread.
+    """
+    tb = telebot.TeleBot(bot_data.token, threaded=False)
+
+    # Entrega principal
+    try:
+        # 🔥 LÓGICA V7: DEFINIÇÃO INTELIGENTE DO CANAL DE DESTINO 🔥
+        # Se o plano tem um canal específico configurado, usa ele.
+        # Caso contrário, usa o canal padrão configurado no Bot.
+        canal_id_final = canal_destino_do_plano(bot_data, plano)
+        if canal_id_final != canal_destino_do_plano(bot_data, None):
+            logger.info(f"🎯 Usando Canal Específico do Plano: {canal_id_final}")
+        else:
+            logger.info(f"🎯 Usando Canal Padrão do Bot: {canal_id_final}")
+
+        # Tenta desbanir antes (boas práticas)
+        try:
+            tb.unban_chat_member(canal_id_final, int(target_id))
+        except:
+            pass
+
+        # Gera Link Único para o canal decidido acima
+        convite = tb.create_chat_invite_link(
+            chat_id=canal_id_final,
+            member_limit=1,
+            name=f"Venda {pedido.first_name}"
+        )
+
+        msg_cliente = (
+            f"✅ <b>Pagamento Confirmado!</b>\n"
+            f"📅 Validade: <b>{texto_validade}</b>\n\n"
+            f"Seu acesso exclusivo:\n👉 {convite.invite_link}"
+        )
+
+        tb.send_message(int(target_id), msg_cliente, parse_mode="HTML")
+        logger.info(f"✅ Entrega enviada para {target_id} (Canal: {canal_id_final})")
+
+    except Exception as e_main:
+        logger.error(f"❌ Erro na entrega principal (TeleBot): {e_main}")
+        # Fallback: Tenta avisar o usuário que houve erro na geração
+        try:
+            tb.send_message(int(target_id), "✅ Pagamento recebido!\n⚠️ Erro ao gerar link automático. Contate o suporte.")
+        except: pass
+
+    # Entrega Order Bump
+    if pedido.tem_order_bump:
+        try:
+            if bump_config and bump_config.link_acesso:
+                msg_bump = (
+                    f"🎁 <b>BÔNUS LIBERADO!</b>\n\n"
+                    f"👉 <b>{bump_config.nome_produto}</b>\n"
+                    f"🔗 {bump_config.link_acesso}"
+                )
+                tb.send_message(int(target_id), msg_bump, parse_mode="HTML")
+                logger.info("✅ Order Bump entregue")
+        except Exception as e_bump:
+            logger.error(f"❌ Erro Bump: {e_bump}")
+
+    # Notificar Admin
+    try:
+        msg_admin = (
+            f"💰 <b>VENDA REALIZADA!</b>\n\n"
+            f"🤖 Bot: <b>{bot_data.nome}</b>\n"
+            f"👤 Cliente: {pedido.first_name} (@{pedido.username})\n"
+            f"📦 Plano: {pedido.plano_nome}\n"
+            f"💵 Valor: <b>R$ {pedido.valor:.2f}</b>\n"
+            f"📅 Vence em: {texto_validade}"
+        )
+        # Função auxiliar que você já deve ter no código
+        # Se não tiver, substitua por lógica direta de envio
+        if 'notificar_admin_principal' in globals():
+            notificar_admin_principal(bot_data, msg_admin)
+        elif bot_data.admin_principal_id:
+            tb.send_message(bot_data.admin_principal_id, msg_admin, parse_mode="HTML")
+
+    except Exception as e_adm:
+        logger.error(f"❌ Erro notificação admin: {e_adm}")
+
 @app.post("/api/webhooks/pushinpay")
 @app.post("/webhook/pix")
-async def webhook_pix(request: Request, db: Session = Depends(get_db)):
+async def webhook_pix(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Webhook de pagamento com sistema de retry automático e suporte a múltiplos canais VIP.
     Se falhar, agenda reprocessamento com exponential backoff.
+    Usa AsyncSession: os helpers síncronos (conversão, NOTIFY, cache) rodam via run_sync.
     """
     print("🔔 WEBHOOK PIX CHEGOU!")
     
@@ -5696,9 +6956,9 @@ async def webhook_pix(request: Request, db: Session = Depends(get_db)):
             return {"status": "ignored"}
         
         # 3. BUSCAR PEDIDO
-        pedido = db.query(Pedido).filter(
-            (Pedido.txid == tx_id) | (Pedido.transaction_id == tx_id)
-        ).first()
+        pedido = (await db.execute(
+            select(Pedido).where((Pedido.txid == tx_id) | (Pedido.transaction_id == tx_id)).limit(1)
+        )).scalars().first()
         
         if not pedido:
             logger.warning(f"⚠️ Pedido {tx_id} não encontrado")
@@ -5718,7 +6978,7 @@ async def webhook_pix(request: Request, db: Session = Depends(get_db)):
                 try:
                     plano_id_int = int(pedido.plano_id) if str(pedido.plano_id).isdigit() else None
                     if plano_id_int:
-                        plano = db.query(PlanoConfig).filter(PlanoConfig.id == plano_id_int).first()
+                        plano = await db.get(PlanoConfig, plano_id_int)
                 except (ValueError, TypeError):
                     logger.warning(f"⚠️ plano_id inválido: {pedido.plano_id}")
             
@@ -5742,9 +7002,17 @@ async def webhook_pix(request: Request, db: Session = Depends(get_db)):
             pedido.mensagem_enviada = False
             pedido.status_funil = 'fundo'
             pedido.pagou_em = now
-            
-            db.commit()
-            
+            await db.run_sync(marcar_conversao_remarketing, pedido)
+
+            await db.commit()
+
+            # 📡 Avisa checkouts aguardando (long-poll / SSE)
+            await db.run_sync(publicar_status_pagamento, pedido)
+            await db.run_sync(invalidar_cache_paineis_do_bot, pedido.bot_id)
+
+            # ⏳ Entra no motor de expiração
+            agendar_expiracao(pedido.id, data_validade)
+
             # ✅ CANCELAR REMARKETING (PAGAMENTO CONFIRMADO)
             try:
                 chat_id_int = int(pedido.telegram_id) if str(pedido.telegram_id).isdigit() else None
@@ -5767,11 +7035,11 @@ async def webhook_pix(request: Request, db: Session = Depends(get_db)):
             # Atualizar Tracking
             if pedido.tracking_id:
                 try:
-                    t_link = db.query(TrackingLink).filter(TrackingLink.id == pedido.tracking_id).first()
+                    t_link = await db.get(TrackingLink, pedido.tracking_id)
                     if t_link:
                         t_link.vendas += 1
                         t_link.faturamento += pedido.valor
-                        db.commit()
+                        await db.commit()
                 except:
                     pass
             
@@ -5780,113 +7048,46 @@ async def webhook_pix(request: Request, db: Session = Depends(get_db)):
             
             # 5. ENTREGA DO ACESSO (COM LÓGICA MULTI-CANAIS)
             try:
-                bot_data = db.query(BotModel).filter(BotModel.id == pedido.bot_id).first()
+                # admins carregados junto: lazy load não é permitido na sessão assíncrona
+                bot_data = (await db.execute(
+                    select(BotModel).options(selectinload(BotModel.admins)).where(BotModel.id == pedido.bot_id)
+                )).scalars().first()
                 if bot_data:
-                    tb = telebot.TeleBot(bot_data.token, threaded=False)
                     target_id = str(pedido.telegram_id).strip()
                     
                     # Corrigir ID se necessário (busca por username se não for numérico)
                     if not target_id.isdigit():
                         clean_user = str(pedido.username).lower().replace("@", "").strip()
-                        lead = db.query(Lead).filter(
-                            Lead.bot_id == pedido.bot_id,
-                            (func.lower(Lead.username) == clean_user) | 
-                            (func.lower(Lead.username) == f"@{clean_user}")
-                        ).order_by(desc(Lead.created_at)).first()
+                        lead = (await db.execute(
+                            select(Lead).where(
+                                Lead.bot_id == pedido.bot_id,
+                                (func.lower(Lead.username) == clean_user) | 
+                                (func.lower(Lead.username) == f"@{clean_user}")
+                            ).order_by(desc(Lead.created_at)).limit(1)
+                        )).scalars().first()
                         
                         if lead and lead.user_id and lead.user_id.isdigit():
                             target_id = lead.user_id
                             pedido.telegram_id = target_id
-                            db.commit()
                     
-                    if target_id.isdigit():
-                        # Entrega principal
-                        try:
-                            # 🔥 LÓGICA V7: DEFINIÇÃO INTELIGENTE DO CANAL DE DESTINO 🔥
-                            # Se o plano tem um canal específico configurado, usa ele.
-                            # Caso contrário, usa o canal padrão configurado no Bot.
-                            
-                            canal_id_final = bot_data.id_canal_vip # Default
-                            
-                            if plano and plano.id_canal_destino and str(plano.id_canal_destino).strip() != "":
-                                canal_id_final = plano.id_canal_destino
-                                logger.info(f"🎯 Usando Canal Específico do Plano: {canal_id_final}")
-                            else:
-                                logger.info(f"🎯 Usando Canal Padrão do Bot: {canal_id_final}")
-
-                            # Tratamento do ID do canal (remove traços extras se houver)
-                            if str(canal_id_final).replace("-", "").isdigit():
-                                canal_id_final = int(str(canal_id_final).strip())
-                            
-                            # Tenta desbanir antes (boas práticas)
-                            try:
-                                tb.unban_chat_member(canal_id_final, int(target_id))
-                            except:
-                                pass
-                            
-                            # Gera Link Único para o canal decidido acima
-                            convite = tb.create_chat_invite_link(
-                                chat_id=canal_id_final,
-                                member_limit=1,
-                                name=f"Venda {pedido.first_name}"
-                            )
-                            
-                            msg_cliente = (
-                                f"✅ <b>Pagamento Confirmado!</b>\n"
-                                f"📅 Validade: <b>{texto_validade}</b>\n\n"
-                                f"Seu acesso exclusivo:\n👉 {convite.invite_link}"
-                            )
-                            
-                            tb.send_message(int(target_id), msg_cliente, parse_mode="HTML")
-                            logger.info(f"✅ Entrega enviada para {target_id} (Canal: {canal_id_final})")
-                            
-                        except Exception as e_main:
-                            logger.error(f"❌ Erro na entrega principal (TeleBot): {e_main}")
-                            # Fallback: Tenta avisar o usuário que houve erro na geração
-                            try:
-                                tb.send_message(int(target_id), "✅ Pagamento recebido!\n⚠️ Erro ao gerar link automático. Contate o suporte.")
-                            except: pass
-                        
-                        # Entrega Order Bump
-                        if pedido.tem_order_bump:
-                            try:
-                                bump_config = db.query(OrderBumpConfig).filter(
-                                    OrderBumpConfig.bot_id == bot_data.id
-                                ).first()
-                                
-                                if bump_config and bump_config.link_acesso:
-                                    msg_bump = (
-                                        f"🎁 <b>BÔNUS LIBERADO!</b>\n\n"
-                                        f"👉 <b>{bump_config.nome_produto}</b>\n"
-                                        f"🔗 {bump_config.link_acesso}"
-                                    )
-                                    tb.send_message(int(target_id), msg_bump, parse_mode="HTML")
-                                    logger.info("✅ Order Bump entregue")
-                            except Exception as e_bump:
-                                logger.error(f"❌ Erro Bump: {e_bump}")
-                        
-                        # Notificar Admin
+                    # Order Bump lido antes: a fase do Telegram (convite + mensagens) roda sem conexão
+                    bump_config = None
+                    if pedido.tem_order_bump:
                         try:
-                            msg_admin = (
-                                f"💰 <b>VENDA REALIZADA!</b>\n\n"
-                                f"🤖 Bot: <b>{bot_data.nome}</b>\n"
-                                f"👤 Cliente: {pedido.first_name} (@{pedido.username})\n"
-                                f"📦 Plano: {pedido.plano_nome}\n"
-                                f"💵 Valor: <b>R$ {pedido.valor:.2f}</b>\n"
-                                f"📅 Vence em: {texto_validade}"
-                            )
-                            # Função auxiliar que você já deve ter no código
-                            # Se não tiver, substitua por lógica direta de envio
-                            if 'notificar_admin_principal' in globals():
-                                notificar_admin_principal(bot_data, msg_admin)
-                            elif bot_data.admin_principal_id:
-                                tb.send_message(bot_data.admin_principal_id, msg_admin, parse_mode="HTML")
-
-                        except Exception as e_adm:
-                            logger.error(f"❌ Erro notificação admin: {e_adm}")
-                        
+                            bump_config = (await db.execute(
+                                select(OrderBumpConfig).where(OrderBumpConfig.bot_id == bot_data.id).limit(1)
+                            )).scalars().first()
+                        except Exception as e_bump:
+                            logger.error(f"❌ Erro Bump: {e_bump}")
+                    await db.commit()
+                    
+                    if target_id.isdigit():
+                        # TeleBot é bloqueante: a entrega roda em thread para não travar o loop
+                        await asyncio.to_thread(
+                            _entregar_acesso_telegram, bot_data, pedido, plano, bump_config, target_id, texto_validade
+                        )
                         pedido.mensagem_enviada = True
-                        db.commit()
+                        await db.commit()
                         
             except Exception as e_tg:
                 logger.error(f"❌ Erro Telegram/Entrega Geral: {e_tg}")
@@ -5900,8 +7101,10 @@ async def webhook_pix(request: Request, db: Session = Depends(get_db)):
             logger.error(f"❌ ERRO no processamento do webhook: {e_process}")
             
             # Registrar para retry (se a função existir no seu escopo global)
-            if 'registrar_webhook_para_retry' in globals():
-                registrar_webhook_para_retry(
+            # Reprocessamentos não criam novo registro: o executor já controla as tentativas
+            if 'registrar_webhook_para_retry' in globals() and not getattr(request, "eh_reprocessamento", False):
+                await asyncio.to_thread(
+                    registrar_webhook_para_retry,
                     webhook_type='pushinpay',
                     payload=data,
                     reference_id=tx_id
@@ -6023,12 +7226,14 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
     
     bot_db = db.query(BotModel).filter(BotModel.token == token).first()
     if not bot_db or bot_db.status == "pausado": return {"status": "ignored"}
+    liberar_conexao(db)
 
     try:
         body = await req.json()
         update = telebot.types.Update.de_json(body)
         # 🔥 FIX: threaded=False obriga o envio a acontecer AGORA, sem criar thread paralela
-        bot_temp = telebot.TeleBot(token, threaded=False)
+        # TeleBotSemConexao: a conexão do banco é devolvida antes de cada chamada ao Telegram
+        bot_temp = TeleBotSemConexao(telebot.TeleBot(token, threaded=False), db)
         message = update.message if update.message else None
         
         # ----------------------------------------
@@ -6358,39 +7563,41 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                     mytx = str(uuid.uuid4())
                     
                     # Passamos agendar_remarketing=False para NÃO reiniciar o ciclo de mensagens
-                    pix = await gerar_pix_pushinpay(
+                    pix = await obter_pix_checkout(
                         valor_float=preco_promo,
                         transaction_id=mytx,
                         bot_id=bot_db.id,
                         db=db,
                         user_telegram_id=str(chat_id),
+                        plano_id=plano.id,
                         user_first_name=first_name,
                         plano_nome=f"{plano.nome_exibicao} (OFERTA)",
                         agendar_remarketing=False  # <--- BLOQUEIA O RESTART DO CICLO
                     )
-                    
+
                     if pix:
                         qr = pix.get('qr_code_text') or pix.get('qr_code')
                         txid = str(pix.get('id') or mytx).lower()
-                        
-                        # Salva pedido
-                        novo_pedido = Pedido(
-                            bot_id=bot_db.id,
-                            telegram_id=str(chat_id),
-                            first_name=first_name,
-                            username=username,
-                            plano_nome=f"{plano.nome_exibicao} (PROMO {desconto_percentual}% OFF)",
-                            plano_id=plano.id,
-                            valor=preco_promo,
-                            transaction_id=txid,
-                            qr_code=qr,
-                            status="pending",
-                            tem_order_bump=False,
-                            created_at=datetime.utcnow(),
-                            tracking_id=track_id_pedido
-                        )
-                        db.add(novo_pedido)
-                        db.commit()
+
+                        # Salva pedido (PIX reaproveitado já tem pedido)
+                        if not pix.get('reaproveitado'):
+                            novo_pedido = Pedido(
+                                bot_id=bot_db.id,
+                                telegram_id=str(chat_id),
+                                first_name=first_name,
+                                username=username,
+                                plano_nome=f"{plano.nome_exibicao} (PROMO {desconto_percentual}% OFF)",
+                                plano_id=plano.id,
+                                valor=preco_promo,
+                                transaction_id=txid,
+                                qr_code=qr,
+                                status="pending",
+                                tem_order_bump=False,
+                                created_at=datetime.utcnow(),
+                                tracking_id=track_id_pedido
+                            )
+                            db.add(novo_pedido)
+                            db.commit()
                         
                         try:
                             bot_temp.delete_message(chat_id, msg_wait.message_id)
@@ -6421,7 +7628,7 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                             bot_temp.delete_message(chat_id, msg_wait.message_id)
                         except:
                             pass
-                        bot_temp.send_message(chat_id, "❌ Erro ao gerar PIX.")
+                        bot_temp.send_message(chat_id, mensagem_erro_pix())
                         
                 except Exception as e:
                     logger.error(f"❌ Erro no handler checkout_promo_: {str(e)}", exc_info=True)
@@ -6509,39 +7716,41 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                     mytx = str(uuid.uuid4())
                     
                     # 🔥 NÃO REINICIA O CICLO DE REMARKETING
-                    pix = await gerar_pix_pushinpay(
+                    pix = await obter_pix_checkout(
                         valor_float=valor_final,
                         transaction_id=mytx,
                         bot_id=bot_db.id,
                         db=db,
                         user_telegram_id=str(chat_id),
+                        plano_id=plano.id,
                         user_first_name=first_name,
                         plano_nome=f"{plano.nome_exibicao} (OFERTA AUTOMÁTICA)",
                         agendar_remarketing=False  # <--- BLOQUEIA O RESTART DO CICLO
                     )
-                    
+
                     if pix:
                         qr = pix.get('qr_code_text') or pix.get('qr_code')
                         txid = str(pix.get('id') or mytx).lower()
-                        
-                        # Salva pedido
-                        novo_pedido = Pedido(
-                            bot_id=bot_db.id,
-                            telegram_id=str(chat_id),
-                            first_name=first_name,
-                            username=username,
-                            plano_nome=f"{plano.nome_exibicao} (PROMO {desconto_percentual}% OFF)" if desconto_percentual > 0 else plano.nome_exibicao,
-                            plano_id=plano.id,
-                            valor=valor_final,
-                            transaction_id=txid,
-                            qr_code=qr,
-                            status="pending",
-                            tem_order_bump=False,
-                            created_at=datetime.utcnow(),
-                            tracking_id=track_id_pedido
-                        )
-                        db.add(novo_pedido)
-                        db.commit()
+
+                        # Salva pedido (PIX reaproveitado já tem pedido)
+                        if not pix.get('reaproveitado'):
+                            novo_pedido = Pedido(
+                                bot_id=bot_db.id,
+                                telegram_id=str(chat_id),
+                                first_name=first_name,
+                                username=username,
+                                plano_nome=f"{plano.nome_exibicao} (PROMO {desconto_percentual}% OFF)" if desconto_percentual > 0 else plano.nome_exibicao,
+                                plano_id=plano.id,
+                                valor=valor_final,
+                                transaction_id=txid,
+                                qr_code=qr,
+                                status="pending",
+                                tem_order_bump=False,
+                                created_at=datetime.utcnow(),
+                                tracking_id=track_id_pedido
+                            )
+                            db.add(novo_pedido)
+                            db.commit()
                         
                         try:
                             bot_temp.delete_message(chat_id, msg_wait.message_id)
@@ -6579,7 +7788,7 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                             bot_temp.delete_message(chat_id, msg_wait.message_id)
                         except:
                             pass
-                        bot_temp.send_message(chat_id, "❌ Erro ao gerar PIX.")
+                        bot_temp.send_message(chat_id, mensagem_erro_pix())
                         
                 except Exception as e:
                     logger.error(f"❌ Erro no handler remarketing_plano_: {str(e)}", exc_info=True)
@@ -6619,12 +7828,13 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                     mytx = str(uuid.uuid4())
                     
                     # Gera PIX com remarketing integrado
-                    pix = await gerar_pix_pushinpay(
+                    pix = await obter_pix_checkout(
                         valor_float=plano.preco_atual,
                         transaction_id=mytx,
                         bot_id=bot_db.id,
                         db=db,
                         user_telegram_id=str(chat_id),  # ✅ PASSA TELEGRAM ID
+                        plano_id=plano.id,
                         user_first_name=first_name,     # ✅ PASSA NOME
                         plano_nome=plano.nome_exibicao  # ✅ PASSA PLANO
                     )
@@ -6632,25 +7842,26 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                     if pix:
                         qr = pix.get('qr_code_text') or pix.get('qr_code')
                         txid = str(pix.get('id') or mytx).lower()
-                        
-                        # Salva pedido
-                        novo_pedido = Pedido(
-                            bot_id=bot_db.id,
-                            telegram_id=str(chat_id),
-                            first_name=first_name,
-                            username=username,
-                            plano_nome=plano.nome_exibicao,
-                            plano_id=plano.id,
-                            valor=plano.preco_atual,
-                            transaction_id=txid,
-                            qr_code=qr,
-                            status="pending",
-                            tem_order_bump=False,
-                            created_at=datetime.utcnow(),
-                            tracking_id=track_id_pedido
-                        )
-                        db.add(novo_pedido)
-                        db.commit()
+
+                        # Salva pedido (PIX reaproveitado já tem pedido)
+                        if not pix.get('reaproveitado'):
+                            novo_pedido = Pedido(
+                                bot_id=bot_db.id,
+                                telegram_id=str(chat_id),
+                                first_name=first_name,
+                                username=username,
+                                plano_nome=plano.nome_exibicao,
+                                plano_id=plano.id,
+                                valor=plano.preco_atual,
+                                transaction_id=txid,
+                                qr_code=qr,
+                                status="pending",
+                                tem_order_bump=False,
+                                created_at=datetime.utcnow(),
+                                tracking_id=track_id_pedido
+                            )
+                            db.add(novo_pedido)
+                            db.commit()
                         
                         try:
                             bot_temp.delete_message(chat_id, msg_wait.message_id)
@@ -6673,7 +7884,7 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                         bot_temp.send_message(chat_id, msg_pix, parse_mode="HTML", reply_markup=markup_pix)
                         
                     else:
-                        bot_temp.send_message(chat_id, "❌ Erro ao gerar PIX.")
+                        bot_temp.send_message(chat_id, mensagem_erro_pix())
 
             # --- C) BUMP YES/NO ---
             elif data.startswith("bump_yes_") or data.startswith("bump_no_"):
@@ -6702,38 +7913,40 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                 mytx = str(uuid.uuid4())
 
                 # Gera PIX com remarketing integrado
-                pix = await gerar_pix_pushinpay(
+                pix = await obter_pix_checkout(
                     valor_float=valor_final,
                     transaction_id=mytx,
                     bot_id=bot_db.id,
                     db=db,
                     user_telegram_id=str(chat_id),  # ✅ PASSA TELEGRAM ID
+                    plano_id=plano.id,
                     user_first_name=first_name,     # ✅ PASSA NOME
                     plano_nome=nome_final           # ✅ PASSA PLANO
                 )
-                
+
                 if pix:
                     qr = pix.get('qr_code_text') or pix.get('qr_code')
                     txid = str(pix.get('id') or mytx).lower()
-                    
-                    # Salva pedido
-                    novo_pedido = Pedido(
-                        bot_id=bot_db.id,
-                        telegram_id=str(chat_id),
-                        first_name=first_name,
-                        username=username,
-                        plano_nome=nome_final,
-                        plano_id=plano.id,
-                        valor=valor_final,
-                        transaction_id=txid,
-                        qr_code=qr,
-                        status="pending",
-                        tem_order_bump=aceitou,
-                        created_at=datetime.utcnow(),
-                        tracking_id=track_id_pedido
-                    )
-                    db.add(novo_pedido)
-                    db.commit()
+
+                    # Salva pedido (PIX reaproveitado já tem pedido)
+                    if not pix.get('reaproveitado'):
+                        novo_pedido = Pedido(
+                            bot_id=bot_db.id,
+                            telegram_id=str(chat_id),
+                            first_name=first_name,
+                            username=username,
+                            plano_nome=nome_final,
+                            plano_id=plano.id,
+                            valor=valor_final,
+                            transaction_id=txid,
+                            qr_code=qr,
+                            status="pending",
+                            tem_order_bump=aceitou,
+                            created_at=datetime.utcnow(),
+                            tracking_id=track_id_pedido
+                        )
+                        db.add(novo_pedido)
+                        db.commit()
                     
                     try:
                         bot_temp.delete_message(chat_id, msg_wait.message_id)
@@ -6756,7 +7969,7 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
                     bot_temp.send_message(chat_id, msg_pix, parse_mode="HTML", reply_markup=markup_pix)
                     
                 else:
-                    bot_temp.send_message(chat_id, "❌ Erro ao gerar PIX.")
+                    bot_temp.send_message(chat_id, mensagem_erro_pix())
 
             # --- D) PROMO (Campanhas Manuais / Antigas) ---
            # --- D) PROMO (Campanhas Manuais) - LÓGICA BLINDADA ---
@@ -6904,13 +8117,15 @@ async def receber_update_telegram(token: str, req: Request, db: Session = Depend
 # ROTA 1: LISTAR LEADS (TOPO DO FUNIL)
 # ============================================================
 # ============================================================
-# ROTA 1: LISTAR LEADS (DEDUPLICAÇÃO FORÇADA NA MEMÓRIA)
+# ROTA 1: LISTAR LEADS (UM POR CONTATO, VIA TABELA CONTACTS)
 # ============================================================
 @app.get("/api/admin/leads")
 async def listar_leads(
     bot_id: Optional[int] = None,
     page: int = 1,
     per_page: int = 50,
+    cursor: Optional[str] = None,
+    count: str = "exact",
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -6922,75 +8137,45 @@ async def listar_leads(
 
         bots_alvo = [bot_id] if (bot_id and bot_id in user_bot_ids) else user_bot_ids
 
-        # 2. BUSCA TUDO (Sem paginação no SQL)
-        raw_leads = db.query(Lead).filter(
-            Lead.bot_id.in_(bots_alvo),
+        # 2. Lead mais recente de cada contato, paginado no SQL (tabela contacts)
+        query = db.query(Lead).join(Contact, Contact.lead_id == Lead.id).filter(
+            Contact.bot_id.in_(bots_alvo),
             Lead.status != "convertido"  # Exclui convertidos
-        ).order_by(Lead.created_at.desc()).all()
-        
-        # 3. O FILTRO "PENTE FINO" 🧹
-        leads_unicos = {}
-        
-        for lead in raw_leads:
-            # TRATAMENTO AGRESSIVO DE ID
-            # Remove espaços, converte pra string, força minúsculo
-            tid_sujo = str(lead.user_id)
-            tid_limpo = tid_sujo.strip().replace(" ", "")
-            
-            # Chave única: Bot + ID Limpo
-            key = f"{lead.bot_id}_{tid_limpo}"
-            
-            # Se a chave ainda não existe, adicionamos.
-            # Como a lista vem ordenada do MAIS NOVO, o primeiro que entra é o atual.
-            # Os próximos (mais velhos) serão ignorados.
-            if key not in leads_unicos:
-                
-                # Tratamento de datas seguro
-                data_criacao = None
-                if lead.created_at:
-                    data_criacao = lead.created_at.isoformat()
-
-                primeiro_contato = None
-                if lead.primeiro_contato:
-                    primeiro_contato = lead.primeiro_contato.isoformat()
-                    
-                ultimo_contato = None
-                if lead.ultimo_contato:
-                    ultimo_contato = lead.ultimo_contato.isoformat()
-
-                # Tenta pegar expiration com segurança
-                expiration = getattr(lead, 'expiration_date', None)
-                expiration_str = expiration.isoformat() if expiration else None
-
-                leads_unicos[key] = {
-                    "id": lead.id,
-                    "user_id": tid_limpo, # Retorna o ID limpo
-                    "nome": lead.nome or "Sem nome",
-                    "username": lead.username,
-                    "bot_id": lead.bot_id,
-                    "status": lead.status,
-                    "funil_stage": lead.funil_stage,
-                    "primeiro_contato": primeiro_contato,
-                    "ultimo_contato": ultimo_contato,
-                    "total_remarketings": lead.total_remarketings,
-                    "ultimo_remarketing": lead.ultimo_remarketing.isoformat() if lead.ultimo_remarketing else None,
-                    "created_at": data_criacao,
-                    "expiration_date": expiration_str
-                }
-        
-        # 4. PAGINAÇÃO MANUAL
-        lista_final = list(leads_unicos.values())
-        total = len(lista_final)
+        )
+        total = contar_total(db, query, count)
+        leads, next_cursor = paginar_keyset(
+            query.add_columns(Contact.lead_created_at, Contact.id),
+            Contact.lead_created_at, Contact.id, lambda linha: (linha[1], linha[2]),
+            per_page, cursor, page
+        )
+        leads = [linha[0] for linha in leads]
         
-        offset = (page - 1) * per_page
-        paginated_data = lista_final[offset:offset + per_page]
+        paginated_data = []
+        for lead in leads:
+            expiration = getattr(lead, 'expiration_date', None)
+            paginated_data.append({
+                "id": lead.id,
+                "user_id": str(lead.user_id).strip().replace(" ", ""),
+                "nome": lead.nome or "Sem nome",
+                "username": lead.username,
+                "bot_id": lead.bot_id,
+                "status": lead.status,
+                "funil_stage": lead.funil_stage,
+                "primeiro_contato": lead.primeiro_contato.isoformat() if lead.primeiro_contato else None,
+                "ultimo_contato": lead.ultimo_contato.isoformat() if lead.ultimo_contato else None,
+                "total_remarketings": lead.total_remarketings,
+                "ultimo_remarketing": lead.ultimo_remarketing.isoformat() if lead.ultimo_remarketing else None,
+                "created_at": lead.created_at.isoformat() if lead.created_at else None,
+                "expiration_date": expiration.isoformat() if expiration else None
+            })
         
         return {
             "data": paginated_data,
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page if per_page > 0 else 0
+            "total_pages": total_de_paginas(total, per_page),
+            "next_cursor": next_cursor
         }
     
     except Exception as e:
@@ -7009,66 +8194,41 @@ async def listar_leads(
 # ============================================================
 @app.get("/api/admin/contacts/funnel-stats")
 async def obter_estatisticas_funil(
+    request: Request,
     bot_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_analytics),
     current_user: User = Depends(get_current_user)
 ):
     try:
-        user_bot_ids = [bot.id for bot in current_user.bots]
-        if not user_bot_ids:
-            return {"topo": 0, "meio": 0, "fundo": 0, "expirados": 0, "total": 0}
-
-        bots_alvo = [bot_id] if (bot_id and bot_id in user_bot_ids) else user_bot_ids
-
-        # 1. Busca IDs únicos de cada etapa no banco
-        # TOPO (Leads que não converteram)
-        ids_topo = db.query(Lead.user_id).filter(
-            Lead.bot_id.in_(bots_alvo),
-            Lead.status != "convertido"
-        ).distinct().all()
-        
-        # MEIO (Pedidos pendentes)
-        ids_meio = db.query(Pedido.telegram_id).filter(
-            Pedido.bot_id.in_(bots_alvo),
-            Pedido.status == 'pending'
-        ).distinct().all()
-        
-        # FUNDO (Clientes pagos)
-        ids_fundo = db.query(Pedido.telegram_id).filter(
-            Pedido.bot_id.in_(bots_alvo),
-            Pedido.status.in_(['paid', 'active', 'approved'])
-        ).distinct().all()
-        
-        # EXPIRADOS
-        ids_expirados = db.query(Pedido.telegram_id).filter(
-            Pedido.bot_id.in_(bots_alvo),
-            Pedido.status == 'expired'
-        ).distinct().all()
-
-        # 2. Converte para Sets para garantir unicidade e limpeza de strings
-        def extrair_e_limpar(lista_tuplas):
-            return {str(item[0]).strip() for item in lista_tuplas if item[0]}
-
-        set_topo = extrair_e_limpar(ids_topo)
-        set_meio = extrair_e_limpar(ids_meio)
-        set_fundo = extrair_e_limpar(ids_fundo)
-        set_expirados = extrair_e_limpar(ids_expirados)
-
-        # 3. O GRANDE TRUQUE: O Total é a união de todos os IDs sem repetir ninguém
-        total_unicos = set_topo.union(set_meio).union(set_fundo).union(set_expirados)
-
-        return {
-            "topo": len(set_topo),
-            "meio": len(set_meio),
-            "fundo": len(set_fundo),
-            "expirados": len(set_expirados),
-            "total": len(total_unicos) # <--- Agora vai mostrar 6 e não 14!
-        }
-        
+        return responder_com_cache(
+            request, chave_cache_painel(current_user, "funil", bot_id),
+            lambda: _calcular_estatisticas_funil(db, current_user, bot_id)
+        )
     except Exception as e:
         logger.error(f"Erro stats funil: {e}")
         return {"topo": 0, "meio": 0, "fundo": 0, "expirados": 0, "total": 0}
 
+def _calcular_estatisticas_funil(db: Session, current_user, bot_id: Optional[int]):
+    user_bot_ids = [bot.id for bot in current_user.bots]
+    if not user_bot_ids:
+        return {"topo": 0, "meio": 0, "fundo": 0, "expirados": 0, "total": 0}
+
+    bots_alvo = [bot_id] if (bot_id and bot_id in user_bot_ids) else user_bot_ids
+
+    # Cada contato está em exatamente uma etapa: o total é a soma
+    por_etapa = dict(
+        db.query(Contact.stage, func.count(Contact.id))
+        .filter(Contact.bot_id.in_(bots_alvo))
+        .group_by(Contact.stage).all()
+    )
+    return {
+        "topo": por_etapa.get("topo", 0),
+        "meio": por_etapa.get("meio", 0),
+        "fundo": por_etapa.get("fundo", 0),
+        "expirados": por_etapa.get("expirado", 0),
+        "total": sum(por_etapa.values())
+    }
+
 # ============================================================
 # ROTA 3: ATUALIZAR ROTA DE CONTATOS EXISTENTE
 # ============================================================
@@ -7091,12 +8251,26 @@ async def obter_estatisticas_funil(
 # ============================================================
 # 🔥 ROTA DE CONTATOS (V4.0 - CORREÇÃO TOTAL DE DUPLICATAS)
 # ============================================================
+def filtrar_contatos_por_status(query, status: str):
+    """Filtros da tela de contatos (também usados na exportação)."""
+    if status == "meio" or status == "pendentes":
+        return query.filter(Contact.stage == "meio")
+    if status == "fundo" or status == "pagantes":
+        return query.filter(Contact.stage == "fundo")
+    if status == "expirado" or status == "expirados":
+        return query.filter(Contact.stage == "expirado")
+    if status != "todos":
+        return query.filter(Contact.order_id != None)
+    return query
+
 @app.get("/api/admin/contacts")
 async def get_contacts(
     status: str = "todos",
     bot_id: Optional[int] = None,
     page: int = 1,
     per_page: int = 50,
+    cursor: Optional[str] = None,
+    count: str = "exact",
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -7121,126 +8295,38 @@ async def get_contacts(
         # Define quais bots vamos consultar
         bots_alvo = [bot_id] if bot_id else user_bot_ids
         
-        # Prepara a paginação
-        offset = (page - 1) * per_page
-        
-        # Dicionário Mágico para Remover Duplicatas (Chave = BotID_TelegramID)
-        contatos_unicos = {}
-
-        # ============================================================
-        # CENÁRIO 1: "TODOS" (Mescla Leads + Pedidos)
-        # ============================================================
-        if status == "todos":
-            # A. Processa LEADS
-            leads = db.query(Lead).filter(Lead.bot_id.in_(bots_alvo)).all()
-            for l in leads:
-                tid = str(l.user_id).strip()
-                key = f"{l.bot_id}_{tid}"
-                
-                # Tenta pegar a data de expiração do lead (se existir a coluna)
-                data_lead = getattr(l, 'expiration_date', None)
-
-                contatos_unicos[key] = {
-                    "id": l.id,
-                    "telegram_id": tid,
-                    "user_id": tid,
-                    "first_name": l.nome or "Sem nome",
-                    "username": l.username,
-                    "plano_nome": "-",
-                    "valor": 0.0,
-                    "status": "pending",
-                    "role": "user",
-                    "created_at": clean_date(l.created_at),
-                    "status_funil": "topo",
-                    "origem": "lead",
-                    "custom_expiration": clean_date(data_lead)
-                }
-
-            # B. Processa PEDIDOS (Sobrepõe Leads para atualizar status)
-            pedidos = db.query(Pedido).filter(Pedido.bot_id.in_(bots_alvo)).order_by(Pedido.created_at.asc()).all()
-            for p in pedidos:
-                tid = str(p.telegram_id).strip()
-                key = f"{p.bot_id}_{tid}"
-                
-                st_funil = "meio"
-                if p.status in ["paid", "approved", "active"]: st_funil = "fundo"
-                elif p.status == "expired": st_funil = "expirado"
-                
-                data_exp = clean_date(p.data_expiracao) or clean_date(p.custom_expiration)
-
-                obj_pedido = {
-                    "id": p.id,
-                    "telegram_id": tid,
-                    "user_id": tid,
-                    "first_name": p.first_name or "Sem nome",
-                    "username": p.username,
-                    "plano_nome": p.plano_nome,
-                    "valor": float(p.valor or 0),
-                    "status": p.status,
-                    "role": "user",
-                    "created_at": clean_date(p.created_at),
-                    "status_funil": st_funil,
-                    "origem": "pedido",
-                    "custom_expiration": data_exp
-                }
-
-                # ✅ LÓGICA DE MERGE CORRIGIDA: Pedido SEMPRE sobrepõe Lead
-                # Se o usuário tem QUALQUER pedido, ele prevalece sobre o lead antigo
-                contatos_unicos[key] = obj_pedido
-
-        # ============================================================
-        # CENÁRIO 2: FILTROS ESPECÍFICOS (PAGANTES, PENDENTES...)
-        # ============================================================
-        else:
-            # Busca TODOS os pedidos do filtro (sem limit ainda, para poder deduplicar)
-            query = db.query(Pedido).filter(Pedido.bot_id.in_(bots_alvo))
-            
-            if status == "meio" or status == "pendentes":
-                query = query.filter(Pedido.status == "pending")
-            elif status == "fundo" or status == "pagantes":
-                query = query.filter(Pedido.status.in_(["paid", "active", "approved"]))
-            elif status == "expirado" or status == "expirados":
-                query = query.filter(Pedido.status == "expired")
-            
-            # Ordena ASCENDENTE: O último registro do loop será o mais recente
-            raw_pedidos = query.order_by(Pedido.created_at.asc()).all()
-
-            for p in raw_pedidos:
-                tid = str(p.telegram_id).strip()
-                key = f"{p.bot_id}_{tid}"
-                
-                # Como o loop roda do mais antigo pro mais novo, o dicionário
-                # sempre vai ficar com a ÚLTIMA versão do pedido (eliminando os velhos)
-                contatos_unicos[key] = {
-                    "id": p.id,
-                    "telegram_id": tid,
-                    "user_id": tid,
-                    "first_name": p.first_name or "Sem nome",
-                    "username": p.username,
-                    "plano_nome": p.plano_nome,
-                    "valor": float(p.valor or 0),
-                    "status": p.status,
-                    "role": "user",
-                    "created_at": clean_date(p.created_at),
-                    "custom_expiration": clean_date(p.data_expiracao) or clean_date(p.custom_expiration),
-                    "origem": "pedido"
-                }
-
-        # ============================================================
-        # 3. FINALIZAÇÃO: ORDENAÇÃO E PAGINAÇÃO (NO PYTHON)
-        # ============================================================
-        
-        # Converte o dicionário (que removeu as duplicatas) em lista
-        all_contacts = list(contatos_unicos.values())
-        
-        # Ordena a lista final por data (Mais recentes primeiro)
-        all_contacts.sort(key=lambda x: x["created_at"] or datetime.min, reverse=True)
+        # Uma linha por contato (bot + telegram_id): filtro, ordenação e
+        # paginação direto no SQL
+        query = filtrar_contatos_por_status(
+            db.query(Contact).filter(Contact.bot_id.in_(bots_alvo)), status
+        )
         
-        # Calcula totais
-        total = len(all_contacts)
+        total = contar_total(db, query, count)
+        contatos, next_cursor = paginar_keyset(
+            query, Contact.stage_at, Contact.id, lambda c: (c.stage_at, c.id),
+            per_page, cursor, page
+        )
         
-        # Aplica a paginação na LISTA LIMPA
-        paginated = all_contacts[offset:offset + per_page]
+        paginated = []
+        for c in contatos:
+            tem_pedido = c.order_id is not None
+            contato = {
+                "id": c.order_id if tem_pedido else c.lead_id,
+                "telegram_id": c.telegram_id,
+                "user_id": c.telegram_id,
+                "first_name": c.first_name or "Sem nome",
+                "username": c.username,
+                "plano_nome": c.plan_name if tem_pedido else "-",
+                "valor": float(c.value or 0),
+                "status": c.order_status if tem_pedido else "pending",
+                "role": "user",
+                "created_at": clean_date(c.stage_at),
+                "origem": "pedido" if tem_pedido else "lead",
+                "custom_expiration": clean_date(c.expiration)
+            }
+            if status == "todos":
+                contato["status_funil"] = c.stage
+            paginated.append(contato)
         
         # Retorno final para o Frontend
         return {
@@ -7248,14 +8334,453 @@ async def get_contacts(
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page if per_page > 0 else 0
+            "total_pages": total_de_paginas(total, per_page),
+            "next_cursor": next_cursor
         }
 
-    except Exception as e:
-        logger.error(f"Erro contatos: {e}")
-        # Retorna lista vazia para não quebrar a tela em caso de erro grave
-        return {"data": [], "total": 0, "page": 1, "per_page": per_page, "total_pages": 0}
-        
+    except Exception as e:
+        logger.error(f"Erro contatos: {e}")
+        # Retorna lista vazia para não quebrar a tela em caso de erro grave
+        return {"data": [], "total": 0, "page": 1, "per_page": per_page, "total_pages": 0}
+        
+# ============================================================
+# 📤 EXPORTAÇÃO EM STREAMING (CSV / NDJSON)
+# ============================================================
+# As linhas saem direto de um cursor no servidor (yield_per) para o
+# StreamingResponse, em blocos, opcionalmente já compactadas em gzip. A
+# memória fica constante mesmo em bases com milhões de contatos. O gerador
+# abre a própria sessão: a do Depends fecha antes do stream terminar.
+EXPORTACAO_LOTE = 2000
+EXPORTACAO_FORMATOS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+def _valor_exportavel(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+def _gerar_exportacao(montar_query, campos: List[str], formato: str, compactar: bool):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compactar else None
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer) if formato == "csv" else None
+
+    def esvaziar() -> bytes:
+        pedaco = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(pedaco) if compressor else pedaco
+
+    db = SessionAnalytics()
+    try:
+        if escritor:
+            escritor.writerow(campos)
+        for n, linha in enumerate(montar_query(db).yield_per(EXPORTACAO_LOTE), start=1):
+            valores = [_valor_exportavel(v) for v in linha]
+            if escritor:
+                escritor.writerow(valores)
+            else:
+                buffer.write(json.dumps(dict(zip(campos, valores)), ensure_ascii=False) + "\n")
+            if n % EXPORTACAO_LOTE == 0:
+                pedaco = esvaziar()
+                if pedaco:
+                    yield pedaco
+        pedaco = esvaziar()
+        if compressor:
+            pedaco += compressor.flush()
+        if pedaco:
+            yield pedaco
+    finally:
+        db.close()
+
+def responder_exportacao(nome: str, montar_query, campos: List[str], formato: str, compactar: bool):
+    if formato not in EXPORTACAO_FORMATOS:
+        raise HTTPException(status_code=400, detail="Formato inválido (use csv ou ndjson)")
+    arquivo = f"{nome}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    media_type = EXPORTACAO_FORMATOS[formato]
+    if compactar:
+        arquivo += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        _gerar_exportacao(montar_query, campos, formato, compactar),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{arquivo}"', "Cache-Control": "no-store"}
+    )
+
+def _bots_exportaveis(db: Session, current_user, bot_id: Optional[int]) -> List[int]:
+    user_bot_ids = [b for (b,) in db.query(BotModel.id).filter(BotModel.owner_id == current_user.id).all()]
+    if bot_id:
+        if bot_id not in user_bot_ids:
+            raise HTTPException(status_code=404, detail="Bot não encontrado")
+        return [bot_id]
+    return user_bot_ids
+
+EXPORTACAO_CAMPOS_CONTATOS = [
+    "bot_id", "telegram_id", "first_name", "username", "stage", "order_status",
+    "plan_name", "value", "expiration", "stage_at", "lead_created_at"
+]
+EXPORTACAO_CAMPOS_PEDIDOS = [
+    "id", "bot_id", "telegram_id", "first_name", "username", "plano_nome", "valor",
+    "status", "created_at", "data_aprovacao", "data_expiracao", "custom_expiration", "tem_order_bump"
+]
+EXPORTACAO_CAMPOS_REMARKETING = [
+    "id", "bot_id", "user_id", "sent_at", "status", "converted", "converted_at", "error_message"
+]
+
+@app.get("/api/admin/export/contacts")
+def exportar_contatos(
+    status: str = "todos",
+    bot_id: Optional[int] = None,
+    formato: str = "csv",
+    compactar: bool = False,
+    db: Session = Depends(get_db_analytics),
+    current_user: User = Depends(get_current_user)
+):
+    """Exporta os contatos (mesmos filtros de /api/admin/contacts)."""
+    bots_alvo = _bots_exportaveis(db, current_user, bot_id)
+
+    def montar_query(sessao: Session):
+        colunas = [getattr(Contact, c) for c in EXPORTACAO_CAMPOS_CONTATOS]
+        query = sessao.query(*colunas).filter(Contact.bot_id.in_(bots_alvo))
+        return filtrar_contatos_por_status(query, status).order_by(Contact.bot_id, Contact.id)
+
+    return responder_exportacao("contatos", montar_query, EXPORTACAO_CAMPOS_CONTATOS, formato, compactar)
+
+@app.get("/api/admin/export/orders")
+def exportar_pedidos(
+    bot_id: Optional[int] = None,
+    status: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    formato: str = "csv",
+    compactar: bool = False,
+    db: Session = Depends(get_db_analytics),
+    current_user: User = Depends(get_current_user)
+):
+    """Exporta os pedidos dos bots do usuário (status e período opcionais)."""
+    bots_alvo = _bots_exportaveis(db, current_user, bot_id)
+    try:
+        inicio = datetime.fromisoformat(start_date.replace('Z', '+00:00')) if start_date else None
+        fim = datetime.fromisoformat(end_date.replace('Z', '+00:00')) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida")
+
+    def montar_query(sessao: Session):
+        colunas = [getattr(Pedido, c) for c in EXPORTACAO_CAMPOS_PEDIDOS]
+        query = sessao.query(*colunas).filter(Pedido.bot_id.in_(bots_alvo))
+        if status:
+            query = query.filter(Pedido.status == status)
+        if inicio:
+            query = query.filter(Pedido.created_at >= inicio)
+        if fim:
+            query = query.filter(Pedido.created_at <= fim)
+        return query.order_by(Pedido.id)
+
+    return responder_exportacao("pedidos", montar_query, EXPORTACAO_CAMPOS_PEDIDOS, formato, compactar)
+
+@app.get("/api/admin/export/remarketing-logs")
+def exportar_logs_remarketing(
+    bot_id: Optional[int] = None,
+    formato: str = "csv",
+    compactar: bool = False,
+    db: Session = Depends(get_db_analytics),
+    current_user: User = Depends(get_current_user)
+):
+    """Exporta os envios de remarketing dos bots do usuário."""
+    bots_alvo = _bots_exportaveis(db, current_user, bot_id)
+
+    def montar_query(sessao: Session):
+        colunas = [getattr(RemarketingLog, c) for c in EXPORTACAO_CAMPOS_REMARKETING]
+        return sessao.query(*colunas).filter(RemarketingLog.bot_id.in_(bots_alvo)).order_by(RemarketingLog.id)
+
+    return responder_exportacao("remarketing", montar_query, EXPORTACAO_CAMPOS_REMARKETING, formato, compactar)
+
+# ============================================================
+# 📥 IMPORTAÇÃO EM MASSA DE LEADS / ASSINANTES (COPY)
+# ============================================================
+# Para quem migra de outra plataforma. O CSV chega em stream (corpo da
+# requisição, text/csv), é validado e normalizado em lotes, vai para uma
+# tabela temporária via COPY (Postgres; executemany nos demais) e entra em
+# leads/pedidos com INSERT ... SELECT / UPDATE em conjunto, um commit por lote.
+# Linhas com expira_em no futuro viram assinaturas ativas (pedido aprovado,
+# origem 'importacao', sem mensagem de acesso). Importados não entram no
+# rollup diário: não são leads nem vendas do dia.
+#
+# Colunas (cabeçalho obrigatório, nomes alternativos aceitos):
+#   telegram_id | nome | username | plano | valor | expira_em
+# Progresso: GET /api/admin/import/{import_id} (passe ?import_id= para acompanhar).
+# O import_id do cliente só vale dentro da conta dele; importações terminadas
+# saem da memória depois de IMPORTACAO_RETENCAO_SEGUNDOS.
+IMPORTACAO_LOTE = 5000
+IMPORTACAO_MAX_ERROS_REPORTADOS = 20
+IMPORTACAO_RETENCAO_SEGUNDOS = 3600
+IMPORTACAO_COLUNAS = {
+    "telegram_id": ("telegram_id", "user_id", "id", "chat_id"),
+    "nome": ("nome", "first_name", "name"),
+    "username": ("username", "user"),
+    "plano": ("plano", "plan", "plano_nome"),
+    "valor": ("valor", "value", "price", "preco"),
+    "expira_em": ("expira_em", "expiration", "expires_at", "data_expiracao"),
+}
+IMPORTACAO_CAMPOS_STAGE = ("telegram_id", "nome", "username", "plano", "valor", "expira_em")
+
+# (owner_id, import_id) -> progresso
+importacoes_leads: Dict[tuple, dict] = {}
+
+def _limpar_importacoes_terminadas():
+    limite = datetime.utcnow() - timedelta(seconds=IMPORTACAO_RETENCAO_SEGUNDOS)
+    for chave, progresso in list(importacoes_leads.items()):
+        if progresso.get("finalizada_em") and progresso["finalizada_em"] < limite:
+            importacoes_leads.pop(chave, None)
+
+SQL_STAGE_IMPORTACAO = """
+    CREATE TEMP TABLE IF NOT EXISTS import_leads_stage (
+        telegram_id VARCHAR NOT NULL, nome VARCHAR, username VARCHAR,
+        plano VARCHAR, valor FLOAT, expira_em TIMESTAMP
+    )
+"""
+
+SQL_IMPORTAR_LEADS_NOVOS = text("""
+    INSERT INTO leads (user_id, nome, username, bot_id, status, funil_stage,
+                       primeiro_contato, ultimo_contato, created_at, total_remarketings)
+    SELECT s.telegram_id, MAX(s.nome), MAX(s.username), :bot_id, 'topo', 'lead_frio',
+           :agora, :agora, :agora, 0
+    FROM import_leads_stage s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM leads l WHERE l.bot_id = :bot_id AND l.user_id = s.telegram_id
+    )
+    GROUP BY s.telegram_id
+""")
+
+SQL_IMPORTAR_LEADS_EXISTENTES = text("""
+    UPDATE leads SET
+        nome = COALESCE(leads.nome, (SELECT MAX(s.nome) FROM import_leads_stage s WHERE s.telegram_id = leads.user_id)),
+        username = COALESCE(leads.username, (SELECT MAX(s.username) FROM import_leads_stage s WHERE s.telegram_id = leads.user_id))
+    WHERE leads.bot_id = :bot_id
+      AND leads.created_at < :agora
+      AND leads.user_id IN (SELECT telegram_id FROM import_leads_stage)
+""")
+
+SQL_IMPORTAR_ASSINATURAS = text("""
+    INSERT INTO pedidos (bot_id, telegram_id, first_name, username, plano_nome, valor, status, txid,
+                         data_aprovacao, data_expiracao, custom_expiration, created_at,
+                         mensagem_enviada, tem_order_bump, status_funil, origem,
+                         dias_ate_compra, total_remarketings)
+    SELECT :bot_id, s.telegram_id, MAX(s.nome), MAX(s.username), COALESCE(MAX(s.plano), 'Importado'),
+           COALESCE(MAX(s.valor), 0), 'approved', :prefixo_txid || s.telegram_id,
+           :agora, MAX(s.expira_em), MAX(s.expira_em), :agora,
+           :verdadeiro, :falso, 'fundo', 'importacao', 0, 0
+    FROM import_leads_stage s
+    WHERE s.expira_em > :agora
+      AND NOT EXISTS (
+        SELECT 1 FROM pedidos p
+        WHERE p.bot_id = :bot_id AND p.telegram_id = s.telegram_id
+          AND p.status IN ('paid', 'approved', 'active')
+      )
+    GROUP BY s.telegram_id
+""")
+
+def normalizar_telegram_id(bruto) -> Optional[str]:
+    valor = str(bruto or "").strip().replace(" ", "")
+    if valor.endswith(".0"):  # Planilhas exportam IDs como float
+        valor = valor[:-2]
+    return valor if valor.isdigit() and 5 <= len(valor) <= 20 else None
+
+def _data_importacao(bruto: Optional[str]) -> Optional[datetime]:
+    bruto = (bruto or "").strip()
+    if not bruto:
+        return None
+    for formato in ("%d/%m/%Y", "%d/%m/%Y %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(bruto, formato)
+        except ValueError:
+            pass
+    data = datetime.fromisoformat(bruto.replace("Z", "+00:00"))
+    return data.astimezone(timezone.utc).replace(tzinfo=None) if data.tzinfo else data
+
+def _mapear_cabecalho(cabecalho: List[str]) -> Dict[str, int]:
+    nomes = [c.strip().lower() for c in cabecalho]
+    mapa = {}
+    for campo, alternativos in IMPORTACAO_COLUNAS.items():
+        for nome in alternativos:
+            if nome in nomes:
+                mapa[campo] = nomes.index(nome)
+                break
+    if "telegram_id" not in mapa:
+        raise HTTPException(status_code=400, detail="CSV sem coluna telegram_id")
+    return mapa
+
+def _normalizar_linha_importacao(valores: List[str], mapa: Dict[str, int]) -> dict:
+    def campo(nome):
+        i = mapa.get(nome)
+        return valores[i].strip() if i is not None and i < len(valores) and valores[i].strip() else None
+
+    telegram_id = normalizar_telegram_id(campo("telegram_id"))
+    if not telegram_id:
+        raise ValueError(f"telegram_id inválido: {campo('telegram_id')!r}")
+    valor = campo("valor")
+    return {
+        "telegram_id": telegram_id,
+        "nome": campo("nome"),
+        "username": (campo("username") or "").lstrip("@") or None,
+        "plano": campo("plano"),
+        "valor": float(valor.replace("R$", "").replace(",", ".")) if valor else None,
+        "expira_em": _data_importacao(campo("expira_em")),
+    }
+
+def _carregar_stage_importacao(conexao, linhas: List[dict]):
+    conexao.execute(text("DELETE FROM import_leads_stage"))
+    if engine.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        for linha in linhas:
+            escritor.writerow([_valor_exportavel(linha[c]) for c in IMPORTACAO_CAMPOS_STAGE])
+        buffer.seek(0)
+        cursor = conexao.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY import_leads_stage ({', '.join(IMPORTACAO_CAMPOS_STAGE)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+    else:
+        conexao.execute(text(
+            f"INSERT INTO import_leads_stage ({', '.join(IMPORTACAO_CAMPOS_STAGE)}) "
+            f"VALUES ({', '.join(':' + c for c in IMPORTACAO_CAMPOS_STAGE)})"
+        ), linhas)
+
+def _mesclar_lote_importacao(conexao, bot_id: int, execucao_id: str, linhas: List[dict], progresso: dict):
+    """Roda numa thread: COPY do lote + merge em conjunto + commit."""
+    agora = datetime.utcnow()
+    # execucao_id é gerado no servidor (uuid inteiro): o prefixo nunca colide
+    prefixo_txid = f"import-{execucao_id}-{bot_id}-"
+    try:
+        _carregar_stage_importacao(conexao, linhas)
+        novos = conexao.execute(SQL_IMPORTAR_LEADS_NOVOS, {"bot_id": bot_id, "agora": agora}).rowcount
+        atualizados = conexao.execute(SQL_IMPORTAR_LEADS_EXISTENTES, {"bot_id": bot_id, "agora": agora}).rowcount
+        assinaturas = conexao.execute(SQL_IMPORTAR_ASSINATURAS, {
+            "bot_id": bot_id, "agora": agora, "prefixo_txid": prefixo_txid,
+            "verdadeiro": True, "falso": False
+        }).rowcount
+        prazos = conexao.execute(text("""
+            SELECT id, custom_expiration FROM pedidos
+            WHERE bot_id = :bot_id AND txid LIKE :prefixo
+              AND telegram_id IN (SELECT telegram_id FROM import_leads_stage)
+        """), {"bot_id": bot_id, "prefixo": prefixo_txid + "%"}).all() if assinaturas else []
+        conexao.commit()
+    except Exception:
+        conexao.rollback()
+        raise
+
+    # Fora do SQL em conjunto: motor de expiração e tabela de contatos
+    for pedido_id, prazo in prazos:
+        agendar_expiracao(pedido_id, prazo)
+    db = SessionJobs()
+    try:
+        for i in range(0, len(linhas), CONTATOS_LOTE_BACKFILL):
+            sincronizar_contatos(db, [(bot_id, l["telegram_id"]) for l in linhas[i:i + CONTATOS_LOTE_BACKFILL]])
+        db.commit()
+    finally:
+        db.close()
+
+    progresso["leads_novos"] += max(novos, 0)
+    progresso["leads_atualizados"] += max(atualizados, 0)
+    progresso["assinaturas_novas"] += max(assinaturas, 0)
+
+@app.post("/api/admin/bots/{bot_id}/import/leads")
+async def importar_leads(
+    bot_id: int,
+    request: Request,
+    import_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Importa leads/assinantes de um CSV enviado como corpo da requisição."""
+    verificar_bot_pertence_usuario(bot_id, current_user.id, db)
+    _limpar_importacoes_terminadas()
+    import_id = import_id or str(uuid.uuid4())
+    chave = (current_user.id, import_id)
+    if importacoes_leads.get(chave, {}).get("status") == "processando":
+        raise HTTPException(status_code=409, detail="Já existe uma importação em andamento com esse import_id")
+    execucao_id = uuid.uuid4().hex
+    progresso = importacoes_leads[chave] = {
+        "import_id": import_id, "owner_id": current_user.id, "bot_id": bot_id,
+        "status": "processando", "iniciada_em": datetime.utcnow(), "finalizada_em": None,
+        "linhas_lidas": 0, "linhas_validas": 0, "linhas_invalidas": 0,
+        "leads_novos": 0, "leads_atualizados": 0, "assinaturas_novas": 0,
+        "linhas_por_segundo": 0, "erros": []
+    }
+    inicio = time.monotonic()
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    conexao = engine_jobs.connect()
+    try:
+        await asyncio.to_thread(conexao.execute, text(SQL_STAGE_IMPORTACAO))
+        mapa, resto, lote = None, "", []
+
+        async def processar_lote():
+            nonlocal lote
+            if lote:
+                await asyncio.to_thread(_mesclar_lote_importacao, conexao, bot_id, execucao_id, lote, progresso)
+                lote = []
+            progresso["linhas_por_segundo"] = int(progresso["linhas_lidas"] / max(time.monotonic() - inicio, 0.001))
+
+        def consumir(linhas_texto: List[str]):
+            nonlocal mapa
+            for valores in csv.reader(linhas_texto):
+                if not valores or not any(v.strip() for v in valores):
+                    continue
+                if mapa is None:
+                    mapa = _mapear_cabecalho(valores)
+                    continue
+                progresso["linhas_lidas"] += 1
+                try:
+                    lote.append(_normalizar_linha_importacao(valores, mapa))
+                    progresso["linhas_validas"] += 1
+                except ValueError as e:
+                    progresso["linhas_invalidas"] += 1
+                    if len(progresso["erros"]) < IMPORTACAO_MAX_ERROS_REPORTADOS:
+                        progresso["erros"].append(f"Linha {progresso['linhas_lidas'] + 1}: {e}")
+
+        async for pedaco in request.stream():
+            resto += decodificador.decode(pedaco)
+            *completas, resto = resto.split("\n")
+            consumir(completas)
+            if len(lote) >= IMPORTACAO_LOTE:
+                await processar_lote()
+        resto += decodificador.decode(b"", final=True)
+        consumir([resto])
+        await processar_lote()
+
+        progresso["status"] = "concluida"
+        logger.info(
+            f"📥 [IMPORTAÇÃO] Bot {bot_id}: {progresso['linhas_validas']} linhas válidas, "
+            f"{progresso['leads_novos']} leads novos, {progresso['assinaturas_novas']} assinaturas "
+            f"({progresso['linhas_por_segundo']} linhas/s)"
+        )
+        cache_paineis.invalidar(current_user.id)
+        return progresso
+    except HTTPException as e:
+        progresso["status"] = "erro"
+        progresso["erros"].append(e.detail)
+        raise
+    except Exception as e:
+        progresso["status"] = "erro"
+        progresso["erros"].append(str(e))
+        logger.error(f"❌ [IMPORTAÇÃO] Bot {bot_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro na importação: {e}")
+    finally:
+        progresso["finalizada_em"] = datetime.utcnow()
+        await asyncio.to_thread(conexao.close)
+
+@app.get("/api/admin/import/{import_id}")
+def status_importacao(import_id: str, owner_id: Optional[int] = None, current_user = Depends(get_current_user)):
+    """Superadmin consulta importações de outra conta passando ?owner_id=."""
+    _limpar_importacoes_terminadas()
+    dono = owner_id if (owner_id and current_user.is_superuser) else current_user.id
+    progresso = importacoes_leads.get((dono, import_id))
+    if not progresso:
+        raise HTTPException(status_code=404, detail="Importação não encontrada")
+    return progresso
+
 # ============================================================
 # 🔥 ROTAS COMPLETAS - Adicione no main.py
 # LOCAL: Após as rotas de /api/admin/contacts (linha ~2040)
@@ -7289,6 +8814,7 @@ async def update_user(user_id: int, data: dict, db: Session = Depends(get_db)):
         if "custom_expiration" in data:
             if data["custom_expiration"] == "remover" or data["custom_expiration"] == "":
                 pedido.custom_expiration = None
+                pedido.data_expiracao = None  # Senão o prazo do plano voltaria a valer
                 logger.info(f"✅ Data de expiração removida (Vitalício)")
             else:
                 # Converter string para datetime
@@ -7303,6 +8829,12 @@ async def update_user(user_id: int, data: dict, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(pedido)
         
+        # 4. Reagenda no motor de expiração
+        if pedido.status in STATUS_ASSINATURA_ATIVA:
+            agendar_expiracao(pedido.id, prazo_expiracao(pedido))
+        else:
+            agendar_expiracao(pedido.id, None)
+        
         logger.info(f"✅ Usuário {user_id} atualizado com sucesso!")
         
         return {
@@ -7473,7 +9005,7 @@ def processar_envio_remarketing(campaign_db_id: int, bot_id: int, payload: Remar
     Isso impede que os dados fiquem zerados por queda de conexão.
     """
     # 🔥 CRIA NOVA SESSÃO DEDICADA (O SEGREDO PARA SALVAR OS DADOS)
-    db = SessionLocal() 
+    db = SessionJobs() 
     
     try:
         # 1. Recupera a Campanha criada na rota e o Bot
@@ -7482,6 +9014,11 @@ def processar_envio_remarketing(campaign_db_id: int, bot_id: int, payload: Remar
         
         if not campanha or not bot_db:
             return
+        if bot_em_quarentena(bot_db):
+            logger.warning(f"🩺 Disparo cancelado: bot {bot_db.nome} em quarentena ({bot_db.saude_motivo})")
+            db.query(RemarketingCampaign).filter(RemarketingCampaign.id == campaign_db_id).update({"status": "erro"})
+            db.commit()
+            return
 
         logger.info(f"🚀 INICIANDO DISPARO BACKGROUND | Bot: {bot_db.nome}")
 
@@ -7583,6 +9120,8 @@ def processar_envio_remarketing(campaign_db_id: int, bot_id: int, payload: Remar
                 
             except Exception as e:
                 err = str(e).lower()
+                if registrar_erro_telegram_bot(bot_id, e):
+                    break  # Token revogado: não adianta continuar
                 if "blocked" in err or "kicked" in err or "deactivated" in err or "not found" in err:
                     blocked_count += 1
 
@@ -7828,18 +9367,22 @@ def get_remarketing_history(
     bot_id: int, 
     page: int = 1, 
     per_page: int = 10, # Frontend manda 'per_page', não 'limit'
+    cursor: Optional[str] = None,
+    count: str = "exact",
     db: Session = Depends(get_db)
 ):
     try:
         limit = min(per_page, 50)
-        skip = (page - 1) * limit
         
         # Filtra pelo bot_id
         query = db.query(RemarketingCampaign).filter(RemarketingCampaign.bot_id == bot_id)
         
-        total = query.count()
+        total = contar_total(db, query, count)
         # Ordena por data (descrescente)
-        campanhas = query.order_by(desc(RemarketingCampaign.data_envio)).offset(skip).limit(limit).all()
+        campanhas, next_cursor = paginar_keyset(
+            query, RemarketingCampaign.data_envio, RemarketingCampaign.id, lambda c: (c.data_envio, c.id),
+            limit, cursor, page
+        )
             
         data = []
         for c in campanhas:
@@ -7856,15 +9399,13 @@ def get_remarketing_history(
                 "config": c.config
             })
 
-        # Cálculo correto de páginas
-        total_pages = (total // limit) + (1 if total % limit > 0 else 0)
-
         return {
             "data": data,
             "total": total,
             "page": page,
             "per_page": limit,
-            "total_pages": total_pages
+            "total_pages": total_de_paginas(total, limit),
+            "next_cursor": next_cursor
         }
     except Exception as e:
         logger.error(f"Erro ao buscar histórico: {e}")
@@ -7893,6 +9434,344 @@ def delete_remarketing_history(history_id: int, db: Session = Depends(get_db)):
     return {"status": "ok", "message": "Campanha deletada com sucesso"}
 
 
+# =========================================================
+# 🗃️ CACHE DE RESPOSTAS DOS PAINÉIS (TTL + LRU + ETAG)
+# =========================================================
+# Dashboard, perfil e funil são recalculados a cada F5 / aba aberta. As
+# respostas ficam em memória já serializadas, por (usuário, rota, parâmetros),
+# com TTL curto e limite de entradas (LRU). Aprovação de pagamento invalida as
+# entradas do dono do bot e as visões globais (super admin); entre workers o
+# aviso trafega por NOTIFY. Com o ETag o navegador recebe 304 sem corpo.
+CACHE_PAINEL_TTL_SEGUNDOS = int(os.getenv("CACHE_PAINEL_TTL_SEGUNDOS", "30"))
+CACHE_PAINEL_MAX_ENTRADAS = int(os.getenv("CACHE_PAINEL_MAX_ENTRADAS", "2000"))
+CACHE_PAINEL_CANAL_NOTIFY = "cache_painel_invalidar"
+
+def serializar_json(dados) -> bytes:
+    return json.dumps(jsonable_encoder(dados), ensure_ascii=False).encode("utf-8")
+
+def etag_de(corpo: bytes) -> str:
+    return f'"{hashlib.sha1(corpo).hexdigest()}"'
+
+def resposta_json_com_etag(request: Request, etag: str, corpo: bytes, cache_control: str) -> Response:
+    """Corpo já serializado; 304 sem corpo quando o If-None-Match bate."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
+class CacheRespostas:
+    """LRU com TTL. Thread-safe: as rotas síncronas rodam no threadpool."""
+
+    def __init__(self, ttl_segundos: int, max_entradas: int):
+        self.ttl = ttl_segundos
+        self.max_entradas = max_entradas
+        self._entradas: OrderedDict = OrderedDict()  # chave -> (expira_em, etag, corpo)
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave: tuple) -> Optional[tuple]:
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] < time.monotonic():
+                self._entradas.pop(chave, None)
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada[1], entrada[2]
+
+    def guardar(self, chave: tuple, corpo: bytes) -> tuple:
+        etag = etag_de(corpo)
+        with self._lock:
+            self._entradas[chave] = (time.monotonic() + self.ttl, etag, corpo)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return etag, corpo
+
+    def invalidar(self, user_id: Optional[int]):
+        """Remove as entradas do usuário e todas as visões globais."""
+        with self._lock:
+            for chave in [c for c in self._entradas if c[0] == user_id or c[1]]:
+                del self._entradas[chave]
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+cache_paineis = CacheRespostas(CACHE_PAINEL_TTL_SEGUNDOS, CACHE_PAINEL_MAX_ENTRADAS)
+
+def chave_cache_painel(current_user, rota: str, *params) -> tuple:
+    # Super admin pode ver dados da plataforma inteira: entra como visão global
+    return (current_user.id, bool(current_user.is_superuser), rota) + params
+
+def responder_com_cache(request: Request, chave: tuple, calcular) -> Response:
+    """Serve do cache (ou calcula e guarda) e responde 304 se o ETag bater."""
+    entrada = cache_paineis.obter(chave)
+    if entrada is None:
+        entrada = cache_paineis.guardar(chave, serializar_json(calcular()))
+    etag, corpo = entrada
+    return resposta_json_com_etag(request, etag, corpo, "private, no-cache")
+
+def invalidar_cache_paineis_do_bot(db: Session, bot_id: int):
+    """Chamar depois do commit que aprovou um pagamento do bot."""
+    owner_id = db.query(BotModel.owner_id).filter(BotModel.id == bot_id).scalar()
+    cache_paineis.invalidar(owner_id)
+
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        db.execute(
+            text("SELECT pg_notify(:canal, :payload)"),
+            {"canal": CACHE_PAINEL_CANAL_NOTIFY, "payload": str(owner_id or "")}
+        )
+        db.commit()
+    except Exception as e:
+        logger.warning(f"⚠️ [CACHE-PAINEL] Falha no NOTIFY: {e}")
+        db.rollback()
+
+# =========================================================
+# 🔖 PAGINAÇÃO POR CURSOR (KEYSET)
+# =========================================================
+# As listagens grandes ordenam por (data, id) decrescente. Com `cursor` a
+# próxima página é filtrada a partir da última linha vista, então a página N
+# custa o mesmo que a primeira. Sem cursor continua valendo `page` (OFFSET)
+# para o painel antigo. O cursor é opaco para o cliente (base64 de data + id).
+# As colunas de data usadas aqui não podem ser nulas (NOT NULL desde a
+# migração v15; em contacts o _linha_contato preenche): um NULL no cursor
+# cortaria a listagem.
+#
+# `count`: "exact" (padrão, COUNT(*)), "estimate" (estimativa do planner no
+# Postgres, sem varrer a tabela) ou "none" (não conta).
+
+def codificar_cursor(data_ordem, id_ordem: int) -> str:
+    valor = data_ordem.isoformat() if isinstance(data_ordem, datetime) else data_ordem
+    return base64.urlsafe_b64encode(json.dumps([valor, id_ordem]).encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> tuple:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valor, id_ordem = json.loads(bruto)
+        return (datetime.fromisoformat(valor) if isinstance(valor, str) else valor), int(id_ordem)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido")
+
+def paginar_keyset(query, coluna_data, coluna_id, chave_da_linha, limite: int,
+                   cursor: Optional[str] = None, page: int = 1):
+    """
+    Ordena por (coluna_data, coluna_id) decrescente e devolve (linhas, next_cursor).
+    `chave_da_linha(linha)` retorna (data, id) da linha para montar o cursor.
+    """
+    query = query.order_by(coluna_data.desc(), coluna_id.desc())
+    if cursor:
+        data_cursor, id_cursor = decodificar_cursor(cursor)
+        query = query.filter(or_(
+            coluna_data < data_cursor,
+            and_(coluna_data == data_cursor, coluna_id < id_cursor)
+        ))
+    elif page > 1:
+        query = query.offset((page - 1) * limite)
+
+    linhas = query.limit(limite + 1).all()
+    if len(linhas) <= limite:
+        return linhas, None
+    linhas = linhas[:limite]
+    return linhas, codificar_cursor(*chave_da_linha(linhas[-1]))
+
+def contar_total(db: Session, query, modo: str = "exact") -> Optional[int]:
+    if modo == "none":
+        return None
+    if modo == "estimate" and engine.dialect.name == "postgresql":
+        try:
+            compilado = query.order_by(None).statement.compile(
+                dialect=engine.dialect, compile_kwargs={"render_postcompile": True}
+            )
+            plano = db.connection().exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compilado}", compilado.params
+            ).scalar()
+            if isinstance(plano, str):
+                plano = json.loads(plano)
+            return int(plano[0]["Plan"]["Plan Rows"])
+        except Exception as e:
+            logger.warning(f"⚠️ [PAGINAÇÃO] Estimativa indisponível, usando COUNT: {e}")
+    return query.order_by(None).count()
+
+def total_de_paginas(total: Optional[int], por_pagina: int) -> Optional[int]:
+    if total is None or por_pagina <= 0:
+        return None
+    return (total + por_pagina - 1) // por_pagina
+
+# =========================================================
+# 📅 AGRUPAMENTO POR DIA (POSTGRES / SQLITE)
+# =========================================================
+def normalizar_dia(valor):
+    """Converte o valor agrupado (datetime, date ou 'YYYY-MM-DD') em date."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return datetime.strptime(valor[:10], "%Y-%m-%d").date()
+    return valor
+
+# =========================================================
+# 📊 ROLLUP DIÁRIO DE MÉTRICAS (daily_bot_metrics)
+# =========================================================
+# Um listener after_flush soma os eventos (lead novo, PIX gerado, venda
+# aprovada, remarketing enviado/convertido) na linha (bot_id, dia) do rollup,
+# na MESMA transação que grava o evento. Assim qualquer rota que crie leads ou
+# pedidos alimenta o rollup sem precisar lembrar disso. Leads, pedidos e logs
+# apagados pelo ORM descontam o que somaram. DELETEs em massa (query.delete(),
+# SQL direto) não passam pelo listener: depois deles rode o backfill do bot.
+# Para (re)construir a partir do histórico: python backfill_metricas.py
+STATUS_VENDA = ('approved', 'paid', 'active')
+METRICAS_DIARIAS_CAMPOS = (
+    "leads", "pix_generated", "sales", "revenue_cents", "remarketing_sent", "remarketing_converted"
+)
+
+SQL_UPSERT_METRICAS_DIARIAS = text(f"""
+    INSERT INTO daily_bot_metrics (bot_id, day, {", ".join(METRICAS_DIARIAS_CAMPOS)})
+    VALUES (:bot_id, :day, {", ".join(":" + c for c in METRICAS_DIARIAS_CAMPOS)})
+    ON CONFLICT (bot_id, day) DO UPDATE SET
+    {", ".join(f"{c} = daily_bot_metrics.{c} + excluded.{c}" for c in METRICAS_DIARIAS_CAMPOS)}
+""")
+# Descontos (registros apagados) só ajustam linhas existentes: nunca criam linha negativa
+# Trava compartilhada por bot: o backfill pega a exclusiva enquanto recalcula
+SQL_TRAVAR_METRICAS_BOT_COMPARTILHADA = text("SELECT pg_advisory_xact_lock_shared(:classe, :bot_id)")
+SQL_DESCONTAR_METRICAS_DIARIAS = text(f"""
+    UPDATE daily_bot_metrics SET
+    {", ".join(f"{c} = {c} + :{c}" for c in METRICAS_DIARIAS_CAMPOS)}
+    WHERE bot_id = :bot_id AND day = :day
+""")
+# Status que o backfill conta como venda (inclusive as já expiradas)
+STATUS_VENDA_HISTORICO = STATUS_VENDA + ('expired',)
+
+def _dia_utc(valor: Optional[datetime]) -> date:
+    if isinstance(valor, datetime):
+        if valor.tzinfo:
+            valor = valor.astimezone(timezone.utc)
+        return valor.date()
+    return datetime.utcnow().date()
+
+def valor_em_centavos(valor: Optional[float]) -> int:
+    return int(round((valor or 0) * 100))
+
+def _mudou_para(obj, atributo: str, valores: tuple, exceto_de: tuple = ()) -> bool:
+    historico = sa_inspect(obj).attrs[atributo].history
+    if not historico.added:
+        return False
+    antigo = historico.deleted[0] if historico.deleted else None
+    return historico.added[0] in valores and antigo not in valores and antigo not in exceto_de
+
+@event.listens_for(SessaoBanco, "after_flush")
+def _acumular_metricas_diarias(session, flush_context):
+    deltas: Dict[tuple, dict] = {}
+
+    def somar(bot_id, dia, **valores):
+        if not bot_id:
+            return
+        linha = deltas.setdefault((bot_id, dia), dict.fromkeys(METRICAS_DIARIAS_CAMPOS, 0))
+        for campo, valor in valores.items():
+            linha[campo] += valor
+
+    for obj in session.new:
+        if isinstance(obj, Lead):
+            somar(obj.bot_id, _dia_utc(obj.created_at), leads=1)
+        elif isinstance(obj, Pedido):
+            somar(obj.bot_id, _dia_utc(obj.created_at), pix_generated=1)
+            if obj.status in STATUS_VENDA:
+                somar(obj.bot_id, _dia_utc(obj.data_aprovacao or obj.created_at), sales=1, revenue_cents=valor_em_centavos(obj.valor))
+        elif isinstance(obj, RemarketingLog) and (obj.status or 'sent') == 'sent':
+            somar(obj.bot_id, _dia_utc(obj.sent_at), remarketing_sent=1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Pedido) and _mudou_para(obj, "status", STATUS_VENDA, exceto_de=('expired',)):
+            somar(obj.bot_id, _dia_utc(obj.data_aprovacao), sales=1, revenue_cents=valor_em_centavos(obj.valor))
+        elif isinstance(obj, RemarketingLog) and _mudou_para(obj, "converted", (True,)):
+            somar(obj.bot_id, _dia_utc(obj.converted_at), remarketing_converted=1)
+
+    # Mesmas regras do backfill, com sinal trocado
+    for obj in session.deleted:
+        if isinstance(obj, Lead):
+            somar(obj.bot_id, _dia_utc(obj.created_at), leads=-1)
+        elif isinstance(obj, Pedido):
+            somar(obj.bot_id, _dia_utc(obj.created_at), pix_generated=-1)
+            if obj.status in STATUS_VENDA_HISTORICO:
+                somar(obj.bot_id, _dia_utc(obj.data_aprovacao or obj.created_at), sales=-1, revenue_cents=-valor_em_centavos(obj.valor))
+        elif isinstance(obj, RemarketingLog):
+            if obj.status == 'sent':
+                somar(obj.bot_id, _dia_utc(obj.sent_at), remarketing_sent=-1)
+            if obj.converted:
+                somar(obj.bot_id, _dia_utc(obj.converted_at), remarketing_converted=-1)
+
+    somas, descontos = [], []
+    for (bot_id, dia), linha in deltas.items():
+        if any(v > 0 for v in linha.values()):
+            somas.append({"bot_id": bot_id, "day": dia, **{c: max(v, 0) for c, v in linha.items()}})
+        if any(v < 0 for v in linha.values()):
+            descontos.append({"bot_id": bot_id, "day": dia, **{c: min(v, 0) for c, v in linha.items()}})
+    if (somas or descontos) and engine.dialect.name == "postgresql":
+        # Fica até o commit: o backfill do bot não grava por cima deste evento
+        for bot_id in sorted({b for b, _ in deltas}):
+            session.connection().execute(
+                SQL_TRAVAR_METRICAS_BOT_COMPARTILHADA, {"classe": METRICAS_LOCK_CLASSE, "bot_id": bot_id}
+            )
+    if somas:
+        session.connection().execute(SQL_UPSERT_METRICAS_DIARIAS, somas)
+    if descontos:
+        session.connection().execute(SQL_DESCONTAR_METRICAS_DIARIAS, descontos)
+
+def marcar_conversao_remarketing(db: Session, pedido: Pedido, janela_dias: int = 7):
+    """Marca o último remarketing enviado ao comprador (na janela) como convertido."""
+    log = db.query(RemarketingLog).filter(
+        RemarketingLog.bot_id == pedido.bot_id,
+        RemarketingLog.user_id == str(pedido.telegram_id),
+        RemarketingLog.status == 'sent',
+        RemarketingLog.converted == False,
+        RemarketingLog.sent_at >= datetime.utcnow() - timedelta(days=janela_dias)
+    ).order_by(desc(RemarketingLog.sent_at)).first()
+    if log:
+        log.converted = True
+        log.converted_at = datetime.utcnow()
+
+def _filtrar_metricas(query, bots_ids: Optional[List[int]], desde: Optional[date], ate: Optional[date]):
+    if bots_ids is not None:
+        query = query.filter(DailyBotMetrics.bot_id.in_(bots_ids))
+    if desde:
+        query = query.filter(DailyBotMetrics.day >= desde)
+    if ate:
+        query = query.filter(DailyBotMetrics.day <= ate)
+    return query
+
+def somar_metricas_diarias(db: Session, bots_ids: Optional[List[int]] = None,
+                           desde: Optional[date] = None, ate: Optional[date] = None) -> dict:
+    """Totais do rollup. bots_ids=None soma a plataforma inteira."""
+    colunas = [func.coalesce(func.sum(getattr(DailyBotMetrics, c)), 0) for c in METRICAS_DIARIAS_CAMPOS]
+    linha = _filtrar_metricas(db.query(*colunas), bots_ids, desde, ate).one()
+    return {campo: int(valor or 0) for campo, valor in zip(METRICAS_DIARIAS_CAMPOS, linha)}
+
+def metricas_diarias_por_dia(db: Session, bots_ids: Optional[List[int]], desde: date, ate: date) -> Dict[date, dict]:
+    colunas = [func.sum(getattr(DailyBotMetrics, c)) for c in METRICAS_DIARIAS_CAMPOS]
+    query = _filtrar_metricas(db.query(DailyBotMetrics.day, *colunas), bots_ids, desde, ate)
+    return {
+        normalizar_dia(dia): {campo: int(valor or 0) for campo, valor in zip(METRICAS_DIARIAS_CAMPOS, valores)}
+        for dia, *valores in query.group_by(DailyBotMetrics.day).all()
+    }
+
+def metricas_diarias_por_bot(db: Session, bots_ids: List[int]) -> Dict[int, dict]:
+    colunas = [func.sum(getattr(DailyBotMetrics, c)) for c in METRICAS_DIARIAS_CAMPOS]
+    query = _filtrar_metricas(db.query(DailyBotMetrics.bot_id, *colunas), bots_ids, None, None)
+    return {
+        bot_id: {campo: int(valor or 0) for campo, valor in zip(METRICAS_DIARIAS_CAMPOS, valores)}
+        for bot_id, *valores in query.group_by(DailyBotMetrics.bot_id).all()
+    }
+
+# =========================================================
+# 👥 CONTATOS MATERIALIZADOS (tabela contacts)
+# =========================================================
+# Sincronização (listener after_flush) e backfill ficam em contatos.py,
+# importável sem subir a aplicação. Reconstrução: python backfill_contatos.py
+
 # =========================================================
 # 📊 ROTA DE DASHBOARD (KPIs REAIS E CUMULATIVOS)
 # =========================================================
@@ -7904,11 +9783,24 @@ def delete_remarketing_history(history_id: int, db: Session = Depends(get_db)):
 # =========================================================
 @app.get("/api/admin/dashboard/stats")
 def dashboard_stats(
+    request: Request,
     bot_id: Optional[int] = None, 
     start_date: Optional[str] = None, 
     end_date: Optional[str] = None, 
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_analytics),
     current_user = Depends(get_current_user)
+):
+    return responder_com_cache(
+        request, chave_cache_painel(current_user, "dashboard", bot_id, start_date, end_date),
+        lambda: _calcular_dashboard_stats(db, current_user, bot_id, start_date, end_date)
+    )
+
+def _calcular_dashboard_stats(
+    db: Session,
+    current_user,
+    bot_id: Optional[int] = None, 
+    start_date: Optional[str] = None, 
+    end_date: Optional[str] = None
 ):
     """
     Dashboard com filtros de data e bot.
@@ -7988,93 +9880,62 @@ def dashboard_stats(
         # ============================================
         # 💰 CÁLCULO DE FATURAMENTO DO PERÍODO
         # ============================================
+        # Vendas, leads e gráfico vêm do rollup diário (O(dias), não O(pedidos))
+        filtro_rollup = bots_ids if ((not is_super_with_split or bot_id) and bots_ids) else None
+        taxa_centavos = current_user.taxa_venda or 60
+        hoje = datetime.utcnow().date()
+        mes_inicio = hoje.replace(day=1)
+
+        por_dia = metricas_diarias_por_dia(db, filtro_rollup, min(start.date(), mes_inicio), max(end.date(), hoje))
+        periodo = [por_dia[d] for d in por_dia if start.date() <= d <= end.date()]
+        qtd_periodo = sum(m["sales"] for m in periodo)
+        receita_periodo = sum(m["revenue_cents"] for m in periodo)
+
         if is_super_with_split and not bot_id:
-            # SUPER ADMIN (Visão Geral): Calcula pelos splits de TODAS as vendas da plataforma
-            vendas_periodo = db.query(Pedido).filter(
-                Pedido.status.in_(['approved', 'paid', 'active']),
-                Pedido.data_aprovacao >= start,
-                Pedido.data_aprovacao <= end
-            ).all()
-            
-            # Faturamento = Quantidade de Vendas * Taxa Fixa (ex: 60 centavos)
+            # SUPER ADMIN (Visão Geral): Faturamento = Quantidade de Vendas * Taxa Fixa (ex: 60 centavos)
             # Nota: Usamos a taxa configurada no perfil do admin como base
-            taxa_centavos = current_user.taxa_venda or 60
-            total_revenue = len(vendas_periodo) * taxa_centavos
-            
-            logger.info(f"💰 Super Admin - Período: {len(vendas_periodo)} vendas × R$ {taxa_centavos/100:.2f} = R$ {total_revenue/100:.2f} ({total_revenue} centavos)")
-            
+            total_revenue = qtd_periodo * taxa_centavos
+            logger.info(f"💰 Super Admin - Período: {qtd_periodo} vendas × R$ {taxa_centavos/100:.2f} = R$ {total_revenue/100:.2f} ({total_revenue} centavos)")
         else:
             # USUÁRIO NORMAL (ou Admin vendo bot específico): Soma valor total dos pedidos
-            query = db.query(Pedido).filter(
-                Pedido.status.in_(['approved', 'paid', 'active']),
-                Pedido.data_aprovacao >= start,
-                Pedido.data_aprovacao <= end
-            )
-            
-            if bots_ids:
-                query = query.filter(Pedido.bot_id.in_(bots_ids))
-            
-            vendas_periodo = query.all()
-            
-            # Se for admin vendo bot específico, ainda calcula como taxa ou valor cheio?
-            # Geralmente admin quer ver o faturamento do cliente, então valor cheio.
-            total_revenue = sum(int(p.valor * 100) if p.valor else 0 for p in vendas_periodo)
-            
-            logger.info(f"👤 User - Período: {len(vendas_periodo)} vendas = R$ {total_revenue/100:.2f} ({total_revenue} centavos)")
+            total_revenue = receita_periodo
+            logger.info(f"👤 User - Período: {qtd_periodo} vendas = R$ {total_revenue/100:.2f} ({total_revenue} centavos)")
         
         # ============================================
         # 📊 OUTRAS MÉTRICAS
         # ============================================
         
-        # Usuários ativos (assinaturas não expiradas)
-        query_active = db.query(Pedido).filter(
-            Pedido.status.in_(['approved', 'paid', 'active']),
+        # Usuários ativos (assinaturas não expiradas) - estado atual, não evento
+        query_active = db.query(func.count(Pedido.id)).filter(
+            Pedido.status.in_(STATUS_VENDA),
             Pedido.data_expiracao > datetime.utcnow()
         )
-        if not is_super_with_split or bot_id:
-             if bots_ids: query_active = query_active.filter(Pedido.bot_id.in_(bots_ids))
-        active_users = query_active.count()
+        if filtro_rollup:
+            query_active = query_active.filter(Pedido.bot_id.in_(filtro_rollup))
+        active_users = query_active.scalar() or 0
         
         # Vendas de hoje
-        hoje_start = datetime.utcnow().replace(hour=0, minute=0, second=0)
-        query_hoje = db.query(Pedido).filter(
-            Pedido.status.in_(['approved', 'paid', 'active']),
-            Pedido.data_aprovacao >= hoje_start
-        )
-        if not is_super_with_split or bot_id:
-            if bots_ids: query_hoje = query_hoje.filter(Pedido.bot_id.in_(bots_ids))
-            
-        vendas_hoje = query_hoje.all()
-        
+        metricas_hoje = por_dia.get(hoje, dict.fromkeys(METRICAS_DIARIAS_CAMPOS, 0))
         if is_super_with_split and not bot_id:
-            sales_today = len(vendas_hoje) * (current_user.taxa_venda or 60)
+            sales_today = metricas_hoje["sales"] * taxa_centavos
         else:
-            sales_today = sum(int(p.valor * 100) if p.valor else 0 for p in vendas_hoje)
+            sales_today = metricas_hoje["revenue_cents"]
         
-        # Leads do mês
-        mes_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0)
-        query_leads_mes = db.query(Lead).filter(Lead.created_at >= mes_start)
-        if not is_super_with_split or bot_id:
-             if bots_ids: query_leads_mes = query_leads_mes.filter(Lead.bot_id.in_(bots_ids))
-        leads_mes = query_leads_mes.count()
-        
-        # Leads de hoje
-        query_leads_hoje = db.query(Lead).filter(Lead.created_at >= hoje_start)
-        if not is_super_with_split or bot_id:
-             if bots_ids: query_leads_hoje = query_leads_hoje.filter(Lead.bot_id.in_(bots_ids))
-        leads_hoje = query_leads_hoje.count()
+        # Leads do mês / de hoje
+        leads_mes = sum(m["leads"] for d, m in por_dia.items() if d >= mes_inicio)
+        leads_hoje = metricas_hoje["leads"]
         
         # Ticket médio
-        if vendas_periodo:
+        if qtd_periodo:
             if is_super_with_split and not bot_id:
-                ticket_medio = (current_user.taxa_venda or 60) # Para admin, ticket médio é a taxa fixa
+                ticket_medio = taxa_centavos # Para admin, ticket médio é a taxa fixa
             else:
-                ticket_medio = int(total_revenue / len(vendas_periodo))
+                ticket_medio = int(total_revenue / qtd_periodo)
         else:
             ticket_medio = 0
         
         # Total de transações
-        total_transacoes = len(vendas_periodo)
+        total_transacoes = qtd_periodo
         
         # Reembolsos (Placeholder)
         reembolsos = 0
@@ -8088,37 +9949,26 @@ def dashboard_stats(
         # ============================================
         # 📈 DADOS DO GRÁFICO (AGRUPADO POR DIA)
         # ============================================
+        # Dias sem linha no rollup são preenchidos com zero
         chart_data = []
-        current_date = start
-        
-        while current_date <= end:
-            day_start = current_date.replace(hour=0, minute=0, second=0)
-            day_end = current_date.replace(hour=23, minute=59, second=59)
-            
-            query_dia = db.query(Pedido).filter(
-                Pedido.status.in_(['approved', 'paid', 'active']),
-                Pedido.data_aprovacao >= day_start,
-                Pedido.data_aprovacao <= day_end
-            )
-            
-            if not is_super_with_split or bot_id:
-                if bots_ids: query_dia = query_dia.filter(Pedido.bot_id.in_(bots_ids))
-            
-            vendas_dia = query_dia.all()
-            
-            if is_super_with_split and not bot_id:
+        dia = start.date()
+        while dia <= end.date():
+            metricas_dia = por_dia.get(dia)
+            if not metricas_dia:
+                valor_dia = 0
+            elif is_super_with_split and not bot_id:
                 # Admin: Vendas * Taxa / 100 (para Reais)
-                valor_dia = len(vendas_dia) * ((current_user.taxa_venda or 60) / 100)
+                valor_dia = metricas_dia["sales"] * (taxa_centavos / 100)
             else:
                 # User: Soma dos valores
-                valor_dia = sum(p.valor for p in vendas_dia) if vendas_dia else 0
+                valor_dia = metricas_dia["revenue_cents"] / 100
             
             chart_data.append({
-                "name": current_date.strftime("%d/%m"),
+                "name": dia.strftime("%d/%m"),
                 "value": round(valor_dia, 2)  # ✅ Em REAIS
             })
             
-            current_date += timedelta(days=1)
+            dia += timedelta(days=1)
         
         logger.info(f"📊 Retornando: revenue={total_revenue} centavos, active={active_users}, today={sales_today} centavos")
         
@@ -8165,6 +10015,7 @@ async def webhook(req: Request, bg_tasks: BackgroundTasks):
             if p and p.status != 'paid':
                 p.status = 'paid'
                 db.commit() # Salva o status pago
+                invalidar_cache_paineis_do_bot(db, p.bot_id)
                 
                 # --- 🔔 NOTIFICAÇÃO AO ADMIN ---
                 try:
@@ -8388,9 +10239,16 @@ def enviar_oferta_final(tb, cid, fluxo, bot_id, db):
 # =========================================================
 @app.get("/api/profile/stats")
 def get_profile_stats(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_db_analytics),
     current_user = Depends(get_current_user)
 ):
+    return responder_com_cache(
+        request, chave_cache_painel(current_user, "perfil_stats"),
+        lambda: _calcular_profile_stats(db, current_user)
+    )
+
+def _calcular_profile_stats(db: Session, current_user):
     """
     Retorna estatísticas do perfil do usuário logado.
     
@@ -8415,10 +10273,8 @@ def get_profile_stats(
             # 💰 CÁLCULO ESPECIAL PARA SUPER ADMIN (SPLIT)
             # ============================================
             
-            # 1. Conta TODAS as vendas aprovadas da PLATAFORMA INTEIRA
-            total_vendas_sistema = db.query(Pedido).filter(
-                Pedido.status.in_(['approved', 'paid', 'active'])
-            ).count()
+            # 1. Conta TODAS as vendas aprovadas da PLATAFORMA INTEIRA (rollup diário)
+            total_vendas_sistema = somar_metricas_diarias(db)["sales"]
             
             # 2. Calcula faturamento: vendas × taxa (em centavos)
             taxa_centavos = current_user.taxa_venda or 60
@@ -8453,15 +10309,10 @@ def get_profile_stats(
                     "total_sales": 0
                 }
             
-            # Soma pedidos aprovados dos bots do usuário
-            pedidos_aprovados = db.query(Pedido).filter(
-                Pedido.bot_id.in_(bots_ids),
-                Pedido.status.in_(['approved', 'paid', 'active'])
-            ).all()
-            
-            # Calcula revenue em centavos
-            total_revenue = sum(int(p.valor * 100) if p.valor else 0 for p in pedidos_aprovados)
-            total_sales = len(pedidos_aprovados)
+            # Soma as vendas dos bots do usuário (rollup diário, já em centavos)
+            totais = somar_metricas_diarias(db, bots_ids)
+            total_revenue = totais["revenue_cents"]
+            total_sales = totais["sales"]
             
             logger.info(f"👤 User {current_user.username}: {total_sales} vendas = R$ {total_revenue/100:.2f} (retornando {total_revenue} centavos)")
             
@@ -8493,9 +10344,16 @@ def get_profile_stats(
 # =========================================================
 @app.get("/api/admin/profile")
 def get_user_profile(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_db_analytics),
     current_user = Depends(get_current_user) # 🔒 AUTH OBRIGATÓRIA
 ):
+    return responder_com_cache(
+        request, chave_cache_painel(current_user, "perfil"),
+        lambda: _calcular_user_profile(db, current_user)
+    )
+
+def _calcular_user_profile(db: Session, current_user):
     """
     Retorna dados do perfil, mas calcula estatísticas APENAS
     dos bots que pertencem ao usuário logado.
@@ -8677,6 +10535,8 @@ def get_audit_logs(
     end_date: Optional[str] = None,
     page: int = 1,
     per_page: int = 50,
+    cursor: Optional[str] = None,
+    count: str = "exact",
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
@@ -8692,6 +10552,8 @@ def get_audit_logs(
     - end_date: Data final (ISO format)
     - page: Página atual (padrão: 1)
     - per_page: Logs por página (padrão: 50, máx: 100)
+    - cursor: next_cursor da resposta anterior (substitui page)
+    - count: exact | estimate | none
     """
     try:
         # Limita per_page a 100
@@ -8733,11 +10595,13 @@ def get_audit_logs(
                 pass
         
         # Total de registros
-        total = query.count()
+        total = contar_total(db, query, count)
         
         # Paginação
-        offset = (page - 1) * per_page
-        logs = query.order_by(AuditLog.created_at.desc()).offset(offset).limit(per_page).all()
+        logs, next_cursor = paginar_keyset(
+            query, AuditLog.created_at, AuditLog.id, lambda l: (l.created_at, l.id),
+            per_page, cursor, page
+        )
         
         # Formata resposta
         logs_data = []
@@ -8772,9 +10636,12 @@ def get_audit_logs(
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page
+            "total_pages": total_de_paginas(total, per_page),
+            "next_cursor": next_cursor
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao buscar audit logs: {e}")
         raise HTTPException(status_code=500, detail="Erro ao buscar logs de auditoria")
@@ -8783,9 +10650,44 @@ def get_audit_logs(
 # 👑 ROTAS SUPER ADMIN (🆕 FASE 3.4)
 # =========================================================
 
+# Agregados por página: uma consulta agrupada para todos os usuários/bots
+# listados, em vez de COUNT/SUM por linha.
+def contar_bots_por_dono(db: Session, owners_ids: List[int]) -> Dict[int, int]:
+    if not owners_ids:
+        return {}
+    return dict(
+        db.query(BotModel.owner_id, func.count(BotModel.id))
+        .filter(BotModel.owner_id.in_(owners_ids))
+        .group_by(BotModel.owner_id).all()
+    )
+
+def vendas_por_dono(db: Session, owners_ids: List[int], status: List[str]) -> Dict[int, tuple]:
+    """{owner_id: (vendas, receita em reais)}"""
+    if not owners_ids:
+        return {}
+    linhas = db.query(
+        BotModel.owner_id, func.count(Pedido.id), func.coalesce(func.sum(Pedido.valor), 0)
+    ).join(Pedido, Pedido.bot_id == BotModel.id).filter(
+        BotModel.owner_id.in_(owners_ids),
+        Pedido.status.in_(status)
+    ).group_by(BotModel.owner_id).all()
+    return {owner_id: (vendas, float(receita)) for owner_id, vendas, receita in linhas}
+
+def vendas_por_bot(db: Session, bots_ids: List[int], status: List[str]) -> Dict[int, tuple]:
+    """{bot_id: (vendas, receita em reais)}"""
+    if not bots_ids:
+        return {}
+    linhas = db.query(
+        Pedido.bot_id, func.count(Pedido.id), func.coalesce(func.sum(Pedido.valor), 0)
+    ).filter(
+        Pedido.bot_id.in_(bots_ids),
+        Pedido.status.in_(status)
+    ).group_by(Pedido.bot_id).all()
+    return {bot_id: (vendas, float(receita)) for bot_id, vendas, receita in linhas}
+
 @app.get("/api/superadmin/stats")
 def get_superadmin_stats(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db_analytics),
     current_superuser = Depends(get_current_superuser)
 ):
     """
@@ -8810,13 +10712,10 @@ def get_superadmin_stats(
         active_bots = db.query(BotModel).filter(BotModel.status == 'ativo').count()
         inactive_bots = total_bots - active_bots
         
-        # Receita total do sistema
-        todas_vendas = db.query(Pedido).filter(
-            Pedido.status.in_(['approved', 'paid', 'active'])
-        ).all()
-        
-        total_revenue = sum(int(p.valor * 100) for p in todas_vendas)
-        total_sales = len(todas_vendas)
+        # Receita total do sistema (rollup diário)
+        totais = somar_metricas_diarias(db)
+        total_revenue = totais["revenue_cents"]
+        total_sales = totais["sales"]
         
         # Ticket médio do sistema
         avg_ticket = int(total_revenue / total_sales) if total_sales > 0 else 0
@@ -8836,20 +10735,18 @@ def get_superadmin_stats(
             desc(User.created_at)
         ).limit(5).all()
         
+        recent_ids = [u.id for u in recent_users]
+        bots_recentes = contar_bots_por_dono(db, recent_ids)
+        vendas_recentes = vendas_por_dono(db, recent_ids, ['approved', 'paid'])
+        
         recent_users_data = []
         for u in recent_users:
-            user_bots = db.query(BotModel).filter(BotModel.owner_id == u.id).count()
-            user_sales = db.query(Pedido).filter(
-                Pedido.bot_id.in_([b.id for b in u.bots]),
-                Pedido.status.in_(['approved', 'paid'])
-            ).count()
-            
             recent_users_data.append({
                 "id": u.id,
                 "username": u.username,
                 "email": u.email,
-                "total_bots": user_bots,
-                "total_sales": user_sales,
+                "total_bots": bots_recentes.get(u.id, 0),
+                "total_sales": vendas_recentes.get(u.id, (0, 0.0))[0],
                 "created_at": u.created_at.isoformat() if u.created_at else None
             })
         
@@ -8904,6 +10801,8 @@ def list_all_users(
     per_page: int = 50,
     search: str = None,
     status: str = None,
+    cursor: Optional[str] = None,
+    count: str = "exact",
     db: Session = Depends(get_db),
     current_superuser = Depends(get_current_superuser)
 ):
@@ -8915,6 +10814,8 @@ def list_all_users(
     - status: "active" ou "inactive"
     - page: Página atual (padrão: 1)
     - per_page: Usuários por página (padrão: 50, máx: 100)
+    - cursor: next_cursor da resposta anterior (substitui page)
+    - count: exact | estimate | none
     """
     try:
         from database import User
@@ -8942,33 +10843,23 @@ def list_all_users(
             query = query.filter(User.is_active == False)
         
         # Total de registros
-        total = query.count()
+        total = contar_total(db, query, count)
         
         # Paginação
-        offset = (page - 1) * per_page
-        users = query.order_by(User.created_at.desc()).offset(offset).limit(per_page).all()
+        users, next_cursor = paginar_keyset(
+            query, User.created_at, User.id, lambda u: (u.created_at, u.id),
+            per_page, cursor, page
+        )
+        
+        # Bots, receita e vendas de todos os usuários da página (2 consultas)
+        users_ids = [u.id for u in users]
+        bots_por_usuario = contar_bots_por_dono(db, users_ids)
+        vendas_por_usuario = vendas_por_dono(db, users_ids, ['approved'])
         
         # Formata resposta com estatísticas de cada usuário
         users_data = []
         for user in users:
-            # Busca bots do usuário
-            user_bots = db.query(BotModel).filter(BotModel.owner_id == user.id).all()
-            bot_ids = [b.id for b in user_bots]
-            
-            # Calcula receita e vendas
-            user_revenue = 0.0
-            user_sales = 0
-            
-            if bot_ids:
-                user_revenue = db.query(func.sum(Pedido.valor)).filter(
-                    Pedido.bot_id.in_(bot_ids),
-                    Pedido.status == 'approved'
-                ).scalar() or 0.0
-                
-                user_sales = db.query(Pedido).filter(
-                    Pedido.bot_id.in_(bot_ids),
-                    Pedido.status == 'approved'
-                ).count()
+            user_sales, user_revenue = vendas_por_usuario.get(user.id, (0, 0.0))
             
             users_data.append({
                 "id": user.id,
@@ -8978,7 +10869,7 @@ def list_all_users(
                 "is_active": user.is_active,
                 "is_superuser": user.is_superuser,
                 "created_at": user.created_at.isoformat() if user.created_at else None,
-                "total_bots": len(user_bots),
+                "total_bots": bots_por_usuario.get(user.id, 0),
                 "total_revenue": float(user_revenue),
                 "total_sales": user_sales
             })
@@ -8988,9 +10879,12 @@ def list_all_users(
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page
+            "total_pages": total_de_paginas(total, per_page),
+            "next_cursor": next_cursor
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao listar usuários: {e}")
         raise HTTPException(status_code=500, detail="Erro ao listar usuários")
@@ -9314,6 +11208,8 @@ def list_all_bots_system(
     per_page: int = 50,
     search: str = None,
     status: str = None,
+    cursor: Optional[str] = None,
+    count: str = "exact",
     db: Session = Depends(get_db),
     current_superuser = Depends(get_current_superuser)
 ):
@@ -9329,7 +11225,7 @@ def list_all_bots_system(
         if per_page > 100: per_page = 100
         
         # Query base: Traz Bots e junta com a tabela Users (para saber quem é o dono)
-        query = db.query(BotModel).join(User, BotModel.owner_id == User.id)
+        query = db.query(BotModel, User).join(User, BotModel.owner_id == User.id)
         
         # 🔍 Filtro de Busca (Nome do Bot, User do Bot ou Nome do Dono)
         if search:
@@ -9346,25 +11242,21 @@ def list_all_bots_system(
             query = query.filter(BotModel.status == status)
             
         # Contagem total para paginação
-        total = query.count()
+        total = contar_total(db, query, count)
         
         # Ordenação e Paginação
-        bots = query.order_by(BotModel.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
+        linhas, next_cursor = paginar_keyset(
+            query, BotModel.created_at, BotModel.id, lambda linha: (linha[0].created_at, linha[0].id),
+            per_page, cursor, page
+        )
+        
+        # Receita e vendas de todos os bots da página numa consulta agrupada
+        vendas_bots = vendas_por_bot(db, [bot.id for bot, _ in linhas], ['approved', 'paid'])
         
         # Formata a resposta
         bots_data = []
-        for bot in bots:
-            # Calcula receita total deste bot
-            receita = db.query(func.sum(Pedido.valor)).filter(
-                Pedido.bot_id == bot.id,
-                Pedido.status.in_(['approved', 'paid'])
-            ).scalar() or 0.0
-            
-            # Conta vendas
-            vendas = db.query(Pedido).filter(
-                Pedido.bot_id == bot.id,
-                Pedido.status.in_(['approved', 'paid'])
-            ).count()
+        for bot, dono in linhas:
+            vendas, receita = vendas_bots.get(bot.id, (0, 0.0))
 
             bots_data.append({
                 "id": bot.id,
@@ -9374,9 +11266,9 @@ def list_all_bots_system(
                 "created_at": bot.created_at.isoformat() if bot.created_at else None,
                 # Dados do Dono (Essencial para o Super Admin)
                 "owner": {
-                    "id": bot.owner.id,
-                    "username": bot.owner.username,
-                    "email": bot.owner.email
+                    "id": dono.id,
+                    "username": dono.username,
+                    "email": dono.email
                 },
                 # Métricas financeiras
                 "revenue": float(receita),
@@ -9388,9 +11280,12 @@ def list_all_bots_system(
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page
+            "total_pages": total_de_paginas(total, per_page),
+            "next_cursor": next_cursor
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao listar bots do sistema: {e}")
         raise HTTPException(status_code=500, detail="Erro ao buscar lista de bots")
@@ -9559,30 +11454,30 @@ async def impersonate_user(
 def startup_event():
     print("🚀 INICIANDO ZENYX GBOT (VERSÃO ATUALIZADA)...")
     
-    # 1. Garante tabelas básicas (SQLAlchemy)
-    Base.metadata.create_all(bind=engine)
-    
-    # 2. Executa as Migrações "Vacina" (Adiciona colunas novas sem perder dados)
-    try:
-        # Importamos aqui para evitar ciclo se estiver no topo
-        from force_migration import forcar_atualizacao_tabelas
-        from migration_v3 import executar_migracao_v3
-        from migration_v4 import executar_migracao_v4
-        from migration_v5 import executar_migracao_v5
-        from migration_v6 import executar_migracao_v6
-        from migration_v7 import executar_migracao_v7 # ✅ A NOVA MIGRAÇÃO
-        
-        print("💉 Aplicando vacinas de banco de dados...")
-        forcar_atualizacao_tabelas()
-        executar_migracao_v3()
-        executar_migracao_v4()
-        executar_migracao_v5()
-        executar_migracao_v6()
-        executar_migracao_v7() # ✅ Executa a criação da coluna id_canal_destino
-        
-        print("✅ Todas as migrações concluídas!")
-    except Exception as e:
-        print(f"⚠️ Aviso: Erro ao rodar migrações automáticas: {e}")
+    # 1. Primeira carga do rollup diário de métricas (uma vez por banco)
+    # Em segundo plano e sem travar a tabela: o startup não espera a agregação
+    def _backfill_rollup():
+        try:
+            linhas = backfill_se_pendente()
+            if linhas:
+                print(f"📊 Rollup diário preenchido com {linhas} linhas")
+        except Exception as e:
+            print(f"⚠️ Aviso: Erro no backfill do rollup diário: {e}")
+
+    # 2. Primeira carga da tabela de contatos (uma vez por banco, depois do rollup)
+    def _backfill_contatos():
+        try:
+            contatos = backfill_contatos_se_pendente()
+            if contatos:
+                print(f"👥 Tabela de contatos preenchida com {contatos} contatos")
+        except Exception as e:
+            print(f"⚠️ Aviso: Erro no backfill de contatos: {e}")
+
+    def _cargas_iniciais():
+        _backfill_rollup()
+        _backfill_contatos()
+
+    threading.Thread(target=_cargas_iniciais, daemon=True).start()
 
     # 3. Inicia o Scheduler (Tarefas agendadas)
     try:
@@ -9664,13 +11559,16 @@ def send_broadcast(broadcast: BroadcastSchema, request: Request, db: Session = D
 @app.get("/api/notifications")
 def get_notifications(
     limit: int = 20, 
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user) # <--- CORRIGIDO AQUI
 ):
-    """Retorna as notificações do usuário logado"""
-    notifs = db.query(Notification).filter(
-        Notification.user_id == current_user.id
-    ).order_by(desc(Notification.created_at)).limit(limit).all()
+    """Retorna as notificações do usuário logado (use next_cursor para as mais antigas)"""
+    notifs, next_cursor = paginar_keyset(
+        db.query(Notification).filter(Notification.user_id == current_user.id),
+        Notification.created_at, Notification.id, lambda n: (n.created_at, n.id),
+        min(limit, 100), cursor
+    )
     
     # Conta não lidas
     unread_count = db.query(Notification).filter(
@@ -9680,7 +11578,8 @@ def get_notifications(
     
     return {
         "notifications": notifs,
-        "unread_count": unread_count
+        "unread_count": unread_count,
+        "next_cursor": next_cursor
     }
 
 @app.put("/api/notifications/read-all")
@@ -9722,100 +11621,145 @@ def mark_one_read(
 # ========================================================================
 # ENDPOINTS PÚBLICOS PARA LANDING PAGE - CORRIGIDOS
 # ========================================================================
+# Cada visitante da landing batia no banco. Agora um job recalcula os dois
+# payloads a cada PUBLICO_SNAPSHOT_SEGUNDOS e guarda os bytes prontos (com
+# ETag); as rotas só devolvem o snapshot, sem abrir sessão.
+PUBLICO_SNAPSHOT_SEGUNDOS = int(os.getenv("PUBLICO_SNAPSHOT_SEGUNDOS", "10"))
+PUBLICO_CACHE_CONTROL = f"public, max-age={PUBLICO_SNAPSHOT_SEGUNDOS}, stale-while-revalidate={PUBLICO_SNAPSHOT_SEGUNDOS * 3}"
 
-@app.get("/api/public/activity-feed")
-def get_public_activity_feed(db: Session = Depends(get_db)):
+snapshots_publicos: Dict[str, tuple] = {}  # nome -> (etag, corpo)
+snapshots_publicos_lock = threading.Lock()
+
+def _calcular_feed_publico(db: Session):
     """
     Retorna atividades recentes (últimas 20) para exibir na landing page
-    SEM dados sensíveis (IDs de telegram ocultos, nomes parciais)
-    """
-    try:
-        # Import local para evitar erro de referência circular ou 'not defined'
-        from database import Pedido
-        
-        # Busca últimos 20 pedidos aprovados usando ORM
-        pedidos = db.query(Pedido).filter(
-            Pedido.status.in_(['approved', 'paid', 'active', 'expired'])
-        ).order_by(desc(Pedido.created_at)).limit(20).all()
-        
-        # Lista de nomes fictícios para privacidade
-        fake_names = [
-            "João P.", "Maria S.", "Carlos A.", "Ana C.", "Lucas F.",
-            "Patricia M.", "Rafael L.", "Julia O.", "Bruno N.", "Fernanda R.",
-            "Diego T.", "Amanda B.", "Ricardo G.", "Camila V.", "Felipe H.",
-            "Juliana K.", "Marcos E.", "Beatriz D.", "Gustavo W.", "Larissa Q."
-        ]
-        
-        activities = []
-        for idx, row in enumerate(pedidos):
-            # Usa um nome da lista de forma cíclica
-            name = fake_names[idx % len(fake_names)]
-            
-            # Define ação baseada no status
-            if row.status in ['approved', 'active', 'paid']:
-                action = 'ADICIONADO'
-                icon = '✅'
-            else:
-                action = 'REMOVIDO'
-                icon = '❌'
-            
-            activities.append({
-                "name": name,
-                "plan": row.plano_nome or "Plano VIP",
-                "price": float(row.valor) if row.valor else 0.0,
-                "action": action,
-                "icon": icon,
-                "timestamp": row.created_at.isoformat() if row.created_at else None
-            })
-        
-        return {"activities": activities}
-        
-    except Exception as e:
-        logger.error(f"❌ Erro ao buscar feed de atividades: {e}")
-        return {"activities": []}
+    SEM dados sensíveis (IDs de telegram ocultos, nomes parciais).
+    Erros sobem: o snapshot anterior continua servindo.
+    """
+    # Import local para evitar erro de referência circular ou 'not defined'
+    from database import Pedido
+    
+    # Busca últimos 20 pedidos aprovados usando ORM
+    pedidos = db.query(Pedido).filter(
+        Pedido.status.in_(['approved', 'paid', 'active', 'expired'])
+    ).order_by(desc(Pedido.created_at)).limit(20).all()
+    
+    # Lista de nomes fictícios para privacidade
+    fake_names = [
+        "João P.", "Maria S.", "Carlos A.", "Ana C.", "Lucas F.",
+        "Patricia M.", "Rafael L.", "Julia O.", "Bruno N.", "Fernanda R.",
+        "Diego T.", "Amanda B.", "Ricardo G.", "Camila V.", "Felipe H.",
+        "Juliana K.", "Marcos E.", "Beatriz D.", "Gustavo W.", "Larissa Q."
+    ]
+    
+    activities = []
+    for idx, row in enumerate(pedidos):
+        # Usa um nome da lista de forma cíclica
+        name = fake_names[idx % len(fake_names)]
+        
+        # Define ação baseada no status
+        if row.status in ['approved', 'active', 'paid']:
+            action = 'ADICIONADO'
+            icon = '✅'
+        else:
+            action = 'REMOVIDO'
+            icon = '❌'
+        
+        activities.append({
+            "name": name,
+            "plan": row.plano_nome or "Plano VIP",
+            "price": float(row.valor) if row.valor else 0.0,
+            "action": action,
+            "icon": icon,
+            "timestamp": row.created_at.isoformat() if row.created_at else None
+        })
+    
+    return {"activities": activities}
 
-@app.get("/api/public/stats")
-def get_public_platform_stats(db: Session = Depends(get_db)):
+def _calcular_stats_publicos(db: Session):
     """
     Retorna estatísticas gerais da plataforma (números públicos)
     """
-    try:
-        # Import local para garantir acesso aos modelos
-        from database import Bot, Pedido
-        
-        # Conta total de bots criados (Ativos)
-        total_bots = db.query(BotModel).filter(BotModel.status == 'ativo').count()
-        
-        # Conta total de pedidos aprovados
-        total_sales = db.query(Pedido).filter(
-            Pedido.status.in_(['approved', 'active', 'paid'])
-        ).count()
-        
-        # Soma receita total processada
-        total_revenue = db.query(func.sum(Pedido.valor)).filter(
-            Pedido.status.in_(['approved', 'active', 'paid'])
-        ).scalar()
-        
-        # Conta usuários ativos (Donos de Bots ativos)
-        active_users = db.query(BotModel.owner_id).filter(
-            BotModel.status == 'ativo'
-        ).distinct().count()
-        
-        return {
-            "total_bots": int(total_bots or 0),
-            "total_sales": int(total_sales or 0),
-            "total_revenue": float(total_revenue or 0.0),
-            "active_users": int(active_users or 0)
-        }
-        
-    except Exception as e:
-        logger.error(f"❌ Erro ao buscar estatísticas públicas: {e}")
-        return {
-            "total_bots": 0,
-            "total_sales": 0,
-            "total_revenue": 0.0,
-            "active_users": 0
-        }
+    # Import local para garantir acesso aos modelos
+    from database import Bot, Pedido
+    
+    # Conta total de bots criados (Ativos)
+    total_bots = db.query(BotModel).filter(BotModel.status == 'ativo').count()
+    
+    # Vendas e receita processada (rollup diário)
+    totais = somar_metricas_diarias(db)
+    total_sales = totais["sales"]
+    total_revenue = totais["revenue_cents"] / 100
+    
+    # Conta usuários ativos (Donos de Bots ativos)
+    active_users = db.query(BotModel.owner_id).filter(
+        BotModel.status == 'ativo'
+    ).distinct().count()
+    
+    return {
+        "total_bots": int(total_bots or 0),
+        "total_sales": int(total_sales or 0),
+        "total_revenue": float(total_revenue or 0.0),
+        "active_users": int(active_users or 0)
+    }
+
+SNAPSHOTS_PUBLICOS = {
+    "activity-feed": _calcular_feed_publico,
+    "stats": _calcular_stats_publicos,
+}
+
+def atualizar_snapshots_publicos(somente_faltando: bool = False):
+    """
+    Job: recalcula e troca os snapshots (o antigo segue servindo até lá).
+    Se o cálculo de um snapshot falhar, os bytes anteriores dele são mantidos.
+    Roda inteiro sob snapshots_publicos_lock: job e primeira requisição nunca
+    recalculam ao mesmo tempo.
+    """
+    with snapshots_publicos_lock:
+        if somente_faltando and all(nome in snapshots_publicos for nome in SNAPSHOTS_PUBLICOS):
+            return
+        db = SessionAnalytics()
+        try:
+            for nome, calcular in SNAPSHOTS_PUBLICOS.items():
+                try:
+                    corpo = serializar_json(calcular(db))
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"❌ [VITRINE] Erro ao atualizar snapshot '{nome}', mantendo o anterior: {e}")
+                    continue
+                snapshots_publicos[nome] = (etag_de(corpo), corpo)
+        finally:
+            db.close()
+
+# next_run_time: o primeiro snapshot sai na subida do scheduler, não 10s depois
+scheduler.add_job(
+    atualizar_snapshots_publicos,
+    'interval',
+    seconds=PUBLICO_SNAPSHOT_SEGUNDOS,
+    next_run_time=datetime.now(),
+    id='snapshots_publicos',
+    replace_existing=True
+)
+
+def responder_snapshot_publico(request: Request, nome: str) -> Response:
+    snapshot = snapshots_publicos.get(nome)
+    if snapshot is None:
+        # Requisição antes do primeiro job: só uma recalcula, as outras esperam o lock
+        atualizar_snapshots_publicos(somente_faltando=True)
+        snapshot = snapshots_publicos.get(nome)
+    if snapshot is None:
+        return JSONResponse(status_code=503, content={"detail": "Indisponível"}, headers={"Retry-After": "5"})
+    etag, corpo = snapshot
+    return resposta_json_com_etag(request, etag, corpo, PUBLICO_CACHE_CONTROL)
+
+@app.get("/api/public/activity-feed")
+def get_public_activity_feed(request: Request):
+    return responder_snapshot_publico(request, "activity-feed")
+
+@app.get("/api/public/stats")
+def get_public_platform_stats(request: Request):
+    """Estatísticas gerais da plataforma (números públicos)"""
+    return responder_snapshot_publico(request, "stats")
 
 @app.get("/")
 def home():
@@ -9867,72 +11811,19 @@ def limpar_leads_que_viraram_pedidos(db: Session = Depends(get_db)):
 # 💀 CRON JOB: REMOVEDOR DE USUÁRIOS VENCIDOS
 # =========================================================
 @app.get("/cron/check-expired")
-def cron_check_expired(db: Session = Depends(get_db)):
+async def cron_check_expired():
     """
-    Roda periodicamente para remover usuários com acesso vencido.
-    Deve ser chamado por um Cron Job externo (ex: Railway Cron ou EasyCron).
+    Mantido para crons externos antigos. A remoção de vencidos agora é feita
+    pelo motor de expiração; aqui apenas forçamos a recarga dos prazos.
     """
-    logger.info("💀 Iniciando verificação de vencidos...")
-    now = datetime.utcnow()
-    
-    # 1. Busca pedidos aprovados que JÁ venceram (data_expiracao < agora)
-    vencidos = db.query(Pedido).filter(
-        Pedido.status.in_(['approved', 'active']), # Apenas ativos
-        Pedido.data_expiracao != None,
-        Pedido.data_expiracao < now
-    ).all()
-    
-    removidos = 0
-    erros = 0
-    
-    for pedido in vencidos:
-        try:
-            bot_data = db.query(BotModel).filter(BotModel.id == pedido.bot_id).first()
-            if not bot_data: continue
-            
-            # Conecta no Telegram (Sem threads para evitar erro)
-            tb = telebot.TeleBot(bot_data.token, threaded=False)
-            
-            # Identifica o Canal
-            canal_id = bot_data.id_canal_vip
-            if str(canal_id).replace("-","").isdigit(): canal_id = int(str(canal_id).strip())
-            
-            # --- AÇÃO DE REMOÇÃO ---
-            try:
-                # Banir (Kick) e Desbanir (Kick remove do grupo, Unban permite voltar pagando)
-                tb.ban_chat_member(canal_id, int(pedido.telegram_id))
-                time.sleep(1) # Espera 1s para o Telegram processar
-                tb.unban_chat_member(canal_id, int(pedido.telegram_id))
-                
-                # Avisa o usuário no privado
-                try:
-                    tb.send_message(int(pedido.telegram_id), "🚫 <b>Seu acesso expirou!</b>\n\nObrigado por ter ficado conosco. Renove seu plano para voltar!", parse_mode="HTML")
-                except: pass
-                
-                logger.info(f"💀 Usuário {pedido.first_name} ({pedido.telegram_id}) removido do bot {bot_data.nome}")
-            except Exception as e_kick:
-                logger.warning(f"⚠️ Erro ao remover {pedido.telegram_id} (Talvez já saiu): {e_kick}")
-            
-            # Atualiza status no Pedido
-            pedido.status = 'expired'
-            
-            # Atualiza status no Lead (Sincronia)
-            lead = db.query(Lead).filter(Lead.bot_id == pedido.bot_id, Lead.user_id == pedido.telegram_id).first()
-            if lead:
-                lead.status = 'expired'
-            
-            removidos += 1
-            db.commit()
-            
-        except Exception as e:
-            logger.error(f"❌ Erro ao processar vencido {pedido.id}: {e}")
-            erros += 1
-
+    if expiracao_estado["evento"] is None:
+        return {"status": "starting"}
+    expiracao_estado["horizonte"] = None
+    expiracao_estado["evento"].set()
     return {
-        "status": "completed", 
-        "total_analisado": len(vencidos),
-        "removidos_sucesso": removidos, 
-        "erros": erros
+        "status": "scheduled",
+        "prazos_agendados": len(expiracao_prazos),
+        "metricas": expiracao_metricas
     }
 
 # =========================================================
@@ -10149,77 +12040,6 @@ def debug_users_list(db: Session = Depends(get_db)):
         return {"erro_fatal": str(e)}
 
 # =========================================================
-# 💀 CRON JOB: REMOVEDOR DE USUÁRIOS VENCIDOS
-# =========================================================
-@app.get("/cron/check-expired")
-def cron_check_expired(db: Session = Depends(get_db)):
-    """
-    Roda periodicamente para remover usuários com acesso vencido.
-    Deve ser chamado por um Cron Job externo (ex: Railway Cron ou EasyCron).
-    """
-    logger.info("💀 Iniciando verificação de vencidos...")
-    now = datetime.utcnow()
-    
-    # 1. Busca pedidos aprovados que JÁ venceram (data_expiracao < agora)
-    vencidos = db.query(Pedido).filter(
-        Pedido.status.in_(['approved', 'active']), # Apenas ativos
-        Pedido.data_expiracao != None,
-        Pedido.data_expiracao < now
-    ).all()
-    
-    removidos = 0
-    erros = 0
-    
-    for pedido in vencidos:
-        try:
-            bot_data = db.query(BotModel).filter(BotModel.id == pedido.bot_id).first()
-            if not bot_data: continue
-            
-            # Conecta no Telegram (Sem threads para evitar erro)
-            tb = telebot.TeleBot(bot_data.token, threaded=False)
-            
-            # Identifica o Canal
-            canal_id = bot_data.id_canal_vip
-            if str(canal_id).replace("-","").isdigit(): canal_id = int(str(canal_id).strip())
-            
-            # --- AÇÃO DE REMOÇÃO ---
-            try:
-                # Banir (Kick) e Desbanir (Kick remove do grupo, Unban permite voltar pagando)
-                tb.ban_chat_member(canal_id, int(pedido.telegram_id))
-                time.sleep(1) # Espera 1s para o Telegram processar
-                tb.unban_chat_member(canal_id, int(pedido.telegram_id))
-                
-                # Avisa o usuário no privado
-                try:
-                    tb.send_message(int(pedido.telegram_id), "🚫 <b>Seu acesso expirou!</b>\n\nObrigado por ter ficado conosco. Renove seu plano para voltar!", parse_mode="HTML")
-                except: pass
-                
-                logger.info(f"💀 Usuário {pedido.first_name} ({pedido.telegram_id}) removido do bot {bot_data.nome}")
-            except Exception as e_kick:
-                logger.warning(f"⚠️ Erro ao remover {pedido.telegram_id} (Talvez já saiu): {e_kick}")
-            
-            # Atualiza status no Pedido
-            pedido.status = 'expired'
-            
-            # Atualiza status no Lead (Sincronia)
-            lead = db.query(Lead).filter(Lead.bot_id == pedido.bot_id, Lead.user_id == pedido.telegram_id).first()
-            if lead:
-                lead.status = 'expired'
-            
-            removidos += 1
-            db.commit()
-            
-        except Exception as e:
-            logger.error(f"❌ Erro ao processar vencido {pedido.id}: {e}")
-            erros += 1
-
-    return {
-        "status": "completed", 
-        "total_analisado": len(vencidos),
-        "removidos_sucesso": removidos, 
-        "erros": erros
-    }
-# =========================================================
 # 🧹 FAXINA GERAL: REMOVE DUPLICATAS E CORRIGE DATAS
 # =========================================================
 @app.get("/api/admin/fix-duplicates-and-dates")
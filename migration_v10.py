@@ -0,0 +1,46 @@
+# =========================================================
+# 🔄 MIGRAÇÃO V10 - ÍNDICES DO MOTOR DE EXPIRAÇÃO
+# =========================================================
+
+import os
+import logging
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+def executar_migracao_v10():
+    """
+    Cria os índices (status, custom_expiration) e (status, data_expiracao)
+    em 'pedidos', usados pelo motor de expiração para carregar os prazos.
+    """
+    try:
+        # Pega a URL do ambiente
+        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+        # Ajuste para Railway (postgres:// -> postgresql://)
+        if DATABASE_URL.startswith("postgres://"):
+            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+        engine = create_engine(DATABASE_URL)
+        
+        logger.info("🔄 [MIGRAÇÃO V10] Verificando índices de expiração em pedidos...")
+        
+        indices = {
+            "ix_pedidos_status_custom_expiration": "(status, custom_expiration)",
+            "ix_pedidos_status_data_expiracao": "(status, data_expiracao)",
+        }
+        
+        with engine.connect() as conn:
+            for nome, colunas in indices.items():
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON pedidos {colunas};"))
+                conn.commit()
+                logger.info(f"   ✅ Índice '{nome}' verificado/criado com sucesso!")
+            
+            return True
+            
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            logger.info("ℹ️  [MIGRAÇÃO V10] Índices já existem.")
+            return True
+        else:
+            logger.error(f"❌ Erro na Migração V10: {e}")
+            return False
@@ -0,0 +1,48 @@
+# =========================================================
+# 🔄 MIGRAÇÃO V11 - SAÚDE DOS BOTS (QUARENTENA)
+# =========================================================
+
+import os
+import logging
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+def executar_migracao_v11():
+    """
+    Adiciona as colunas de saúde (quarentena automática) na tabela 'bots'.
+    """
+    try:
+        # Pega a URL do ambiente
+        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+        # Ajuste para Railway (postgres:// -> postgresql://)
+        if DATABASE_URL.startswith("postgres://"):
+            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+        engine = create_engine(DATABASE_URL)
+        
+        logger.info("🔄 [MIGRAÇÃO V11] Verificando colunas de saúde em 'bots'...")
+        
+        colunas = {
+            "saude_status": "VARCHAR DEFAULT 'ok'",
+            "saude_motivo": "VARCHAR",
+            "saude_falhas": "INTEGER DEFAULT 0",
+            "saude_desde": "TIMESTAMP WITHOUT TIME ZONE",
+            "saude_proxima_sonda": "TIMESTAMP WITHOUT TIME ZONE",
+        }
+        
+        with engine.connect() as conn:
+            for nome, tipo in colunas.items():
+                conn.execute(text(f"ALTER TABLE bots ADD COLUMN IF NOT EXISTS {nome} {tipo};"))
+                conn.commit()
+                logger.info(f"   ✅ Coluna '{nome}' verificada/adicionada com sucesso!")
+            
+            return True
+            
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            logger.info("ℹ️  [MIGRAÇÃO V11] Colunas já existem.")
+            return True
+        else:
+            logger.error(f"❌ Erro na Migração V11: {e}")
+            return False
@@ -0,0 +1,73 @@
+# =========================================================
+# 🔄 MIGRAÇÃO V14 - ÍNDICES DAS CONSULTAS QUENTES
+# =========================================================
+
+import os
+import logging
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+PREDICADO_VENDAS = "status IN ('paid', 'approved', 'active')"
+
+# nome: (tabela, colunas, WHERE do índice parcial)
+INDICES_V14 = {
+    "ix_pedidos_bot_telegram_status": ("pedidos", "(bot_id, telegram_id, status)", None),
+    "ix_pedidos_transaction_id": ("pedidos", "(transaction_id)", None),
+    "ix_pedidos_status_data_aprovacao": ("pedidos", "(status, data_aprovacao)", None),
+    "ix_pedidos_vendas_bot_aprovacao": ("pedidos", "(bot_id, data_aprovacao)", PREDICADO_VENDAS),
+    "ix_pedidos_vendas_bot_expiracao": ("pedidos", "(bot_id, data_expiracao)", PREDICADO_VENDAS),
+    "ix_leads_bot_user": ("leads", "(bot_id, user_id)", None),
+    "ix_leads_bot_created_at": ("leads", "(bot_id, created_at)", None),
+    "ix_remarketing_logs_bot_user_sent_at": ("remarketing_logs", "(bot_id, user_id, sent_at)", None),
+    "ix_bot_flow_steps_bot_order": ("bot_flow_steps", "(bot_id, step_order)", None),
+    "ix_tracking_links_folder_bot": ("tracking_links", "(folder_id, bot_id)", None),
+}
+
+def executar_migracao_v14():
+    """
+    Cria os índices compostos e parciais usados pelas consultas quentes
+    (pedidos, leads, remarketing_logs, bot_flow_steps e tracking_links).
+    No Postgres usa CREATE INDEX CONCURRENTLY para não travar as gravações.
+    """
+    try:
+        # Pega a URL do ambiente
+        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+        # Ajuste para Railway (postgres:// -> postgresql://)
+        if DATABASE_URL.startswith("postgres://"):
+            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+        engine = create_engine(DATABASE_URL)
+        postgres = engine.dialect.name == "postgresql"
+
+        logger.info("🔄 [MIGRAÇÃO V14] Verificando índices das consultas quentes...")
+
+        # CONCURRENTLY não roda dentro de transação
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for nome, (tabela, colunas, where) in INDICES_V14.items():
+                if postgres:
+                    # Um CONCURRENTLY interrompido deixa o índice inválido: recria
+                    invalido = conn.execute(text("""
+                        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = :nome AND NOT i.indisvalid
+                    """), {"nome": nome}).first()
+                    if invalido:
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome};"))
+
+                concorrente = "CONCURRENTLY " if postgres else ""
+                filtro = f" WHERE {where}" if where else ""
+                conn.execute(text(f"CREATE INDEX {concorrente}IF NOT EXISTS {nome} ON {tabela} {colunas}{filtro};"))
+                logger.info(f"   ✅ Índice '{nome}' verificado/criado com sucesso!")
+
+            if postgres:
+                conn.execute(text("ANALYZE pedidos, leads, remarketing_logs, bot_flow_steps, tracking_links;"))
+
+            return True
+
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            logger.info("ℹ️  [MIGRAÇÃO V14] Índices já existem.")
+            return True
+        else:
+            logger.error(f"❌ Erro na Migração V14: {e}")
+            return False
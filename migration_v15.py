@@ -0,0 +1,99 @@
+# =========================================================
+# 🔄 MIGRAÇÃO V15 - ÍNDICES DA PAGINAÇÃO POR CURSOR (KEYSET)
+# =========================================================
+
+import os
+import logging
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+# nome: (tabela, colunas) — mesma ordem do ORDER BY de paginar_keyset
+INDICES_V15 = {
+    "ix_notifications_user_created_id": ("notifications", "(user_id, created_at, id)"),
+    "ix_remarketing_campaigns_bot_envio_id": ("remarketing_campaigns", "(bot_id, data_envio, id)"),
+    "ix_users_created_id": ("users", "(created_at, id)"),
+}
+
+# Colunas de ordenação da paginação: um NULL no cursor cortaria a listagem.
+# Linhas antigas sem data recebem a menor data da tabela (ficam no fim da lista).
+COLUNAS_NAO_NULAS_V15 = {
+    "notifications": "created_at",
+    "remarketing_campaigns": "data_envio",
+    "users": "created_at",
+    "bots": "created_at",
+    "audit_logs": "created_at",
+}
+
+def _preencher_e_travar_nulos(conn, postgres: bool):
+    # contacts.lead_created_at fica nulo quando não há lead: só completa os que têm
+    conn.execute(text(
+        "UPDATE contacts SET lead_created_at = updated_at WHERE lead_id IS NOT NULL AND lead_created_at IS NULL"
+    ))
+    for tabela, coluna in COLUNAS_NAO_NULAS_V15.items():
+        conn.execute(text(f"""
+            UPDATE {tabela} SET {coluna} = COALESCE((SELECT MIN({coluna}) FROM {tabela}), CURRENT_TIMESTAMP)
+            WHERE {coluna} IS NULL
+        """))
+        if not postgres:
+            continue
+
+        # CHECK NOT VALID + VALIDATE não bloqueia gravações; com ele validado o
+        # SET NOT NULL dispensa a varredura da tabela (Postgres 12+)
+        restricao = f"ck_{tabela}_{coluna}_nao_nulo"
+        conn.execute(text(f"ALTER TABLE {tabela} DROP CONSTRAINT IF EXISTS {restricao};"))
+        conn.execute(text(f"ALTER TABLE {tabela} ADD CONSTRAINT {restricao} CHECK ({coluna} IS NOT NULL) NOT VALID;"))
+        conn.execute(text(f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {restricao};"))
+        conn.execute(text(f"ALTER TABLE {tabela} ALTER COLUMN {coluna} SET NOT NULL;"))
+        conn.execute(text(f"ALTER TABLE {tabela} DROP CONSTRAINT {restricao};"))
+        logger.info(f"   ✅ Coluna '{tabela}.{coluna}' agora é NOT NULL")
+
+def executar_migracao_v15():
+    """
+    Cria os índices (filtro, data, id) usados pela paginação por cursor de
+    notificações, campanhas de remarketing e usuários, e torna NOT NULL as
+    colunas de data que ordenam as listagens paginadas.
+    No Postgres usa CREATE INDEX CONCURRENTLY para não travar as gravações.
+    """
+    try:
+        # Pega a URL do ambiente
+        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+        # Ajuste para Railway (postgres:// -> postgresql://)
+        if DATABASE_URL.startswith("postgres://"):
+            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+        engine = create_engine(DATABASE_URL)
+        postgres = engine.dialect.name == "postgresql"
+
+        logger.info("🔄 [MIGRAÇÃO V15] Verificando índices da paginação por cursor...")
+
+        # CONCURRENTLY não roda dentro de transação
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            _preencher_e_travar_nulos(conn, postgres)
+
+            for nome, (tabela, colunas) in INDICES_V15.items():
+                if postgres:
+                    # Um CONCURRENTLY interrompido deixa o índice inválido: recria
+                    invalido = conn.execute(text("""
+                        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = :nome AND NOT i.indisvalid
+                    """), {"nome": nome}).first()
+                    if invalido:
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome};"))
+
+                concorrente = "CONCURRENTLY " if postgres else ""
+                conn.execute(text(f"CREATE INDEX {concorrente}IF NOT EXISTS {nome} ON {tabela} {colunas};"))
+                logger.info(f"   ✅ Índice '{nome}' verificado/criado com sucesso!")
+
+            if postgres:
+                conn.execute(text("ANALYZE notifications, remarketing_campaigns, users;"))
+
+            return True
+
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            logger.info("ℹ️  [MIGRAÇÃO V15] Índices já existem.")
+            return True
+        else:
+            logger.error(f"❌ Erro na Migração V15: {e}")
+            return False
@@ -0,0 +1,43 @@
+# =========================================================
+# 🔄 MIGRAÇÃO V8 - LATÊNCIA DO RETRY DE WEBHOOKS
+# =========================================================
+
+import os
+import logging
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+def executar_migracao_v8():
+    """
+    Adiciona a coluna 'last_latency_ms' na tabela 'webhook_retry'.
+    """
+    try:
+        # Pega a URL do ambiente
+        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+        # Ajuste para Railway (postgres:// -> postgresql://)
+        if DATABASE_URL.startswith("postgres://"):
+            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+        engine = create_engine(DATABASE_URL)
+        
+        logger.info("🔄 [MIGRAÇÃO V8] Verificando coluna last_latency_ms em 'webhook_retry'...")
+        
+        with engine.connect() as conn:
+            sql_coluna = """
+            ALTER TABLE webhook_retry 
+            ADD COLUMN IF NOT EXISTS last_latency_ms INTEGER;
+            """
+            conn.execute(text(sql_coluna))
+            conn.commit()
+            logger.info("   ✅ Coluna 'last_latency_ms' verificada/adicionada com sucesso!")
+            
+            return True
+            
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            logger.info("ℹ️  [MIGRAÇÃO V8] Coluna já existe.")
+            return True
+        else:
+            logger.error(f"❌ Erro na Migração V8: {e}")
+            return False
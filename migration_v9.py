@@ -0,0 +1,44 @@
+# =========================================================
+# 🔄 MIGRAÇÃO V9 - ÍNDICE DE RECONCILIAÇÃO DE PEDIDOS
+# =========================================================
+
+import os
+import logging
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+def executar_migracao_v9():
+    """
+    Cria o índice (status, created_at) em 'pedidos', usado pela
+    reconciliação de PIX pendentes.
+    """
+    try:
+        # Pega a URL do ambiente
+        DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+        # Ajuste para Railway (postgres:// -> postgresql://)
+        if DATABASE_URL.startswith("postgres://"):
+            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+        engine = create_engine(DATABASE_URL)
+        
+        logger.info("🔄 [MIGRAÇÃO V9] Verificando índice ix_pedidos_status_created_at...")
+        
+        with engine.connect() as conn:
+            sql_indice = """
+            CREATE INDEX IF NOT EXISTS ix_pedidos_status_created_at
+            ON pedidos (status, created_at);
+            """
+            conn.execute(text(sql_indice))
+            conn.commit()
+            logger.info("   ✅ Índice 'ix_pedidos_status_created_at' verificado/criado com sucesso!")
+            
+            return True
+            
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            logger.info("ℹ️  [MIGRAÇÃO V9] Índice já existe.")
+            return True
+        else:
+            logger.error(f"❌ Erro na Migração V9: {e}")
+            return False
@@ -0,0 +1,249 @@
+# =========================================================
+# 🧬 RUNNER DE MIGRAÇÕES VERSIONADAS (schema_version)
+# =========================================================
+# Cada migração tem versão, nome e checksum (SHA-256 do código da função).
+# A tabela schema_version guarda o que já foi aplicado; no startup, se a
+# versão gravada já é a última, basta UMA consulta e nada de DDL.
+#
+# Rodar antes do deploy (recomendado):
+#   python migrations.py              # aplica as pendentes
+#   python migrations.py --status     # lista aplicadas / pendentes
+#   python migrations.py --verificar  # sai com erro se houver pendência ou checksum divergente
+#
+# Nova migração: crie migration_vN.py com executar_migracao_vN() (retorna
+# False em caso de falha), com N igual à próxima versão, e acrescente no FIM
+# de MIGRACOES (as anteriores ao runner, v3 a v11, mantêm o nome antigo).
+# Modelo novo no database.py também precisa de uma entrada (por exemplo
+# chamando criar_tabelas_faltantes). Nunca altere uma já aplicada.
+
+import sys
+import time
+import zlib
+import inspect
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy import text
+
+from database import Base, engine, SessionJobs, SystemConfig
+
+logger = logging.getLogger(__name__)
+
+MIGRACOES_LOCK_ID = 724_001  # pg_advisory_lock: um worker migra, os outros esperam
+CARGAS_LOCK_CLASSE = 724_002  # pg_try_advisory_lock(classe, carga): um worker por carga de dados
+
+SQL_CRIAR_SCHEMA_VERSION = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        nome VARCHAR NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        aplicada_em TIMESTAMP NOT NULL,
+        duracao_ms INTEGER
+    )
+"""
+
+# ---------------------------------------------------------
+# Migrações (as antigas continuam nos seus módulos)
+# ---------------------------------------------------------
+def criar_tabelas_faltantes():
+    """Cria as tabelas dos modelos que ainda não existem (não altera as existentes)."""
+    Base.metadata.create_all(bind=engine)
+
+def _forcar_atualizacao_tabelas():
+    from force_migration import forcar_atualizacao_tabelas
+    forcar_atualizacao_tabelas()
+
+def _coluna_role_users():
+    with engine.connect() as conn:
+        conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS role VARCHAR DEFAULT 'USER'"))
+        conn.commit()
+
+def _importar(modulo: str, funcao: str):
+    def executar():
+        return getattr(__import__(modulo), funcao)()
+    executar.__name__ = funcao
+    executar.modulo = modulo
+    return executar
+
+# (versão, nome, função, só Postgres?)
+# As "só Postgres" usam ALTER ... IF NOT EXISTS; nos demais bancos o
+# create_all da versão 1 já cria tudo a partir dos modelos.
+MIGRACOES = [
+    (1, "estrutura_base", criar_tabelas_faltantes, False),
+    (2, "colunas_forcadas", _forcar_atualizacao_tabelas, True),
+    (3, "users_role", _coluna_role_users, True),
+    (4, "v3", _importar("migration_v3", "executar_migracao_v3"), True),
+    (5, "v4", _importar("migration_v4", "executar_migracao_v4"), True),
+    (6, "v5", _importar("migration_v5", "executar_migracao_v5"), True),
+    (7, "v6", _importar("migration_v6", "executar_migracao_v6"), True),
+    (8, "v7_canal_destino", _importar("migration_v7", "executar_migracao_v7"), True),
+    (9, "audit_logs", _importar("migration_audit_logs", "executar_migracao_audit_logs"), False),
+    (10, "v8_latencia_webhooks", _importar("migration_v8", "executar_migracao_v8"), True),
+    (11, "v9_indice_reconciliacao", _importar("migration_v9", "executar_migracao_v9"), True),
+    (12, "v10_indices_expiracao", _importar("migration_v10", "executar_migracao_v10"), True),
+    (13, "v11_saude_bots", _importar("migration_v11", "executar_migracao_v11"), True),
+    (14, "v14_indices_consultas_quentes", _importar("migration_v14", "executar_migracao_v14"), False),
+    (15, "v15_indices_paginacao_keyset", _importar("migration_v15", "executar_migracao_v15"), False),
+]
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+def checksum_migracao(funcao) -> str:
+    modulo = getattr(funcao, "modulo", None)
+    alvo = getattr(__import__(modulo), funcao.__name__) if modulo else funcao
+    return hashlib.sha256(inspect.getsource(alvo).encode("utf-8")).hexdigest()
+
+# ---------------------------------------------------------
+# Runner
+# ---------------------------------------------------------
+def versao_do_banco() -> int:
+    """A única consulta do caminho rápido. -1 se schema_version não existe."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        return -1
+
+def migracoes_aplicadas() -> dict:
+    with engine.connect() as conn:
+        conn.execute(text(SQL_CRIAR_SCHEMA_VERSION))
+        conn.commit()
+        linhas = conn.execute(text("SELECT version, nome, checksum, aplicada_em FROM schema_version")).all()
+    return {versao: (nome, checksum, aplicada_em) for versao, nome, checksum, aplicada_em in linhas}
+
+def _registrar(versao: int, nome: str, checksum: str, duracao_ms: int):
+    with engine.connect() as conn:
+        conn.execute(text("""
+            INSERT INTO schema_version (version, nome, checksum, aplicada_em, duracao_ms)
+            VALUES (:versao, :nome, :checksum, :agora, :duracao)
+        """), {"versao": versao, "nome": nome, "checksum": checksum, "agora": datetime.utcnow(), "duracao": duracao_ms})
+        conn.commit()
+
+def _aplicar_pendentes() -> int:
+    aplicadas = migracoes_aplicadas()
+    postgres = engine.dialect.name == "postgresql"
+    total = 0
+    for versao, nome, funcao, somente_postgres in MIGRACOES:
+        checksum = checksum_migracao(funcao)
+        if versao in aplicadas:
+            if aplicadas[versao][1] != checksum:
+                logger.warning(f"⚠️ [MIGRAÇÕES] v{versao} ({nome}) mudou depois de aplicada (checksum diferente)")
+            continue
+
+        inicio = time.monotonic()
+        if somente_postgres and not postgres:
+            logger.info(f"⏭️ [MIGRAÇÕES] v{versao} ({nome}) só se aplica ao Postgres")
+        else:
+            logger.info(f"🔄 [MIGRAÇÕES] Aplicando v{versao} ({nome})...")
+            if funcao() is False:
+                raise RuntimeError(f"Migração v{versao} ({nome}) falhou")
+        _registrar(versao, nome, checksum, int((time.monotonic() - inicio) * 1000))
+        total += 1
+    return total
+
+def aplicar_migracoes() -> int:
+    """
+    Aplica as migrações pendentes, em ordem. Se o banco já está na última
+    versão retorna 0 após uma única consulta. Retorna quantas foram aplicadas.
+    """
+    if versao_do_banco() >= VERSAO_ATUAL:
+        return 0
+
+    if engine.dialect.name != "postgresql":
+        return _aplicar_pendentes()
+
+    with engine.connect() as trava:
+        trava.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRACOES_LOCK_ID})
+        try:
+            # Outro worker pode ter migrado enquanto esperávamos a trava
+            if versao_do_banco() >= VERSAO_ATUAL:
+                return 0
+            return _aplicar_pendentes()
+        finally:
+            trava.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRACOES_LOCK_ID})
+            trava.commit()
+
+# ---------------------------------------------------------
+# Cargas de dados únicas (backfills disparados no startup)
+# ---------------------------------------------------------
+def carga_concluida(chave: str) -> bool:
+    db = SessionJobs()
+    try:
+        return db.query(SystemConfig.key).filter(SystemConfig.key == chave).first() is not None
+    finally:
+        db.close()
+
+def _marcar_carga_concluida(chave: str):
+    db = SessionJobs()
+    try:
+        db.merge(SystemConfig(key=chave, value=datetime.utcnow().isoformat(), updated_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+def executar_carga_unica(chave: str, funcao) -> int:
+    """
+    Roda `funcao` (um backfill) uma única vez por banco. O marcador `chave` em
+    system_config só é gravado se ela terminar sem erro; até lá cada subida
+    tenta de novo. No Postgres só um worker executa, os outros pulam.
+    Retorna o que a função retornou (0 se não rodou).
+    """
+    if carga_concluida(chave):
+        return 0
+
+    if engine.dialect.name != "postgresql":
+        total = funcao()
+        _marcar_carga_concluida(chave)
+        return total
+
+    carga_id = zlib.crc32(chave.encode("utf-8")) & 0x7FFFFFFF
+    with engine.connect() as trava:
+        obtida = trava.execute(
+            text("SELECT pg_try_advisory_lock(:classe, :carga)"), {"classe": CARGAS_LOCK_CLASSE, "carga": carga_id}
+        ).scalar()
+        trava.commit()
+        if not obtida:
+            logger.info(f"⏭️ [CARGAS] '{chave}' já está rodando em outro worker")
+            return 0
+        try:
+            # Outro worker pode ter concluído enquanto subíamos
+            if carga_concluida(chave):
+                return 0
+            total = funcao()
+            _marcar_carga_concluida(chave)
+            return total
+        finally:
+            trava.execute(text("SELECT pg_advisory_unlock(:classe, :carga)"), {"classe": CARGAS_LOCK_CLASSE, "carga": carga_id})
+            trava.commit()
+
+def status_migracoes() -> list:
+    aplicadas = migracoes_aplicadas()
+    resultado = []
+    for versao, nome, funcao, _ in MIGRACOES:
+        checksum = checksum_migracao(funcao)
+        if versao not in aplicadas:
+            situacao = "pendente"
+        elif aplicadas[versao][1] != checksum:
+            situacao = "checksum divergente"
+        else:
+            situacao = "aplicada"
+        resultado.append({
+            "versao": versao, "nome": nome, "situacao": situacao,
+            "aplicada_em": aplicadas[versao][2] if versao in aplicadas else None
+        })
+    return resultado
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--status" in sys.argv or "--verificar" in sys.argv:
+        problemas = 0
+        for m in status_migracoes():
+            if m["situacao"] != "aplicada":
+                problemas += 1
+            print(f"  v{m['versao']:<3} {m['nome']:<28} {m['situacao']:<20} {m['aplicada_em'] or ''}")
+        if "--verificar" in sys.argv and problemas:
+            print(f"❌ {problemas} migração(ões) pendente(s) ou divergente(s)")
+            sys.exit(1)
+    else:
+        print(f"🧬 Aplicando migrações (última versão: v{VERSAO_ATUAL})...")
+        aplicadas = aplicar_migracoes()
+        print(f"✅ {aplicadas} migração(ões) aplicada(s); banco em v{versao_do_banco()}")
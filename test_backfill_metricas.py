@@ -0,0 +1,90 @@
+"""
+Teste do backfill do rollup diário no startup: roda mesmo com a tabela já
+tendo linhas gravadas ao vivo, grava o marcador em system_config só quando
+termina sem erro e não roda de novo depois disso. Usa SQLite temporário.
+Execute com: python -m pytest test_backfill_metricas.py
+"""
+
+import os
+import tempfile
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/backfill_metricas.db")
+
+TOKEN = "559:backfill"
+
+
+def preparar_banco():
+    from database import Base, engine, SessionLocal, Bot, Pedido, Lead, DailyBotMetrics, SystemConfig
+    import backfill_metricas
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        antigo = db.query(Bot).filter(Bot.token == TOKEN).first()
+        if antigo:
+            db.query(Pedido).filter(Pedido.bot_id == antigo.id).delete()
+            db.query(Lead).filter(Lead.bot_id == antigo.id).delete()
+            db.query(DailyBotMetrics).filter(DailyBotMetrics.bot_id == antigo.id).delete()
+            db.delete(antigo)
+        db.query(SystemConfig).filter(SystemConfig.key == backfill_metricas.BACKFILL_METRICAS_CHAVE).delete()
+        db.commit()
+
+        bot = Bot(nome="Bot Backfill", token=TOKEN, id_canal_vip="-100559")
+        db.add(bot)
+        db.commit()
+        return bot.id
+    finally:
+        db.close()
+
+
+def leads_do_dia(bot_id, dia):
+    from database import SessionLocal, DailyBotMetrics
+    db = SessionLocal()
+    try:
+        linha = db.query(DailyBotMetrics).filter(DailyBotMetrics.bot_id == bot_id, DailyBotMetrics.day == dia).first()
+        return linha.leads if linha else 0
+    finally:
+        db.close()
+
+
+def test_backfill_roda_pelo_marcador_e_nao_pela_tabela_vazia(monkeypatch):
+    import main  # import tardio: registra o listener do rollup
+    import backfill_metricas
+    from sqlalchemy import text
+    from database import SessionLocal, Lead
+
+    bot_id = preparar_banco()
+    hoje = datetime.utcnow().date()
+    db = SessionLocal()
+    try:
+        db.add(Lead(bot_id=bot_id, user_id="301", nome="Antigo", status="topo"))
+        db.commit()
+        # Histórico anterior ao rollup: some da tabela, só o backfill recupera
+        db.execute(text("DELETE FROM daily_bot_metrics"))
+        db.commit()
+        # Evento ao vivo de outro worker antes do backfill: a tabela deixa de estar vazia
+        db.add(Lead(bot_id=bot_id, user_id="302", nome="Novo", status="topo"))
+        db.commit()
+    finally:
+        db.close()
+    assert leads_do_dia(bot_id, hoje) == 1
+
+    # Falha em um bot: nada de marcador, a próxima subida tenta de novo
+    original = backfill_metricas._calcular_metricas
+
+    def falhar(db, bots_ids=None):
+        raise RuntimeError("banco fora do ar")
+
+    monkeypatch.setattr(backfill_metricas, "_calcular_metricas", falhar)
+    try:
+        backfill_metricas.backfill_se_pendente()
+        assert False, "o backfill deveria falhar"
+    except RuntimeError:
+        pass
+    assert not backfill_metricas.carga_concluida(backfill_metricas.BACKFILL_METRICAS_CHAVE)
+
+    monkeypatch.setattr(backfill_metricas, "_calcular_metricas", original)
+    assert backfill_metricas.backfill_se_pendente() > 0
+    assert leads_do_dia(bot_id, hoje) == 2
+    assert backfill_metricas.carga_concluida(backfill_metricas.BACKFILL_METRICAS_CHAVE)
+    assert backfill_metricas.backfill_se_pendente() == 0
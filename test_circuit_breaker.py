@@ -0,0 +1,103 @@
+"""
+Teste das transições do circuit breaker da PushinPay:
+fechado → aberto (erro ou p95) → meio-aberto → fechado/aberto,
+p95 só com a janela cheia e sondagem cancelada que não trava o circuito.
+Execute com: python -m pytest test_circuit_breaker.py
+"""
+
+import os
+import asyncio
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/circuit_breaker.db")
+
+
+def novo_breaker():
+    import main  # import tardio: não fixa variáveis de ambiente de outros testes
+    return main.CircuitBreakerPushinPay("teste")
+
+
+def passar_tempo_aberto(breaker):
+    breaker.aberto_desde -= breaker.TEMPO_ABERTO_SEGUNDOS
+
+
+def test_abre_por_taxa_de_erro_e_fecha_com_sondagem_ok():
+    breaker = novo_breaker()
+    for _ in range(breaker.MINIMO_CHAMADAS - 1):
+        assert breaker.permitir()
+        breaker.registrar(False, 100)
+    assert breaker.estado == "fechado"
+
+    breaker.registrar(False, 100)
+    assert breaker.estado == "aberto"
+    assert not breaker.permitir()
+
+    passar_tempo_aberto(breaker)
+    assert breaker.permitir()
+    assert breaker.estado == "meio_aberto"
+    assert not breaker.permitir()  # uma sondagem por vez
+
+    breaker.registrar(True, 100)
+    assert breaker.estado == "fechado"
+    assert breaker.permitir()
+
+
+def test_abre_por_p95_e_reabre_com_sondagem_lenta():
+    breaker = novo_breaker()
+    lento = breaker.LIMITE_LENTO_MS + 1
+    # 1 lenta em 20 fica fora do p95
+    for _ in range(breaker.JANELA - 1):
+        breaker.registrar(True, 100)
+    breaker.registrar(True, lento)
+    assert breaker.estado == "fechado"
+
+    breaker.registrar(True, lento)
+    assert breaker.estado == "aberto"
+    assert breaker.taxa_erro() == 0
+
+    passar_tempo_aberto(breaker)
+    assert breaker.permitir()
+    breaker.registrar(True, lento)
+    assert breaker.estado == "aberto"
+    assert not breaker.permitir()
+
+
+def test_uma_chamada_lenta_com_janela_incompleta_nao_abre():
+    breaker = novo_breaker()
+    for _ in range(breaker.MINIMO_CHAMADAS - 1):
+        breaker.registrar(True, 100)
+    # Com 5 amostras o p95 seria a própria lenta
+    breaker.registrar(True, breaker.LIMITE_LENTO_MS + 1)
+    assert len(breaker.resultados) == breaker.MINIMO_CHAMADAS
+    assert breaker.latencia_p95() > breaker.LIMITE_LENTO_MS
+    assert breaker.estado == "fechado"
+    assert breaker.permitir()
+
+
+def test_sondagem_cancelada_libera_nova_sondagem(monkeypatch):
+    import main
+
+    class ClienteTravado:
+        async def post(self, *args, **kwargs):
+            await asyncio.sleep(3600)
+
+    monkeypatch.setattr(main, "http_client", ClienteTravado())
+    token = "token-cancelado"
+    breaker = main.obter_breaker_pushinpay(token)
+    breaker._abrir()
+    passar_tempo_aberto(breaker)
+
+    async def cancelar_sondagem():
+        tarefa = asyncio.create_task(main.chamar_pushinpay_cashin(token, {}))
+        await asyncio.sleep(0.01)
+        tarefa.cancel()
+        try:
+            await tarefa
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancelar_sondagem())
+
+    assert breaker.estado == "meio_aberto"
+    assert not breaker.sondagem_em_andamento
+    assert breaker.permitir()
@@ -0,0 +1,96 @@
+"""
+Teste: o webhook do Telegram não segura conexão do pool durante as chamadas
+à API do Telegram (TeleBotSemConexao + liberar_conexao). Usa SQLite temporário.
+Execute com: python -m pytest test_conexoes_telegram.py
+"""
+
+import os
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/conexoes.db")
+
+TOKEN = "555:conexao"
+CHAT_ID = 777
+
+
+def preparar_banco():
+    from database import Base, engine, SessionLocal, Bot, Pedido
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        antigo = db.query(Bot).filter(Bot.token == TOKEN).first()
+        if antigo:
+            db.query(Pedido).filter(Pedido.bot_id == antigo.id).delete()
+            db.delete(antigo)
+            db.commit()
+        bot = Bot(nome="Bot Conexão", token=TOKEN, id_canal_vip="-100777", status="ativo")
+        db.add(bot)
+        db.commit()
+        db.add(Pedido(
+            bot_id=bot.id, telegram_id=str(CHAT_ID), first_name="Cliente", valor=19.90,
+            status="paid", plano_nome="Mensal", txid="tx-conexao", transaction_id="tx-conexao",
+            data_aprovacao=datetime.utcnow(), data_expiracao=datetime.utcnow() + timedelta(days=30)
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+class RequisicaoFake:
+    def __init__(self, corpo):
+        self.corpo = corpo
+
+    async def json(self):
+        return self.corpo
+
+
+def test_status_nao_segura_conexao_durante_chamada_ao_telegram(monkeypatch):
+    import main  # import tardio: não fixa variáveis de ambiente de outros testes
+    from database import engine, SessionLocal
+
+    preparar_banco()
+    conexoes_em_uso = []
+
+    class TeleBotFake:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def send_message(self, *args, **kwargs):
+            conexoes_em_uso.append(engine.pool.checkedout())
+
+    monkeypatch.setattr(main.telebot, "TeleBot", TeleBotFake)
+
+    update = {
+        "update_id": 1,
+        "message": {
+            "message_id": 1, "date": 0, "text": "/status",
+            "chat": {"id": CHAT_ID, "type": "private"},
+            "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Cliente"},
+        },
+    }
+    db = SessionLocal()
+    try:
+        resultado = asyncio.run(main.receber_update_telegram(TOKEN, RequisicaoFake(update), db))
+    finally:
+        db.close()
+
+    assert resultado == {"status": "ok"}
+    assert conexoes_em_uso == [0]
+
+
+def test_liberar_conexao_nao_grava_alteracoes_pendentes():
+    import main
+    from database import SessionLocal, Bot
+
+    preparar_banco()
+    db = SessionLocal()
+    try:
+        bot = db.query(Bot).filter(Bot.token == TOKEN).first()
+        bot.nome = "Não gravar"
+        assert main.liberar_conexao(db) is False
+        db.rollback()
+        assert db.query(Bot.nome).filter(Bot.token == TOKEN).scalar() == "Bot Conexão"
+    finally:
+        db.close()
@@ -0,0 +1,119 @@
+"""
+Teste do listener que mantém a tabela contacts: só recalcula quando mudam
+colunas que alimentam o contato e, quando o telegram_id muda, recalcula a
+chave antiga também. Usa SQLite temporário, sem importar o main.
+Execute com: python -m pytest test_contatos.py
+"""
+
+import os
+import tempfile
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/contatos.db")
+
+TOKEN = "557:contatos"
+
+
+def preparar_banco():
+    from database import Base, engine, SessionLocal, Bot, Pedido, Lead, Contact
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        antigo = db.query(Bot).filter(Bot.token == TOKEN).first()
+        if antigo:
+            db.query(Pedido).filter(Pedido.bot_id == antigo.id).delete()
+            db.query(Lead).filter(Lead.bot_id == antigo.id).delete()
+            db.query(Contact).filter(Contact.bot_id == antigo.id).delete()
+            db.delete(antigo)
+            db.commit()
+        bot = Bot(nome="Bot Contatos", token=TOKEN, id_canal_vip="-100557")
+        db.add(bot)
+        db.commit()
+        return bot.id
+    finally:
+        db.close()
+
+
+def contatos_do_bot(bot_id):
+    from database import SessionLocal, Contact
+    db = SessionLocal()
+    try:
+        return {c.telegram_id: c.stage for c in db.query(Contact).filter(Contact.bot_id == bot_id)}
+    finally:
+        db.close()
+
+
+def test_listener_sincroniza_apenas_colunas_do_contato(monkeypatch):
+    import contatos
+    from database import SessionLocal, Pedido, Lead
+
+    bot_id = preparar_banco()
+    chamadas = []
+    original = contatos.sincronizar_contatos
+
+    def espiao(db, chaves):
+        chamadas.append(set(chaves))
+        return original(db, chaves)
+
+    monkeypatch.setattr(contatos, "sincronizar_contatos", espiao)
+
+    db = SessionLocal()
+    try:
+        lead = Lead(bot_id=bot_id, user_id="101", nome="Lead", status="topo")
+        db.add(lead)
+        db.commit()
+        assert chamadas == [{(bot_id, "101")}]
+        assert contatos_do_bot(bot_id) == {"101": "topo"}
+
+        # Caminho quente: não alimenta contacts
+        chamadas.clear()
+        lead.ultimo_contato = datetime.utcnow()
+        lead.total_remarketings = 3
+        db.commit()
+        assert chamadas == []
+
+        pedido = Pedido(
+            bot_id=bot_id, telegram_id="101", first_name="Lead", valor=9.90,
+            status="pending", transaction_id="tx-contatos"
+        )
+        db.add(pedido)
+        db.commit()
+        assert contatos_do_bot(bot_id) == {"101": "meio"}
+
+        # telegram_id corrigido: a chave antiga volta a refletir só o lead
+        chamadas.clear()
+        pedido.telegram_id = "202"
+        db.commit()
+        assert chamadas == [{(bot_id, "202"), (bot_id, "101")}]
+        assert contatos_do_bot(bot_id) == {"101": "topo", "202": "meio"}
+
+        db.delete(pedido)
+        db.commit()
+        assert contatos_do_bot(bot_id) == {"101": "topo"}
+    finally:
+        db.close()
+
+
+def test_primeira_carga_so_insere_os_que_faltam_e_roda_uma_vez():
+    import contatos
+    from sqlalchemy import text
+    from database import SessionLocal, Lead, SystemConfig
+
+    bot_id = preparar_banco()
+    db = SessionLocal()
+    try:
+        db.query(SystemConfig).filter(SystemConfig.key == contatos.BACKFILL_CONTATOS_CHAVE).delete()
+        db.add(Lead(bot_id=bot_id, user_id="401", nome="Com contato", status="topo"))
+        db.add(Lead(bot_id=bot_id, user_id="402", nome="Sem contato", status="topo"))
+        db.commit()
+        # 402 é anterior à tabela; 401 o listener mantém (etapa gravada ao vivo)
+        db.execute(text("DELETE FROM contacts WHERE bot_id = :b AND telegram_id = '402'"), {"b": bot_id})
+        db.execute(text("UPDATE contacts SET stage = 'meio' WHERE bot_id = :b AND telegram_id = '401'"), {"b": bot_id})
+        db.commit()
+    finally:
+        db.close()
+
+    assert contatos.backfill_contatos_se_pendente() >= 1
+    assert contatos_do_bot(bot_id) == {"401": "meio", "402": "topo"}
+    assert contatos.carga_concluida(contatos.BACKFILL_CONTATOS_CHAVE)
+    assert contatos.backfill_contatos_se_pendente() == 0
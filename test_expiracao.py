@@ -0,0 +1,39 @@
+"""
+Teste do motor de expiração: um lote que falha não perde os prazos, eles
+voltam ao heap com um pequeno atraso e são reprocessados. Usa SQLite temporário.
+Execute com: python -m pytest test_expiracao.py
+"""
+
+import os
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/expiracao.db")
+
+
+def test_lote_com_erro_volta_ao_heap_com_backoff(monkeypatch):
+    import main  # import tardio: não fixa variáveis de ambiente de outros testes
+
+    monkeypatch.setattr(main, "_agrupar_vencidos_por_bot", lambda ids: {1: list(ids)})
+
+    async def lote_com_erro(bot_id, pedido_ids):
+        raise RuntimeError("banco fora do ar")
+
+    monkeypatch.setattr(main, "_expirar_lote_bot", lote_com_erro)
+    monkeypatch.setattr(main, "expiracao_heap", [])
+    monkeypatch.setattr(main, "expiracao_prazos", {})
+    monkeypatch.setattr(main, "expiracao_estado", {
+        "horizonte": datetime.utcnow() + timedelta(hours=1), "loop": None, "evento": asyncio.Event()
+    })
+    # Pedido 8 foi reagendado enquanto o lote rodava: mantém o prazo novo
+    prazo_novo = datetime.utcnow() + timedelta(minutes=10)
+    main.expiracao_prazos[8] = prazo_novo
+
+    antes = datetime.utcnow()
+    asyncio.run(main.processar_vencidos([7, 8]))
+
+    assert main.expiracao_prazos[8] == prazo_novo
+    prazo_7 = main.expiracao_prazos[7]
+    assert prazo_7 >= antes + timedelta(seconds=main.EXPIRACAO_BACKOFF_SEGUNDOS)
+    assert (prazo_7, 7) in main.expiracao_heap
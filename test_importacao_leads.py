@@ -0,0 +1,111 @@
+"""
+Teste da importação de leads/assinantes por CSV (stream) num SQLite
+temporário: leads novos, assinatura ativa para quem tem expira_em no futuro,
+linhas inválidas reportadas e import_id isolado por conta.
+Execute com: python -m pytest test_importacao_leads.py
+"""
+
+import os
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/importacao.db")
+
+TOKEN = "558:importacao"
+
+
+def preparar_banco():
+    from database import Base, engine, SessionLocal, Bot, User, Pedido, Lead, Contact
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        antigo = db.query(Bot).filter(Bot.token == TOKEN).first()
+        if antigo:
+            db.query(Pedido).filter(Pedido.bot_id == antigo.id).delete()
+            db.query(Lead).filter(Lead.bot_id == antigo.id).delete()
+            db.query(Contact).filter(Contact.bot_id == antigo.id).delete()
+            db.delete(antigo)
+        db.query(User).filter(User.username == "importador").delete()
+        db.commit()
+
+        dono = User(username="importador", email="importador@teste.com", password_hash="x")
+        db.add(dono)
+        db.commit()
+        bot = Bot(nome="Bot Importação", token=TOKEN, id_canal_vip="-100558", owner_id=dono.id)
+        db.add(bot)
+        db.commit()
+        return dono.id, bot.id
+    finally:
+        db.close()
+
+
+class RequisicaoCSV:
+    def __init__(self, texto: str, tamanho: int = 7):
+        self.dados = texto.encode("utf-8")
+        self.tamanho = tamanho
+
+    async def stream(self):
+        # Pedaços pequenos: linhas quebradas entre chunks
+        for i in range(0, len(self.dados), self.tamanho):
+            yield self.dados[i:i + self.tamanho]
+
+
+class UsuarioFake:
+    def __init__(self, user_id, superuser=False):
+        self.id = user_id
+        self.is_superuser = superuser
+
+
+def test_importa_csv_pequeno_no_sqlite():
+    import main  # import tardio: não fixa variáveis de ambiente de outros testes
+    from database import SessionLocal, Pedido, Lead, Contact
+
+    dono_id, bot_id = preparar_banco()
+    futuro = (datetime.utcnow() + timedelta(days=10)).strftime("%Y-%m-%d")
+    csv_texto = (
+        "telegram_id,nome,username,plano,valor,expira_em\n"
+        f"1000001,Ana,@ana,VIP,\"29,90\",{futuro}\n"
+        "1000002,Bruno,bruno,,,\n"
+        "abc,Inválido,,,,\n"
+    )
+
+    db = SessionLocal()
+    try:
+        usuario = UsuarioFake(dono_id)
+        progresso = asyncio.run(main.importar_leads(bot_id, RequisicaoCSV(csv_texto), "lote-1", db, usuario))
+    finally:
+        db.close()
+
+    assert progresso["status"] == "concluida"
+    assert progresso["linhas_validas"] == 2
+    assert progresso["linhas_invalidas"] == 1
+    assert progresso["leads_novos"] == 2
+    assert progresso["assinaturas_novas"] == 1
+
+    db = SessionLocal()
+    try:
+        assert {l.user_id for l in db.query(Lead).filter(Lead.bot_id == bot_id)} == {"1000001", "1000002"}
+        pedido = db.query(Pedido).filter(Pedido.bot_id == bot_id).one()
+        assert pedido.telegram_id == "1000001" and pedido.status == "approved"
+        assert pedido.valor == 29.90
+        assert pedido.txid.startswith("import-") and "lote-1" not in pedido.txid
+        estagios = {c.telegram_id: c.stage for c in db.query(Contact).filter(Contact.bot_id == bot_id)}
+        assert estagios == {"1000001": "fundo", "1000002": "topo"}
+    finally:
+        db.close()
+
+    # import_id vale só dentro da conta de quem importou
+    assert main.status_importacao("lote-1", current_user=UsuarioFake(dono_id))["leads_novos"] == 2
+    try:
+        main.status_importacao("lote-1", current_user=UsuarioFake(dono_id + 1))
+        assert False, "outra conta não deveria ver a importação"
+    except main.HTTPException as e:
+        assert e.status_code == 404
+
+    # Terminada e fora da retenção: sai da memória
+    main.importacoes_leads[(dono_id, "lote-1")]["finalizada_em"] = datetime.utcnow() - timedelta(
+        seconds=main.IMPORTACAO_RETENCAO_SEGUNDOS + 1
+    )
+    main._limpar_importacoes_terminadas()
+    assert (dono_id, "lote-1") not in main.importacoes_leads
@@ -0,0 +1,119 @@
+"""
+Teste da reconciliação de PIX pendentes contra um servidor PushinPay local.
+Sobe um stand-in HTTP em thread, aponta PUSHINPAY_API_URL para ele e usa um
+SQLite temporário. Execute com: python -m pytest test_reconciliacao.py
+"""
+
+import os
+import json
+import asyncio
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# =========================================================
+# 🧪 STAND-IN DA PUSHINPAY
+# =========================================================
+TRANSACOES = {
+    "tx-pago": {"id": "tx-pago", "status": "paid", "value": 1990},
+    "tx-aguardando": {"id": "tx-aguardando", "status": "created", "value": 1990},
+}
+consultas = []
+
+class PushinPayFake(BaseHTTPRequestHandler):
+    def do_GET(self):
+        consultas.append(self.path)
+        tx_id = self.path.rsplit("/", 1)[-1]
+        if not self.path.startswith("/api/transactions/") or tx_id not in TRANSACOES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        corpo = json.dumps(TRANSACOES[tx_id]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+servidor = HTTPServer(("127.0.0.1", 0), PushinPayFake)
+threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+os.environ["PUSHINPAY_API_URL"] = f"http://127.0.0.1:{servidor.server_port}/api"
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/reconciliacao.db"
+
+import main  # noqa: E402  (precisa das variáveis acima)
+from database import Base, engine, SessionLocal, Bot, Pedido  # noqa: E402
+
+
+class TeleBotFake:
+    """Evita chamadas reais ao Telegram durante a entrega do acesso."""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, nome):
+        def chamada(*args, **kwargs):
+            raise RuntimeError("telegram desativado no teste")
+        return chamada
+
+
+def preparar_banco():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db.query(Pedido).delete()
+        db.query(Bot).delete()
+        bot = Bot(nome="Bot Teste", token="123:abc", id_canal_vip="-100123", pushin_token="token-bot")
+        db.add(bot)
+        db.commit()
+
+        criado = datetime.utcnow() - timedelta(minutes=10)
+        for tx_id in ("tx-pago", "tx-aguardando", "tx-desconhecido"):
+            db.add(Pedido(
+                bot_id=bot.id, telegram_id="999", first_name="Cliente",
+                valor=19.90, status="pending", transaction_id=tx_id, created_at=criado
+            ))
+        # Fora da janela: não deve ser consultado
+        db.add(Pedido(
+            bot_id=bot.id, telegram_id="999", first_name="Antigo", valor=19.90,
+            status="pending", transaction_id="tx-antigo",
+            created_at=datetime.utcnow() - timedelta(hours=main.RECONCILIACAO_JANELA_HORAS + 1)
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def status_do_pedido(tx_id):
+    db = SessionLocal()
+    try:
+        return db.query(Pedido).filter(Pedido.transaction_id == tx_id).first().status
+    finally:
+        db.close()
+
+
+def test_reconciliacao_aprova_apenas_pedidos_pagos(monkeypatch):
+    monkeypatch.setattr(main.telebot, "TeleBot", TeleBotFake)
+    preparar_banco()
+    consultas.clear()
+
+    aprovados = asyncio.run(main.reconciliar_pedidos_pendentes())
+
+    assert aprovados == 1
+    assert status_do_pedido("tx-pago") == "approved"
+    assert status_do_pedido("tx-aguardando") == "pending"
+    assert status_do_pedido("tx-desconhecido") == "pending"
+    assert status_do_pedido("tx-antigo") == "pending"
+    assert not any(c.endswith("/tx-antigo") for c in consultas)
+
+
+def test_reconciliacao_nao_conta_pedido_ja_pago_pelo_webhook(monkeypatch):
+    preparar_banco()
+
+    async def webhook_chegou_antes(request, db):
+        return {"status": "ok", "msg": "Already paid"}
+
+    monkeypatch.setattr(main, "webhook_pix", webhook_chegou_antes)
+    assert asyncio.run(main.reconciliar_pedidos_pendentes()) == 0
@@ -0,0 +1,119 @@
+"""
+Teste: o reprocessamento de webhooks roda os itens do lote de verdade em
+paralelo. O TeleBot falso bloqueia (time.sleep) como a API real; se a entrega
+rodasse no loop, os envios nunca se sobreporiam. Um {"status": "error"}
+devolvido pelo handler conta como falha. Usa SQLite temporário.
+Execute com: python -m pytest test_retry_webhooks.py
+"""
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/retry_webhooks.db")
+
+TOKEN = "556:retry"
+ITENS = 4
+ATRASO = 0.3
+
+
+def preparar_banco():
+    from database import Base, engine, SessionLocal, Bot, Pedido, WebhookRetry
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db.query(WebhookRetry).delete()
+        antigo = db.query(Bot).filter(Bot.token == TOKEN).first()
+        if antigo:
+            db.query(Pedido).filter(Pedido.bot_id == antigo.id).delete()
+            db.delete(antigo)
+        db.commit()
+
+        bot = Bot(nome="Bot Retry", token=TOKEN, id_canal_vip="-100556", status="ativo")
+        db.add(bot)
+        db.commit()
+        for i in range(ITENS):
+            tx_id = f"tx-retry-{i}"
+            db.add(Pedido(
+                bot_id=bot.id, telegram_id=str(9000 + i), first_name="Cliente", valor=19.90,
+                status="pending", plano_nome="Mensal", transaction_id=tx_id,
+                created_at=datetime.utcnow() - timedelta(minutes=5)
+            ))
+            db.add(WebhookRetry(
+                webhook_type="pushinpay", payload=json.dumps({"id": tx_id, "status": "paid"}),
+                attempts=0, max_attempts=5, status="pending", reference_id=tx_id
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_lote_de_retries_processa_itens_em_paralelo(monkeypatch):
+    import main  # import tardio: não fixa variáveis de ambiente de outros testes
+    from database import SessionLocal, WebhookRetry
+
+    preparar_banco()
+    trava = threading.Lock()
+    estado = {"em_andamento": 0, "maximo": 0}
+
+    class Convite:
+        invite_link = "https://t.me/+convite"
+
+    class TeleBotLento:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getattr__(self, nome):
+            def chamada(*args, **kwargs):
+                with trava:
+                    estado["em_andamento"] += 1
+                    estado["maximo"] = max(estado["maximo"], estado["em_andamento"])
+                time.sleep(ATRASO)
+                with trava:
+                    estado["em_andamento"] -= 1
+                return Convite()
+            return chamada
+
+    monkeypatch.setattr(main.telebot, "TeleBot", TeleBotLento)
+
+    inicio = time.monotonic()
+    asyncio.run(main.processar_webhooks_pendentes())
+    duracao = time.monotonic() - inicio
+
+    db = SessionLocal()
+    try:
+        status = [s for (s,) in db.query(WebhookRetry.status).all()]
+    finally:
+        db.close()
+
+    assert status == ["success"] * ITENS
+    assert estado["maximo"] > 1
+    # Em série seriam ITENS × (desbanir + convite + mensagem) × ATRASO
+    assert duracao < ITENS * 3 * ATRASO
+
+
+def test_status_error_do_handler_conta_como_falha(monkeypatch):
+    import main
+    from database import SessionLocal, WebhookRetry
+
+    preparar_banco()
+
+    async def webhook_com_erro(request, db):
+        # Mesmo retorno do except externo de webhook_pix (ex.: SELECT do pedido falhou)
+        return {"status": "error"}
+
+    monkeypatch.setattr(main, "webhook_pix", webhook_com_erro)
+    asyncio.run(main.processar_webhooks_pendentes())
+
+    db = SessionLocal()
+    try:
+        itens = db.query(WebhookRetry).all()
+    finally:
+        db.close()
+
+    assert {i.status for i in itens} == {"pending"}
+    assert all(i.attempts == 1 and i.last_error and i.next_retry for i in itens)